@@ -1,28 +1,76 @@
 import logging
 import tweepy
-from db_manager import get_account, insert_account, update_account, get_db_connection, reset_messages  # 追加
+import requests
+from db_manager import get_account, get_accounts, insert_account, update_account, get_db_connection, reset_messages, get_account_stats
+
+logger = logging.getLogger(__name__)
 
 clients = {}
+client_credentials = {}  # アカウントごとのクライアント作成時の認証情報
+client_stats = {'built': 0, 'reused': 0}
+media_apis = {}  # アカウントごとの画像アップロード用の tweepy.API（認証情報, API）
 
-def load_account(account_id):
+def _credentials(account):
+    return (account['bearer_token'], account['consumer_api_key'], account['consumer_api_secret'],
+            account['access_token'], account['access_token_secret'])
+
+# アカウントのTwitterクライアントを取得（初めて使うときと認証情報が変わったときだけ作成する）
+def get_client(account_id):
+    account = get_account(account_id)
+    if not account:
+        logger.error("アカウントが見つかりません: アカウントID %s", account_id)
+        return None
+
+    # 認証情報が変わっていなければ既存のクライアントを使う
+    client = clients.get(account_id)
+    if client is not None and client_credentials.get(account_id) == _credentials(account):
+        client_stats['reused'] += 1
+        return client
+    try:
+        client = tweepy.Client(
+            bearer_token=account['bearer_token'],
+            consumer_key=account['consumer_api_key'],
+            consumer_secret=account['consumer_api_secret'],
+            access_token=account['access_token'],
+            access_token_secret=account['access_token_secret'],
+            return_type=requests.Response  # レート制限ヘッダーを読むため
+        )
+        clients[account_id] = client
+        client_credentials[account_id] = _credentials(account)
+        client_stats['built'] += 1
+        logger.debug("Twitterクライアントの初期化に成功しました: アカウント %s", account_id)
+        return client
+    except Exception as e:
+        logger.error("Twitterクライアントの初期化中にエラーが発生しました: アカウント %s: %s", account_id, e)
+        return None
+
+# 画像アップロード（v1.1 の media/upload）用の tweepy.API を取得（認証情報が変わったら作り直す）
+def get_media_api(account_id):
     account = get_account(account_id)
-    logging.debug(f"アカウントを読み込みました: {account}")
+    if not account:
+        logger.error("アカウントが見つかりません: アカウントID %s", account_id)
+        return None
+    credentials = _credentials(account)
+    cached = media_apis.get(account_id)
+    if cached is not None and cached[0] == credentials:
+        return cached[1]
+    auth = tweepy.OAuth1UserHandler(
+        account['consumer_api_key'], account['consumer_api_secret'],
+        account['access_token'], account['access_token_secret']
+    )
+    api = tweepy.API(auth)
+    media_apis[account_id] = (credentials, api)
+    return api
 
-    if account:
-        try:
-            client = tweepy.Client(
-                bearer_token=account['bearer_token'],
-                consumer_key=account['consumer_api_key'],
-                consumer_secret=account['consumer_api_secret'],
-                access_token=account['access_token'],
-                access_token_secret=account['access_token_secret']
-            )
-            clients[account_id] = client
-            logging.debug(f"Twitterクライアントの初期化に成功しました: アカウント {account_id}")
-        except Exception as e:
-            logging.error(f"Twitterクライアントの初期化中にエラーが発生しました: アカウント {account_id}: {e}")
-    else:
-        logging.error(f"アカウントが見つかりません: アカウントID {account_id}")
+# アップロードした画像を使えるユーザーを表すキー
+# （アクセストークンは "ユーザーID-..." の形式なので、ユーザーIDが分かれば他のアカウントと共有できる）
+def get_media_owner(account):
+    user_id = account['access_token'].split('-', 1)[0]
+    return user_id if user_id.isdigit() else f"account:{account['id']}"
+
+def load_account(account_id):
+    logger.debug("アカウントを読み込みました: アカウント %s", account_id)
+    get_client(account_id)
 
 def register_account(name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret):
     insert_account(name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret)
@@ -36,31 +84,15 @@ def get_all_account_ids():
     cursor = conn.cursor()
     cursor.execute('SELECT id FROM accounts')
     account_ids = [row['id'] for row in cursor.fetchall()]
-    conn.close()
     return account_ids
 
-def get_accounts():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM accounts")
-    accounts = cursor.fetchall()
-    conn.close()
-    return accounts
-
 def get_current_account(account_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM accounts WHERE id = ?", (account_id,))
-    current_account = cursor.fetchone()
-    conn.close()
-    return current_account
+    return get_account(account_id)
 
 def reset_account_messages(account_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM tweets WHERE is_deleted = 0 AND account_id = ?", (account_id,))
-    count_not_deleted = cursor.fetchone()[0]
-    if count_not_deleted == 0:
+    # 未投稿の件数は集計テーブルから取得する（メッセージが1件もなければリセットしない）
+    stats = get_account_stats(account_id)
+    if stats['total'] > 0 and stats['remaining'] == 0:
         reset_messages(account_id)
         return True
     return False
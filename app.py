@@ -1,23 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, session
 import os
 import logging
 from dotenv import load_dotenv
 from db_manager import (
     get_db_connection, get_all_account_ids, get_settings, get_auto_post_status, get_message,
     reset_messages, insert_message, set_interval, update_auto_post_status,
-    get_messages, delete_message, update_message, delete_all_messages,
-    get_tweets  # 追加
+    get_messages, delete_message, update_message, delete_all_messages, copy_messages,
+    get_tweets, get_latest_change_seq, get_message_changes, get_account_stats, get_account, sync_caches
 )
-from csv_manager import insert_messages_from_csv, upload_csv
+from csv_manager import insert_messages_from_csv, upload_csv, get_import_jobs
+from migrations import run_migrations
 from account_manager import (
     load_account, register_account, edit_account, clients, get_all_account_ids,
-    get_accounts, get_current_account, reset_account_messages
+    get_accounts, get_current_account, reset_account_messages, client_stats
 )
+from cache_manager import get_cache_stats
+from log_manager import setup_logging
+from change_feed import stream_events, change_feed
+from history_manager import get_post_history, get_post_summary
+from media_manager import prepare_media, list_media_files, MediaError
+from metrics import render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
 from post_setting_manager import (
-    load_settings, load_auto_post_status, set_interval_route, start_auto_post, stop_auto_post,
-    check_and_start_auto_post, load_account_settings_and_status  # 追加
+    set_interval_route, start_auto_post, stop_auto_post,
+    start_auto_post_scheduler, load_account_settings_and_status  # 追加
 )
-from post_manager import update_auto_post_schedule, auto_post_threads  # 追加
+from post_manager import update_auto_post_schedule, cancel_auto_post_schedule, get_post_metrics, get_rate_limit_status
+
+logger = logging.getLogger(__name__)
 
 # 環境変数の読み込み
 load_dotenv()
@@ -25,50 +34,73 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('APP_SECRET_KEY')
 
-# ログ設定
-LOG_FILENAME = 'app.log'
-logging.basicConfig(filename=LOG_FILENAME, level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
-
-# グローバル変数の初期化
-reset_flag = False
-current_account_id = None
+# `python app.py` で起動すると、取り込み用のプロセス（spawn）はこのファイルを __mp_main__ として読み込み直す
+# そのプロセスではログの設定やマイグレーションを行わない
+IS_WORKER_PROCESS = __name__ == '__mp_main__'
 
-# アカウントごとのデータを管理する辞書
-account_settings = {}   # アカウントごとの設定
-is_auto_posting = {}    # アカウントごとの自動投稿状態
+# ログ設定（JSON形式でキュー経由で書き込む。レベルは LOG_LEVEL / LOG_LEVELS で指定）
+LOG_FILENAME = 'app.log'
+if not IS_WORKER_PROCESS:
+    setup_logging(LOG_FILENAME)
+
+MESSAGES_PAGE_SIZE = 100  # メッセージ一覧の1ページあたりの件数
+MAX_MESSAGES_PAGE_SIZE = 500
+
+# 選択中のアカウントやリセットの通知はセッションに、設定や自動投稿の状態はDBに保存する
+# （プロセス内に状態を持たないので、複数のワーカープロセスで動かせる）
+
+# 他のプロセスでの書き込みをキャッシュに反映する
+@app.before_request
+def sync_caches_before_request():
+    sync_caches()
+
+# 最初のリクエストでスケジューラのリーダー選出を開始する（importしただけでは投稿しない）
+@app.before_request
+def start_auto_post_scheduler_before_request():
+    start_auto_post_scheduler()
+
+# セッションから選択中のアカウントIDを取得（未選択や削除済みなら最初のアカウントを選択）
+def get_current_account_id():
+    account_id = session.get('account_id')
+    if account_id is not None and get_account(account_id):
+        return account_id
+    accounts = get_accounts()
+    if not accounts:
+        return None
+    session['account_id'] = accounts[0]['id']
+    load_account(session['account_id'])
+    return session['account_id']
 
 # Flaskルート（省略せずに記載します）
 
 @app.route('/')
 def index():
-    global current_account_id, reset_flag
-
     # アカウント一覧を取得
     accounts = get_accounts()
+    current_account_id = get_current_account_id()
 
     if current_account_id:
-        is_posting, interval, specific_times, interval_type = load_account_settings_and_status(current_account_id, account_settings, is_auto_posting)
+        is_posting, interval, specific_times, interval_type = load_account_settings_and_status(current_account_id)
     else:
-        # 最初のアカウントをデフォルトとして選択
-        if accounts:
-            current_account_id = accounts[0]['id']
-            load_account(current_account_id)
-            is_posting, interval, specific_times, interval_type = load_account_settings_and_status(current_account_id, account_settings, is_auto_posting)
-        else:
-            is_posting = False
-            interval = None
-            specific_times = []
-            interval_type = 'interval'
+        is_posting = False
+        interval = None
+        specific_times = []
+        interval_type = 'interval'
 
     # 現在のアカウント情報を取得
     current_account = get_current_account(current_account_id)
 
     # 全ての is_deleted フラグが1になった場合、全てのフラグを0にリセット
+    # （他の画面には /events の restored で知らせる）
     if reset_account_messages(current_account_id):
         flash("メッセージリストがリセットされました")
-        reset_flag = True  # リセットフラグを立てる
 
-    messages = get_tweets(current_account_id)
+    queue_stats = get_account_stats(current_account_id)
+
+    # 最初のページだけを表示し、残りは画面側で読み込む
+    changes_cursor = get_latest_change_seq(current_account_id)
+    messages = get_messages(current_account_id, limit=MESSAGES_PAGE_SIZE)
+    next_after_id = messages[-1]['id'] if len(messages) == MESSAGES_PAGE_SIZE else None
 
     current_setting = f"時間間隔: {interval}時間" if interval_type == 'interval' else f"時間指定: {', '.join(specific_times)}"
 
@@ -78,22 +110,23 @@ def index():
         current_account_id=current_account_id,
         current_account=current_account,
         messages=messages,
+        next_after_id=next_after_id,
+        changes_cursor=changes_cursor,
+        queue_stats=queue_stats,
         interval=interval,
         specific_times=specific_times,
         is_auto_posting=is_posting,
         current_setting=current_setting,
-        interval_type=interval_type
+        interval_type=interval_type,
+        media_files=list_media_files()
     )
 
 @app.route('/select_account', methods=['POST'])
 def select_account():
-    global current_account_id
     account_id = int(request.form['account_id'])
-    current_account_id = account_id
+    session['account_id'] = account_id
 
     load_account(account_id)
-    load_settings(account_id, account_settings)
-    load_auto_post_status(account_id, is_auto_posting)
 
     return redirect(url_for('index'))
 
@@ -110,12 +143,13 @@ def register_account_route():
         register_account(name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret)
         flash("新しいアカウントが登録されました")
     except Exception as e:
-        logging.error(f"アカウント登録中にエラーが発生しました: {e}")
+        logger.error("アカウント登録中にエラーが発生しました: %s", e)
         flash("アカウント登録中にエラーが発生しました")
     return redirect(url_for('index'))
 
 @app.route('/edit_account', methods=['POST'])
 def edit_account_route():
+    current_account_id = get_current_account_id()
     try:
         name = request.form['name']
         consumer_api_key = request.form['consumer_api_key']
@@ -124,83 +158,162 @@ def edit_account_route():
         access_token = request.form['access_token']
         access_token_secret = request.form['access_token_secret']
 
-        logging.debug(f"アカウント編集 - 名前: {name}, Consumer API Key: {consumer_api_key}, Consumer API Secret: {consumer_api_secret}, Bearer Token: {bearer_token}, Access Token: {access_token}, Access Token Secret: {access_token_secret}")
+        # 認証情報はログに残さない
+        logger.debug("アカウント編集 - アカウントID: %s, 名前: %s", current_account_id, name)
 
         edit_account(name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret, current_account_id)
-        logging.debug(f"SQL更新クエリを実行しました: アカウントID {current_account_id}")
+        logger.debug("SQL更新クエリを実行しました: アカウントID %s", current_account_id)
 
         flash("アカウント情報が更新されました")
 
         # 最新のアカウント情報を再読み込み
         load_account(current_account_id)
     except Exception as e:
-        logging.error(f"アカウント情報の更新中にエラーが発生しました: {e}")
+        logger.error("アカウント情報の更新中にエラーが発生しました: %s", e)
         flash("アカウント情報の更新中にエラーが発生しました")
     return redirect(url_for('index'))
 
-@app.route('/reset_status')
-def reset_status():
-    global reset_flag
-    status = reset_flag
-    reset_flag = False  # フラグをリセット
-    return jsonify({"reset": status})
-
 @app.route('/post', methods=['POST'])
 def post():
+    current_account_id = get_current_account_id()
     try:
         message = request.form['message']
-        insert_message(message, current_account_id)
-        flash("メッセージが追加されました")
+        media_path = request.form.get('media_path', '').strip() or None
+        try:
+            weight = float(request.form.get('weight') or 1)
+            priority = int(request.form.get('priority') or 0)
+        except ValueError:
+            weight = None
+        if weight is None or not weight > 0:
+            flash("重みには正の数、優先度には整数を入力してください")
+            return redirect(url_for('index'))
+        if media_path:
+            prepare_media(media_path)  # 追加する時点で確認し、アップロードできる形に変換しておく
+        if insert_message(message, current_account_id, media_path, weight, priority):
+            flash("メッセージが追加されました")
+        else:
+            flash("重複のため保存できませんでした")
+    except MediaError as e:
+        flash(str(e))
     except Exception as e:
-        logging.error(f"メッセージ追加中にエラーが発生しました: {e}")
+        logger.error("メッセージ追加中にエラーが発生しました: %s", e)
         flash("メッセージ追加中にエラーが発生しました")
     return redirect(url_for('index'))
 
 @app.route('/set_interval', methods=['POST'])
 def set_interval_route_handler():
-    return set_interval_route(current_account_id, account_settings, is_auto_posting, update_auto_post_schedule)
+    return set_interval_route(get_current_account_id(), update_auto_post_schedule)
 
 @app.route('/start_auto_post')
 def start_auto_post_handler():
-    return start_auto_post(current_account_id, is_auto_posting, update_auto_post_schedule, account_settings)
+    return start_auto_post(get_current_account_id(), update_auto_post_schedule)
 
 @app.route('/stop_auto_post')
 def stop_auto_post_handler():
-    return stop_auto_post(current_account_id, auto_post_threads, is_auto_posting)
+    return stop_auto_post(get_current_account_id(), cancel_auto_post_schedule)
 
+# メッセージ一覧のAPI
+#   /messages?after_id=&limit=  ID順のページ取得
+#   /messages?since=&limit=     since（変更番号）より後の差分取得
 @app.route('/messages')
 def get_messages_route():
+    current_account_id = get_current_account_id()
     try:
-        messages = get_messages(current_account_id)
-        return jsonify([dict(msg) for msg in messages])
+        limit = min(request.args.get('limit', MESSAGES_PAGE_SIZE, type=int), MAX_MESSAGES_PAGE_SIZE)
+        since = request.args.get('since', type=int)
+        after_id = request.args.get('after_id', 0, type=int)
+
+        # 変更がなければ304を返す
+        latest_seq = get_latest_change_seq(current_account_id)
+        etag = f"{current_account_id}-{latest_seq}-{since}-{after_id}-{limit}"
+        if request.if_none_match.contains_weak(etag):
+            return '', 304
+
+        if since is not None:
+            changed, deleted_ids, cursor, has_more, reset = get_message_changes(current_account_id, since, limit)
+            body = {'changes': changed, 'deleted_ids': deleted_ids, 'cursor': cursor, 'has_more': has_more, 'reset': reset}
+        else:
+            messages = get_messages(current_account_id, after_id=after_id, limit=limit)
+            body = {
+                'messages': [dict(msg) for msg in messages],
+                'next_after_id': messages[-1]['id'] if len(messages) == limit else None,
+                'cursor': latest_seq,
+            }
+        response = jsonify(body)
+        response.set_etag(etag, weak=True)
+        return response
     except Exception as e:
-        logging.error(f"メッセージの取得中にエラーが発生しました: {e}")
-        return jsonify([])
+        logger.error("メッセージの取得中にエラーが発生しました: %s", e)
+        return jsonify({'messages': [], 'changes': [], 'deleted_ids': [], 'next_after_id': None, 'cursor': None, 'has_more': False, 'reset': False})
+
+# メッセージの変更を Server-Sent Events で送る
+#   /events?since=  since（変更番号）より後の変更から送る（再接続時は Last-Event-ID を優先）
+#   接続中はワーカーを1つ占有するので、gthread か gevent のワーカーで動かす（change_feed.MAX_EVENT_STREAMS を参照）
+@app.route('/events')
+def events_route():
+    # ストリームが多すぎるとワーカーが埋まるので断る（画面は /messages?since= の定期取得に切り替える）
+    if not change_feed.has_capacity():
+        response = jsonify({'error': 'too many event streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+    current_account_id = get_current_account_id()
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        since = get_latest_change_seq(current_account_id)
+    response = Response(stream_events(current_account_id, since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # プロキシでバッファリングさせない
+    return response
+
+@app.route('/post_metrics')
+def post_metrics_route():
+    return jsonify(get_post_metrics())
+
+@app.route('/rate_limits')
+def rate_limits_route():
+    return jsonify(get_rate_limit_status())
+
+@app.route('/cache_stats')
+def cache_stats_route():
+    stats = get_cache_stats()
+    stats['clients'] = dict(client_stats)
+    return jsonify(stats)
+
+# Prometheus 形式のメトリクス（値はこのプロセスのもの。投稿の集計はリーダーのプロセスで増える）
+@app.route('/metrics')
+def metrics_route():
+    return app.response_class(render_metrics(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/delete/<int:id>', methods=['POST'])
 def delete_message_route(id):
+    current_account_id = get_current_account_id()
     try:
         delete_message(id, current_account_id)
         flash("メッセージが削除されました")
     except Exception as e:
-        logging.error(f"メッセージの削除中にエラーが発生しました: {e}")
+        logger.error("メッセージの削除中にエラーが発生しました: %s", e)
         flash("メッセージの削除中にエラーが発生しました")
     return redirect(url_for('index'))
 
 @app.route('/edit/<int:id>', methods=['POST'])
 def edit_message_route(id):
+    current_account_id = get_current_account_id()
     try:
         new_message = request.form['new_message']
-        logging.debug(f"メッセージ編集 - ID: {id}, 新しいメッセージ: {new_message}")
+        logger.debug("メッセージ編集 - ID: %s, 新しいメッセージ: %s", id, new_message)
         update_message(new_message, id, current_account_id)
         flash("メッセージが編集されました")
     except Exception as e:
-        logging.error(f"メッセージの編集中にエラーが発生しました: {e}")
+        logger.error("メッセージの編集中にエラーが発生しました: %s", e)
         flash("メッセージの編集中にエラーが発生しました")
     return redirect(url_for('index'))
 
 @app.route('/upload', methods=['POST'])
 def upload():
+    current_account_id = get_current_account_id()
     if 'file' not in request.files:
         flash('ファイルがありません')
         return redirect(url_for('index'))
@@ -208,19 +321,58 @@ def upload():
     file = request.files['file']
     return upload_csv(file, current_account_id)
 
+@app.route('/import_jobs')
+def import_jobs_route():
+    current_account_id = get_current_account_id()
+    return jsonify(get_import_jobs(current_account_id))
+
+# 投稿履歴（新しい順）と月ごとの集計
+#   /post_history?before=&limit=&archived=1  before（UNIX時間）より前の履歴。archived=1 なら保管済みの月も読む
+@app.route('/post_history')
+def post_history_route():
+    current_account_id = get_current_account_id()
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    before = request.args.get('before', type=float)
+    include_archived = request.args.get('archived') == '1'
+    return jsonify({
+        'history': get_post_history(current_account_id, limit, before, include_archived),
+        'summary': get_post_summary(current_account_id),
+    })
+
 @app.route('/delete_all_messages', methods=['POST'])
 def delete_all_messages_route():
+    current_account_id = get_current_account_id()
     try:
         delete_all_messages(current_account_id)
         flash("すべてのメッセージが削除されました")
     except Exception as e:
-        logging.error(f"すべてのメッセージの削除中にエラーが発生しました: {e}")
+        logger.error("すべてのメッセージの削除中にエラーが発生しました: %s", e)
         flash("すべてのメッセージの削除中にエラーが発生しました")
     return redirect(url_for('index'))
 
-# アプリケーション起動時に全てのアカウントの自動投稿状態をチェック
-check_and_start_auto_post(account_settings, is_auto_posting)
+# 現在のアカウントのメッセージを選択したアカウントにコピーする（未投稿として追加し、既にあるメッセージは飛ばす）
+@app.route('/copy_messages', methods=['POST'])
+def copy_messages_route():
+    current_account_id = get_current_account_id()
+    target_account_ids = [int(account_id) for account_id in request.form.getlist('target_account_ids')]
+    if not target_account_ids:
+        flash("コピー先のアカウントを選択してください")
+        return redirect(url_for('index'))
+    try:
+        inserted = copy_messages(current_account_id, target_account_ids)
+        flash(f"{len(inserted)}件のアカウントに合計{sum(inserted.values())}件のメッセージをコピーしました")
+    except Exception as e:
+        logger.error("メッセージのコピー中にエラーが発生しました: %s", e)
+        flash("メッセージのコピー中にエラーが発生しました")
+    return redirect(url_for('index'))
+
+# アプリケーション起動時に未適用のマイグレーションを適用する
+if not IS_WORKER_PROCESS:
+    run_migrations(get_db_connection())
 
 if __name__ == '__main__':
+    # リローダーの親プロセスではスケジューラを開始しない
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_auto_post_scheduler()
     app.run(debug=True)
 
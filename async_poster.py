@@ -0,0 +1,110 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+import tweepy
+from oauthlib.oauth1 import Client as OAuth1Client
+
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp がなければ同期の tweepy.Client で投稿する
+    aiohttp = None
+
+TWITTER_API_BASE_URL = os.getenv('TWITTER_API_BASE_URL', 'https://api.twitter.com')
+POST_TIMEOUT_SECONDS = float(os.getenv('POST_TIMEOUT_SECONDS', '15'))  # 1回の投稿リクエストのタイムアウト
+MAX_API_CONNECTIONS = int(os.getenv('MAX_API_CONNECTIONS', '100'))    # 共有する接続プールの最大接続数
+
+TweetResponse = namedtuple('TweetResponse', ['data', 'headers'])  # 投稿結果とレート制限ヘッダー
+
+
+class TweetPostError(tweepy.TweepyException):
+    """非同期投稿でAPIがエラーを返した場合の例外"""
+
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = dict(headers or {})
+        detail = (body.get('detail') or body.get('title') or body) if isinstance(body, dict) else body
+        super().__init__(f"{status} {detail}")
+
+
+class AsyncPoster:
+    """全アカウントで1つのHTTP接続プールを共有し、イベントループ上で並行して投稿する"""
+
+    def __init__(self, base_url=TWITTER_API_BASE_URL, timeout=POST_TIMEOUT_SECONDS, max_connections=MAX_API_CONNECTIONS):
+        if aiohttp is None:
+            raise RuntimeError("非同期投稿には aiohttp が必要です")
+        self.url = f"{base_url.rstrip('/')}/2/tweets"
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._loop = None
+        self._session = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # イベントループ用のスレッドを起動する
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run_loop, args=(ready,), name='async-poster', daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    def _run_loop(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._session = self._loop.run_until_complete(self._create_session())
+        ready.set()
+        self._loop.run_forever()
+
+    async def _create_session(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    # 他のスレッドから投稿を依頼し、concurrent.futures.Future を返す
+    def submit(self, credentials, text, media_ids=None):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(self.create_tweet(credentials, text, media_ids), self._loop)
+
+    # 投稿して完了まで待つ（tweepy.Client.create_tweet の代わりに使う）
+    def post(self, credentials, text, media_ids=None):
+        return self.submit(credentials, text, media_ids).result(self.timeout + 5)
+
+    # イベントループ上で実行する投稿処理
+    async def create_tweet(self, credentials, text, media_ids=None):
+        oauth = OAuth1Client(
+            credentials['consumer_api_key'],
+            client_secret=credentials['consumer_api_secret'],
+            resource_owner_key=credentials['access_token'],
+            resource_owner_secret=credentials['access_token_secret'],
+        )
+        # JSON本文は署名対象に含まれない
+        _, headers, _ = oauth.sign(self.url, http_method='POST', headers={'Content-Type': 'application/json'})
+        payload = {'text': text}
+        if media_ids:
+            payload['media'] = {'media_ids': [str(media_id) for media_id in media_ids]}
+        async with self._session.post(self.url, data=json.dumps(payload), headers=headers) as response:
+            try:
+                body = await response.json(content_type=None)
+            except ValueError:
+                body = await response.text()
+            if response.status >= 400:
+                raise TweetPostError(response.status, body, response.headers)
+            return TweetResponse(body.get('data', {}), dict(response.headers))
+
+    def close(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._thread = None
+            logger.debug("非同期投稿のイベントループを停止しました")
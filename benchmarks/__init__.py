@@ -0,0 +1,6 @@
+"""ベンチマーク
+
+実行方法:
+    python -m benchmarks.run            よく使われる処理をまとめて計測し、結果をJSONに保存する
+    python -m benchmarks.bench_xxx      従来方式との比較（個別のベンチマーク）
+"""
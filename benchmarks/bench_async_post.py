@@ -0,0 +1,73 @@
+"""投稿処理のベンチマーク
+
+アカウントごとに requests のセッションを持ち8スレッドで投稿する従来方式（tweepy.Client 相当）と、
+共有接続プールの AsyncPoster で並行して投稿する方式を、ローカルのモックAPIに対して比較する。
+実行方法: python -m benchmarks.bench_async_post
+"""
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests_oauthlib import OAuth1
+
+from async_poster import AsyncPoster
+from mock_twitter_api import MockTwitterServer
+
+ACCOUNTS = 1000
+LATENCY = 0.05      # モックAPIの応答遅延（秒）
+LEGACY_WORKERS = 8  # PostExecutor の既定のワーカー数
+
+def make_credentials(i):
+    return {
+        'consumer_api_key': 'key',
+        'consumer_api_secret': 'secret',
+        'access_token': f"token{i}",
+        'access_token_secret': 'token_secret',
+    }
+
+# 従来方式: tweepy.Client と同じくアカウントごとのセッションで同期的に投稿する
+def legacy_posts_per_sec(base_url):
+    sessions = {}
+    for i in range(ACCOUNTS):
+        credentials = make_credentials(i)
+        session = requests.Session()
+        session.auth = OAuth1(credentials['consumer_api_key'], credentials['consumer_api_secret'],
+                              credentials['access_token'], credentials['access_token_secret'])
+        sessions[i] = session
+
+    def post(i):
+        response = sessions[i].post(f"{base_url}/2/tweets", json={'text': f"メッセージ{i}"})
+        response.raise_for_status()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=LEGACY_WORKERS) as executor:
+        list(executor.map(post, range(ACCOUNTS)))
+    elapsed = time.perf_counter() - start
+    for session in sessions.values():
+        session.close()
+    return ACCOUNTS / elapsed
+
+def async_posts_per_sec(base_url):
+    poster = AsyncPoster(base_url=base_url)
+    poster.start()
+    start = time.perf_counter()
+    futures = [poster.submit(make_credentials(i), f"メッセージ{i}") for i in range(ACCOUNTS)]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    poster.close()
+    return ACCOUNTS / elapsed
+
+def main():
+    with MockTwitterServer(latency=LATENCY) as server:
+        legacy = legacy_posts_per_sec(server.base_url)
+    with MockTwitterServer(latency=LATENCY) as server:
+        pooled = async_posts_per_sec(server.base_url)
+
+    print(f"{ACCOUNTS}アカウント / 応答遅延 {LATENCY * 1000:.0f}ms")
+    print(f"{'方式':<12}{'posts/s':>10}")
+    print(f"{'従来':<12}{legacy:>10.0f}")
+    print(f"{'非同期':<12}{pooled:>10.0f}")
+    print(f"倍率: {pooled / legacy:.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""CSV取り込みのベンチマーク
+
+1行ずつ COUNT(*) で重複チェックする従来方式と、チャンク単位の一括挿入を比較する。
+実行方法: python -m benchmarks.bench_csv_import
+"""
+import csv
+import os
+import tempfile
+import time
+
+import db_manager
+from migrations import run_migrations, _create_base_tables
+from csv_manager import insert_messages_from_csv
+
+LEGACY_ROWS = 5000       # 従来方式はO(N*M)のため件数を抑える
+BULK_ROWS = 1_000_000
+
+# 従来方式: 1行ごとに重複チェックと挿入を行う
+def legacy_insert_messages_from_csv(filename, account_id):
+    failed_messages = []
+    with open(filename, newline='', encoding='utf-8') as csvfile:
+        reader = csv.reader(csvfile)
+        conn = db_manager.get_db_connection()
+        with conn:
+            cursor = conn.cursor()
+            for row in reader:
+                if row:
+                    cursor.execute("SELECT COUNT(*) FROM tweets WHERE message = ? AND account_id = ?", (row[0], account_id))
+                    if cursor.fetchone()[0] == 0:
+                        cursor.execute("INSERT INTO tweets (message, account_id) VALUES (?, ?)", (row[0], account_id))
+                    else:
+                        failed_messages.append(row[0])
+    return failed_messages
+
+def write_csv(filename, rows):
+    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        for i in range(rows):
+            writer.writerow([f"今日のひとこと その{i}"])
+
+def timed_import(tmpdir, name, rows, insert, migrate=run_migrations):
+    db_manager.DB_PATH = os.path.join(tmpdir, f"{name}.db")
+    conn = db_manager.get_db_connection()
+    migrate(conn)
+    conn.commit()
+    filename = os.path.join(tmpdir, f"{name}.csv")
+    write_csv(filename, rows)
+
+    start = time.perf_counter()
+    insert(filename, 1)
+    first = time.perf_counter() - start
+    # 同じファイルをもう一度取り込む（全行が重複）
+    start = time.perf_counter()
+    failed = insert(filename, 1)
+    second = time.perf_counter() - start
+    db_manager.close_db_connection()
+    assert len(failed) == rows
+    return first, second
+
+def main():
+    print(f"{'方式':<8}{'行数':>10}{'初回(s)':>10}{'再取込(s)':>12}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, rows, insert, migrate in (
+            # 従来方式は元の create_db.py のスキーマで計測する
+            ('legacy', LEGACY_ROWS, legacy_insert_messages_from_csv, _create_base_tables),
+            ('bulk', LEGACY_ROWS, insert_messages_from_csv, run_migrations),
+            ('bulk', BULK_ROWS, insert_messages_from_csv, run_migrations),
+        ):
+            first, second = timed_import(tmpdir, f"{name}_{rows}", rows, insert, migrate)
+            print(f"{name:<8}{rows:>10}{first:>10.2f}{second:>12.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""DB接続のマイクロベンチマーク
+
+呼び出しごとに接続を開閉する従来方式と、スレッドごとに接続を再利用する方式を比較する。
+実行方法: python -m benchmarks.bench_db
+"""
+import os
+import sqlite3
+import tempfile
+import time
+
+import db_manager
+from migrations import run_migrations, _create_base_tables
+
+OPERATIONS = 2000
+
+# 従来方式: 呼び出しごとに接続を開いて閉じる
+def legacy_get_settings(path, account_id):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("SELECT interval_type, interval, specific_time FROM settings WHERE account_id = ?", (account_id,))
+    settings = cursor.fetchall()
+    conn.close()
+    return settings
+
+def legacy_insert_message(path, message, account_id):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO tweets (message, account_id) VALUES (?, ?)", (message, account_id))
+    conn.commit()
+    conn.close()
+
+def ops_per_sec(func):
+    start = time.perf_counter()
+    for i in range(OPERATIONS):
+        func(i)
+    return OPERATIONS / (time.perf_counter() - start)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        legacy_path = os.path.join(tmpdir, 'legacy.db')
+        # 従来方式は元の create_db.py のスキーマで計測する
+        conn = sqlite3.connect(legacy_path)
+        _create_base_tables(conn)
+        conn.commit()
+        conn.close()
+
+        db_manager.DB_PATH = os.path.join(tmpdir, 'pooled.db')
+        run_migrations(db_manager.get_db_connection())
+        db_manager.set_interval('interval', 3, [], 1)
+
+        results = [
+            ('get_settings', ops_per_sec(lambda i: legacy_get_settings(legacy_path, 1)),
+             ops_per_sec(lambda i: db_manager.get_settings(1))),
+            ('insert_message', ops_per_sec(lambda i: legacy_insert_message(legacy_path, f"メッセージ{i}", 1)),
+             ops_per_sec(lambda i: db_manager.insert_message(f"メッセージ{i}", 1))),
+        ]
+        db_manager.close_db_connection()
+
+    print(f"{'処理':<16}{'従来(ops/s)':>14}{'プール(ops/s)':>16}{'倍率':>8}")
+    for name, legacy, pooled in results:
+        print(f"{name:<16}{legacy:>14.0f}{pooled:>16.0f}{pooled / legacy:>8.1f}")
+
+if __name__ == '__main__':
+    main()
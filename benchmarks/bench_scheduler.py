@@ -0,0 +1,81 @@
+"""スケジューラのベンチマーク
+
+従来のアカウントごとのスレッド方式と、ヒープを使う単一スレッド方式を比較する。
+実行方法: python -m benchmarks.bench_scheduler
+"""
+import threading
+import time
+
+from scheduler import PostScheduler
+
+ACCOUNT_COUNTS = [10, 100, 1000]
+CHECK_INTERVAL = 60  # 従来方式のポーリング間隔（秒）
+
+# 従来方式: アカウントごとにスレッドを立て、CHECK_INTERVAL ごとに時刻を確認する
+def legacy_job(account_id, stop_event, account_settings, wakeups):
+    while not stop_event.is_set():
+        settings = account_settings.get(account_id, {})
+        wakeups[account_id] = wakeups.get(account_id, 0) + 1
+        if time.strftime("%H:%M") in settings.get('specific_times', []):
+            pass
+        if stop_event.wait(CHECK_INTERVAL):
+            break
+
+def legacy_schedule(threads, account_id, account_settings, wakeups):
+    if account_id in threads:
+        threads[account_id]['event'].set()
+        threads[account_id]['thread'].join()
+    stop_event = threading.Event()
+    thread = threading.Thread(target=legacy_job, args=(account_id, stop_event, account_settings, wakeups))
+    thread.start()
+    threads[account_id] = {'thread': thread, 'event': stop_event}
+
+def bench_legacy(n, account_settings):
+    threads, wakeups = {}, {}
+    start = time.perf_counter()
+    for account_id in range(n):
+        legacy_schedule(threads, account_id, account_settings, wakeups)
+    start_time = time.perf_counter() - start
+    thread_count = threading.active_count()
+
+    start = time.perf_counter()
+    for account_id in range(n):
+        legacy_schedule(threads, account_id, account_settings, wakeups)
+    reschedule_time = time.perf_counter() - start
+
+    for entry in threads.values():
+        entry['event'].set()
+    for entry in threads.values():
+        entry['thread'].join()
+    return start_time, reschedule_time, thread_count, n  # 1分あたりの起床回数 = アカウント数
+
+def bench_heap(n, account_settings):
+    fired = []
+    scheduler = PostScheduler(fired.append)
+    start = time.perf_counter()
+    for account_id in range(n):
+        scheduler.schedule(account_id, account_settings[account_id])
+    start_time = time.perf_counter() - start
+    thread_count = threading.active_count()
+
+    start = time.perf_counter()
+    for account_id in range(n):
+        scheduler.schedule(account_id, account_settings[account_id])
+    reschedule_time = time.perf_counter() - start
+    scheduler.stop()
+    # 指定時刻モードでは投稿時刻以外に起床しない
+    return start_time, reschedule_time, thread_count, 0
+
+def main():
+    print(f"{'方式':<8}{'アカウント数':>10}{'登録(ms)':>12}{'再設定(ms)':>12}{'スレッド数':>10}{'起床/分':>8}")
+    for n in ACCOUNT_COUNTS:
+        account_settings = {
+            account_id: {'interval_type': 'specific', 'interval': None, 'specific_times': ['03:00']}
+            for account_id in range(n)
+        }
+        for name, bench in (('legacy', bench_legacy), ('heap', bench_heap)):
+            start_time, reschedule_time, thread_count, wakeups = bench(n, account_settings)
+            print(f"{name:<8}{n:>10}{start_time * 1000:>12.2f}{reschedule_time * 1000:>12.2f}{thread_count:>10}{wakeups:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""起動時の自動投稿の読み込みのベンチマーク
+
+アカウントごとにクエリを発行してクライアントを作成する従来方式と、
+1回のクエリでまとめて読み込みクライアントを投稿時まで作らない方式を比較する。
+起動直後の10秒間に投稿時刻が来るアカウント数（一斉投稿の規模）も表示する。
+実行方法: python -m benchmarks.bench_startup
+"""
+import os
+import sqlite3
+import tempfile
+import time
+from unittest.mock import patch
+
+import tweepy
+import db_manager
+import post_manager
+import post_setting_manager
+from cache_manager import invalidate_all_caches
+from migrations import run_migrations
+from scheduler import PostScheduler, get_next_fire_time
+
+ACCOUNTS = 10000
+HERD_SECONDS = 10
+
+def create_database(path):
+    db_manager.DB_PATH = path
+    conn = db_manager.get_db_connection()
+    run_migrations(conn)
+    with conn:
+        conn.executemany(
+            "INSERT INTO accounts (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f"account{i}", f"key{i}", 'secret', 'bearer', f"token{i}", 'token_secret') for i in range(ACCOUNTS)])
+        conn.execute("INSERT INTO auto_post_status (account_id, status) SELECT id, 1 FROM accounts")
+        conn.execute("INSERT INTO settings (interval_type, interval, account_id) SELECT 'interval', 3, id FROM accounts")
+
+# 従来方式: アカウントごとに接続を開いて読み込み、クライアントを作り、すぐに投稿する予定を登録する
+def legacy_startup(path, scheduler):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    account_ids = [row['id'] for row in conn.execute("SELECT id FROM accounts")]
+    conn.close()
+    for account_id in account_ids:
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        account = conn.execute("SELECT * FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        conn.close()
+        tweepy.Client(bearer_token=account['bearer_token'], consumer_key=account['consumer_api_key'],
+                      consumer_secret=account['consumer_api_secret'], access_token=account['access_token'],
+                      access_token_secret=account['access_token_secret'])
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        settings = conn.execute("SELECT * FROM settings WHERE account_id = ?", (account_id,)).fetchall()
+        conn.close()
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        status = conn.execute("SELECT status FROM auto_post_status WHERE account_id = ?", (account_id,)).fetchone()
+        conn.close()
+        if status and status['status']:
+            scheduler.schedule(account_id, {'interval_type': 'interval', 'interval': settings[0]['interval'], 'specific_times': []},
+                               fire_at=get_next_fire_time({'interval_type': 'interval'}, first=True))
+
+# 最初に登録された投稿時刻を記録する
+class FireTimeRecorder:
+
+    def __init__(self, save=None):
+        self.first = {}
+        self.save = save
+
+    def __call__(self, fire_times):
+        for account_id, fire_at in fire_times:
+            self.first.setdefault(account_id, fire_at)
+        if self.save:
+            self.save(fire_times)
+
+    def herd_size(self, start):
+        return sum(1 for fire_at in self.first.values() if fire_at < start + HERD_SECONDS)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'startup.db')
+        create_database(path)
+
+        recorder = FireTimeRecorder()
+        scheduler = PostScheduler(lambda account_id: None, on_fire_times=recorder)
+        wall_start, start = time.time(), time.perf_counter()
+        legacy_startup(path, scheduler)
+        legacy_time = time.perf_counter() - start
+        legacy_herd = recorder.herd_size(wall_start)
+        scheduler.stop()
+
+        invalidate_all_caches()
+        recorder = FireTimeRecorder(db_manager.save_next_fire_times)
+        scheduler = PostScheduler(lambda account_id: None, on_fire_times=recorder)
+        leader = type('Leader', (), {'is_leader': True, 'term': 1})()
+        with patch.object(post_manager, 'scheduler', scheduler), patch.object(post_manager, 'leader', leader):
+            wall_start, start = time.time(), time.perf_counter()
+            post_setting_manager.check_and_start_auto_post()
+            batched_time = time.perf_counter() - start
+        batched_herd = recorder.herd_size(wall_start)
+        scheduler.stop()
+        db_manager.close_db_connection()
+
+    print(f"{ACCOUNTS}アカウント（全て自動投稿中・インターバルモード）")
+    print(f"{'方式':<10}{'起動(ms)':>12}{f'{HERD_SECONDS}秒以内の投稿':>16}")
+    print(f"{'従来':<10}{legacy_time * 1000:>12.0f}{legacy_herd:>16}")
+    print(f"{'一括読み込み':<10}{batched_time * 1000:>12.0f}{batched_herd:>16}")
+
+if __name__ == '__main__':
+    main()
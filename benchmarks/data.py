@@ -0,0 +1,63 @@
+"""ベンチマーク用の合成データ
+
+csv/ のメッセージ集をもとに日本語のメッセージを作り、N アカウント × M 件の tweets.db を作成する。
+"""
+import csv
+import glob
+import os
+import random
+
+import db_manager
+from migrations import run_migrations
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'csv')
+SUFFIXES = ['', '☆', '！', '🍀', ' #今日のひとこと', ' #豆知識', '（続く）', '…']
+
+# 不足した場合に使う短い文
+FALLBACK_CORPUS = [
+    '関数は一つの責任のみを持つようにする',
+    'レモンを切る前に転がすと、果汁が多く絞れます。',
+    '想像力は知識より大切っしょ〜☆',
+]
+
+# csv/ にあるメッセージを読み込む
+def load_corpus(corpus_dir=CORPUS_DIR):
+    corpus = []
+    for filename in sorted(glob.glob(os.path.join(corpus_dir, '*.csv'))):
+        with open(filename, newline='', encoding='utf-8') as csvfile:
+            corpus.extend(row[0].strip() for row in csv.reader(csvfile) if row and row[0].strip())
+    return corpus or FALLBACK_CORPUS
+
+# 重複しない日本語のメッセージを count 件作る
+def generate_messages(count, seed=0, corpus=None):
+    corpus = corpus or load_corpus()
+    rng = random.Random(seed)
+    return [f"{rng.choice(corpus)}{rng.choice(SUFFIXES)} その{i + 1}" for i in range(count)]
+
+def write_csv(filename, count, seed=0):
+    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        for message in generate_messages(count, seed):
+            writer.writerow([message])
+
+# accounts 件のアカウントにそれぞれ messages 件のメッセージを持つDBを作成する
+def create_database(path, accounts, messages, seed=0, interval=3):
+    db_manager.DB_PATH = path
+    conn = db_manager.get_db_connection()
+    run_migrations(conn)
+    corpus = load_corpus()
+    with conn:
+        conn.executemany(
+            "INSERT INTO accounts (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f"アカウント{i + 1}", f"key{i + 1}", 'secret', 'bearer', f"{1000 + i}-token{i + 1}", 'token_secret') for i in range(accounts)])
+        account_ids = [row['id'] for row in conn.execute("SELECT id FROM accounts ORDER BY id")]
+        conn.executemany("INSERT INTO settings (interval_type, interval, account_id) VALUES ('interval', ?, ?)",
+                         [(interval, account_id) for account_id in account_ids])
+        for account_id in account_ids:
+            bodies = generate_messages(messages, seed=seed + account_id, corpus=corpus)
+            content_ids = [db_manager.get_content_id(conn, body) for body in bodies]
+            conn.executemany("INSERT INTO tweets (content_id, account_id, shuffle_key) VALUES (?, ?, weighted_key(1))",
+                             [(content_id, account_id) for content_id in content_ids])
+        conn.executemany("INSERT INTO account_stats (account_id, total, remaining) VALUES (?, ?, ?)",
+                         [(account_id, messages, messages) for account_id in account_ids])
+    return account_ids
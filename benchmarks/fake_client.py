@@ -0,0 +1,87 @@
+"""tweepy.Client の代わりに使う投稿しないクライアント
+
+create_tweet は tweepy.Client(return_type=requests.Response) と同じく requests.Response を返し、
+設定した割合で重複（403）・レート制限（429）・通信エラーを起こす。
+FakeMediaAPI は tweepy.API の simple_upload の代わりに、送信量に応じて待ってから media_id を返す。
+"""
+import itertools
+import json
+import random
+import threading
+import time
+
+import requests
+import tweepy
+from types import SimpleNamespace
+
+
+def _response(status, body, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.reason = {201: 'Created', 403: 'Forbidden', 429: 'Too Many Requests'}.get(status, '')
+    response._content = json.dumps(body).encode('utf-8')
+    response.headers.update(headers or {})
+    return response
+
+
+class FakeTwitterClient:
+
+    def __init__(self, consumer_key='key', latency=0.0, duplicate_rate=0.0, rate_limit_rate=0.0,
+                 network_error_rate=0.0, seed=0):
+        self.consumer_key = consumer_key
+        self.latency = latency
+        self.duplicate_rate = duplicate_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.network_error_rate = network_error_rate
+        self.posted = []
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_tweet(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            roll = self._random.random()
+            if roll < self.network_error_rate:
+                raise requests.ConnectionError('接続がリセットされました')
+            roll -= self.network_error_rate
+            if roll < self.rate_limit_rate:
+                raise tweepy.TooManyRequests(_response(429, {'title': 'Too Many Requests'}, {
+                    'x-rate-limit-limit': '200', 'x-rate-limit-remaining': '0',
+                    'x-rate-limit-reset': str(int(time.time()) + 900)}))
+            roll -= self.rate_limit_rate
+            if roll < self.duplicate_rate:
+                raise tweepy.Forbidden(_response(403, {
+                    'detail': 'You are not allowed to create a Tweet with duplicate content.'}))
+            self.posted.append(text)
+            tweet_id = next(self._ids)
+        return _response(201, {'data': {'id': str(tweet_id), 'text': text}}, {
+            'x-rate-limit-limit': '200', 'x-rate-limit-remaining': '199',
+            'x-rate-limit-reset': str(int(time.time()) + 900)})
+
+
+class FakeMediaAPI:
+
+    def __init__(self, latency=0.0, bytes_per_second=None):
+        self.latency = latency                    # 1回のアップロードの固定の遅延（秒）
+        self.bytes_per_second = bytes_per_second  # 回線の速度（Noneなら送信時間は0）
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def simple_upload(self, filename, *, file=None, additional_owners=None):
+        if file is None:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        else:
+            data = file.read()
+        delay = self.latency + (len(data) / self.bytes_per_second if self.bytes_per_second else 0)
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            self.uploads += 1
+            self.uploaded_bytes += len(data)
+            media_id = next(self._ids)
+        return SimpleNamespace(media_id=media_id, media_id_string=str(media_id), expires_after_secs=86400)
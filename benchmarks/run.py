@@ -0,0 +1,223 @@
+"""よく使われる処理のベンチマークをまとめて実行し、結果をJSONに保存する
+
+合成データのDBを作成し、投稿時のメッセージ取得、CSV取り込み、メッセージ集の複数アカウントへの割り当て、一覧画面の表示、
+/messages のJSON、スケジューラを計測する。投稿は FakeTwitterClient で行い外部には送信しない。
+
+実行方法:
+    python -m benchmarks.run
+    python -m benchmarks.run --accounts 100 --messages 2000 --compare benchmarks/results/abc1234.json
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import db_manager
+from benchmarks.data import create_database, write_csv
+from benchmarks.fake_client import FakeTwitterClient, FakeMediaAPI
+from scheduler import PostScheduler
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+CSV_ROWS = 10000
+SCHEDULER_ACCOUNTS = 10000
+MEDIA_POSTS = 300
+FANOUT_ACCOUNTS = 50  # 同じメッセージ集を割り当てるアカウント数
+MEDIA_DIRS = ['img', 'picuture']  # リポジトリに含まれる画像
+
+# func を repeat 回実行し、1回あたりの時間の中央値・95パーセンタイルと1秒あたりの回数を返す
+def measure(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        'runs': repeat,
+        'median_ms': round(statistics.median(times) * 1000, 4),
+        'p95_ms': round(times[min(int(repeat * 0.95), repeat - 1)] * 1000, 4),
+        'ops_per_sec': round(repeat / sum(times), 2),
+    }
+
+# 全アカウントのメッセージを未投稿に戻し、順番に1件ずつ取り出しても空にならない回数（最大 limit 回）を返す
+def reset_queues(account_ids, limit=1000):
+    for account_id in account_ids:
+        db_manager.reset_messages(account_id)
+    remaining = min(db_manager.get_account_stats(account_id)['remaining'] for account_id in account_ids)
+    return min(limit, remaining * len(account_ids))
+
+def bench_queue(account_ids, results):
+    from db_manager import get_message, claim_message, ack_message
+
+    def claim_and_ack(i):
+        claimed = claim_message(account_ids[i % len(account_ids)], 60)
+        ack_message(claimed['id'])
+
+    results['get_message'] = measure(lambda i: get_message(account_ids[i % len(account_ids)]), reset_queues(account_ids))
+    results['claim_ack_message'] = measure(claim_and_ack, reset_queues(account_ids))
+
+def bench_post_message(account_ids, results):
+    import post_manager
+    client = FakeTwitterClient(duplicate_rate=0.05)
+    with patch.object(post_manager, 'get_client', lambda account_id: client), \
+            patch.object(post_manager, 'leader', SimpleNamespace(is_leader=True, term=1)), \
+            patch.object(post_manager, 'scheduler', SimpleNamespace(defer=lambda account_id, delay: True)), \
+            patch.object(post_manager, 'MINIMUM_POST_INTERVAL_MINUTES', 0):
+        repeat = reset_queues(account_ids)
+        results['post_message'] = measure(lambda i: post_manager.post_message(account_ids[i % len(account_ids)]), repeat)
+
+# 画像付きの投稿で、毎回アップロードする場合と変換済みの画像と media_id を使い回す場合を比べる
+def bench_media_upload(tmpdir, account_ids, results):
+    import media_manager
+    media_root = os.path.join(tmpdir, 'media')
+    for directory in MEDIA_DIRS:
+        shutil.copytree(directory, os.path.join(media_root, directory))
+    images = sorted(os.path.join(dirpath, name) for dirpath, _, names in os.walk(media_root) for name in names)
+
+    # 1回あたり20msの遅延と 10MB/秒 の回線を想定する
+    naive_api = FakeMediaAPI(latency=0.02, bytes_per_second=10 * 1024 * 1024)
+    results['media_upload_naive'] = measure(lambda i: naive_api.simple_upload(images[i % len(images)]), MEDIA_POSTS)
+
+    cached_api = FakeMediaAPI(latency=0.02, bytes_per_second=10 * 1024 * 1024)
+    with patch.object(media_manager, 'MEDIA_ROOTS', [media_root]), \
+            patch.object(media_manager, 'MEDIA_CACHE_DIR', os.path.join(tmpdir, 'media_cache')), \
+            patch.object(media_manager, 'get_media_api', lambda account_id: cached_api):
+        results['media_upload_cached'] = measure(
+            lambda i: media_manager.upload_media(account_ids[i % len(account_ids)], images[i % len(images)]), MEDIA_POSTS)
+    for name, api in (('media_upload_naive', naive_api), ('media_upload_cached', cached_api)):
+        results[name].update(images=len(images), uploads=api.uploads, uploaded_bytes=api.uploaded_bytes)
+
+def bench_csv_import(tmpdir, results):
+    from csv_manager import insert_messages_from_csv
+    filename = os.path.join(tmpdir, 'import.csv')
+    write_csv(filename, CSV_ROWS, seed=12345)
+    # 実行ごとに別のアカウントへ取り込む（重複にならないように）
+    results['insert_messages_from_csv'] = measure(lambda i: insert_messages_from_csv(filename, 100000 + i), 3)
+    results['insert_messages_from_csv']['rows'] = CSV_ROWS
+
+# 同じメッセージ集を FANOUT_ACCOUNTS 件のアカウントに割り当てる（アカウントごとにCSVを取り込む場合と比べる）
+def bench_corpus_fanout(tmpdir, results):
+    from csv_manager import insert_messages_from_csv
+    filename = os.path.join(tmpdir, 'corpus.csv')
+    write_csv(filename, CSV_ROWS, seed=54321)
+    source = 200000
+    insert_messages_from_csv(filename, source)
+    results['corpus_fanout_import'] = measure(
+        lambda i: [insert_messages_from_csv(filename, 300000 + i * FANOUT_ACCOUNTS + j) for j in range(FANOUT_ACCOUNTS)], 1)
+    results['corpus_fanout_copy'] = measure(
+        lambda i: db_manager.copy_messages(source, range(400000 + i * FANOUT_ACCOUNTS, 400000 + (i + 1) * FANOUT_ACCOUNTS)), 3)
+    conn = db_manager.get_db_connection()
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    for name in ('corpus_fanout_import', 'corpus_fanout_copy'):
+        results[name].update(rows=CSV_ROWS, accounts=FANOUT_ACCOUNTS)
+    results['corpus_fanout_copy'].update(
+        db_bytes=conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+        contents=conn.execute("SELECT COUNT(*) FROM message_contents").fetchone()[0],
+        tweets=conn.execute("SELECT COUNT(*) FROM tweets").fetchone()[0])
+
+def bench_web(account_ids, results):
+    import app as web
+    logging.getLogger().setLevel(logging.WARNING)  # 計測中のデバッグログを抑える
+    web.app.secret_key = web.app.secret_key or 'benchmark'
+    client = web.app.test_client()
+    with client.session_transaction() as session:
+        session['account_id'] = account_ids[0]
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, url
+
+    cursor = db_manager.get_latest_change_seq(account_ids[0])
+    results['index'] = measure(lambda i: get('/'), 200)
+    results['messages_page'] = measure(lambda i: get(f"/messages?limit=100&after_id={i * 100 % 1000}"), 500)
+    results['messages_since'] = measure(lambda i: get(f"/messages?since={max(cursor - 50, 0)}"), 500)
+
+def bench_scheduler(results):
+    settings = {'interval_type': 'interval', 'interval': 3, 'specific_times': []}
+    items = [(account_id, settings, time.time() + 3600) for account_id in range(SCHEDULER_ACCOUNTS)]
+
+    def schedule_many(i):
+        scheduler = PostScheduler(lambda account_id: None)
+        scheduler.schedule_many(items)
+        scheduler.stop()
+
+    def fire_all(i):
+        fired = []
+        scheduler = PostScheduler(fired.append)
+        scheduler.schedule_many([(account_id, settings, 0) for account_id in range(SCHEDULER_ACCOUNTS)])
+        while len(fired) < SCHEDULER_ACCOUNTS:
+            time.sleep(0.001)
+        scheduler.stop()
+
+    results['scheduler_schedule_many'] = measure(schedule_many, 5)
+    results['scheduler_fire_all'] = measure(fire_all, 3)
+    results['scheduler_schedule_many']['accounts'] = results['scheduler_fire_all']['accounts'] = SCHEDULER_ACCOUNTS
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# 以前の結果と比べて、1秒あたりの回数の変化を表示する
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\n比較対象: {baseline_path} ({baseline.get('commit')})")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if before:
+            change = result['ops_per_sec'] / before['ops_per_sec'] - 1
+            print(f"{name:<28}{before['ops_per_sec']:>14.1f} -> {result['ops_per_sec']:>12.1f} ({change:+.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマークをまとめて実行する')
+    parser.add_argument('--accounts', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=2000, help='アカウントごとのメッセージ数')
+    parser.add_argument('--output', default=None, help='結果のJSONファイル（省略時は benchmarks/results/<コミット>.json）')
+    parser.add_argument('--compare', default=None, help='比較する以前の結果のJSONファイル')
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        start = time.perf_counter()
+        account_ids = create_database(os.path.join(tmpdir, 'tweets.db'), args.accounts, args.messages)
+        print(f"合成データを作成しました: {args.accounts}アカウント × {args.messages}件 ({time.perf_counter() - start:.1f}秒)")
+
+        bench_web(account_ids, results)  # 投稿で一覧が変わる前に計測する
+        bench_queue(account_ids, results)
+        bench_post_message(account_ids, results)
+        bench_csv_import(tmpdir, results)
+        bench_corpus_fanout(tmpdir, results)
+        bench_media_upload(tmpdir, account_ids, results)
+        bench_scheduler(results)
+        db_manager.close_db_connection()
+
+    print(f"{'処理':<28}{'中央値(ms)':>12}{'p95(ms)':>12}{'回/秒':>12}")
+    for name, result in results.items():
+        print(f"{name:<28}{result['median_ms']:>12.3f}{result['p95_ms']:>12.3f}{result['ops_per_sec']:>12.1f}")
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'commit': commit,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'params': {'accounts': args.accounts, 'messages': args.messages},
+            'results': results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を保存しました: {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import threading
+from metrics import registry
+
+_MISSING = object()
+
+
+class Cache:
+    """DBの読み込み結果を保持するキャッシュ（書き込み時に明示的に無効化する）"""
+
+    def __init__(self, name):
+        self.name = name
+        self._data = {}
+        self._lock = threading.Lock()
+        self._versions = {}   # キーごとの無効化回数
+        self._generation = 0  # 全体の無効化回数
+        self._synced_version = None  # 最後に確認したDB上のバージョン（cache_versions テーブル）
+        self.hits = 0
+        self.misses = 0
+
+    # キャッシュにあれば返し、なければ loader で読み込んで保存する
+    def get(self, key, loader):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+            version = self._version(key)
+        value = loader()
+        with self._lock:
+            # 読み込み中に無効化された場合は古い値を保存しない
+            if self._version(key) == version:
+                self._data[key] = value
+        return value
+
+    # キーを指定しなければ全て無効化する
+    def invalidate(self, key=_MISSING):
+        with self._lock:
+            if key is _MISSING:
+                self._clear()
+            else:
+                self._data.pop(key, None)
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    # DB上のバージョンが前回から変わっていれば全て無効化する
+    def sync(self, version):
+        with self._lock:
+            if version != self._synced_version:
+                self._synced_version = version
+                self._clear()
+
+    def _clear(self):
+        self._data.clear()
+        self._versions.clear()
+        self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def _version(self, key):
+        return (self._generation, self._versions.get(key, 0))
+
+
+accounts_cache = Cache('accounts')        # アカウント一覧とアカウント情報
+settings_cache = Cache('settings')        # 投稿間隔の設定
+auto_post_status_cache = Cache('auto_post_status')  # 自動投稿の状態
+
+CACHES = [accounts_cache, settings_cache, auto_post_status_cache]
+
+def get_cache_stats():
+    return {cache.name: cache.stats() for cache in CACHES}
+
+# 他のプロセスでの書き込みを反映する（versions はキャッシュ名 -> DB上のバージョン）
+def sync_cache_versions(versions):
+    for cache in CACHES:
+        cache.sync(versions.get(cache.name, 0))
+
+def invalidate_all_caches():
+    for cache in CACHES:
+        cache.invalidate()
+
+registry.gauge('tweetbot_cache_hits', 'キャッシュごとのヒット数', ['cache'],
+               callback=lambda: {(cache.name,): cache.hits for cache in CACHES})
+registry.gauge('tweetbot_cache_misses', 'キャッシュごとのミス数', ['cache'],
+               callback=lambda: {(cache.name,): cache.misses for cache in CACHES})
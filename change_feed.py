@@ -0,0 +1,154 @@
+import os
+import json
+import logging
+import threading
+from db_manager import (
+    add_change_listener, get_change_events, get_max_change_seq, get_account_stats, close_db_connection
+)
+
+logger = logging.getLogger(__name__)
+
+CHANGE_POLL_SECONDS = float(os.getenv('CHANGE_POLL_SECONDS', '1'))  # 他のプロセスの書き込みを確認する間隔（秒）
+HEARTBEAT_SECONDS = 15      # 変更がないときに接続維持のコメントを送る間隔（秒）
+CHANGE_BATCH_SIZE = 500     # 1回のクエリで読む変更の件数
+RECONNECT_MILLISECONDS = 3000  # 切断されたときにブラウザが再接続するまでの時間
+# 1プロセスで同時に開けるイベントストリームの数（超えた接続は断り、画面は /messages?since= の定期取得に切り替える）
+# ストリーム1本が開いている間はサーバーのワーカー（スレッド）を1つ占有するため、gunicorn では
+# --worker-class gthread（--threads をこの値より大きくする）か gevent で動かす。sync ワーカーでは数タブで埋まる
+MAX_EVENT_STREAMS = int(os.getenv('MAX_EVENT_STREAMS', '8'))
+
+
+class ChangeFeed:
+    """メッセージの変更を、イベントストリームで待っている接続に知らせる
+
+    このプロセスでの書き込みは db_manager から直接知らされる。他のプロセス（投稿ワーカーなど）の
+    書き込みは、待っている接続がある間だけ tweet_changes の最新の変更番号を確認して検知する。
+    """
+
+    def __init__(self, poll_seconds=CHANGE_POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self.version = 0        # 変更を検知した回数
+        self._subscribers = 0
+        self._last_seq = None   # 最後に確認した変更番号
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def notify(self, account_id=None):
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    # version から変わるか timeout 秒経つまで待ち、その時点の version を返す
+    def wait(self, version, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def subscribe(self):
+        with self._condition:
+            self._subscribers += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, name='change-feed', daemon=True)
+                self._thread.start()
+
+    # 同時に開いているストリームが上限未満か（厳密な上限ではなく、同時に接続されると少し超えることがある）
+    def has_capacity(self, max_streams=MAX_EVENT_STREAMS):
+        with self._condition:
+            return self._subscribers < max_streams
+
+    def unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+            self._condition.notify_all()
+
+    def _poll(self):
+        try:
+            while True:
+                try:
+                    seq = get_max_change_seq()
+                    if self._last_seq is not None and seq != self._last_seq:
+                        self.notify()
+                    self._last_seq = seq
+                except Exception as e:
+                    logger.error("変更番号の確認に失敗しました: %s", e)
+                with self._condition:
+                    self._condition.wait_for(lambda: not self._subscribers, self.poll_seconds)
+                    if not self._subscribers:
+                        self._thread = None
+                        self._last_seq = None
+                        return
+        finally:
+            close_db_connection()
+
+
+change_feed = ChangeFeed()
+add_change_listener(change_feed.notify)
+
+
+def format_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return '\n'.join(lines) + '\n\n'
+
+# since より後の変更をイベントにして返す（posted / inserted / edited / restored / deleted / reload / stats）
+def _pending_events(account_id, since):
+    events = []
+    restored = []  # 続けて未投稿に戻ったメッセージ（サイクルのリセットでは大量に発生するので1件のイベントにまとめる）
+    restored_seq = None
+    cursor = since
+
+    def flush_restored():
+        if restored:
+            events.append(format_event('restored', {'ids': list(restored)}, restored_seq))
+            restored.clear()
+
+    while True:
+        changes, cursor, reset = get_change_events(account_id, cursor, CHANGE_BATCH_SIZE)
+        if reset:
+            # 変更履歴が残っていない場合は一覧を読み込み直してもらう
+            return [format_event('reload', {'cursor': cursor}, cursor)], cursor
+        for change in changes:
+            op = change['op']
+            if op == 'restored':
+                if change['message'] is not None:
+                    restored.append(change['tweet_id'])
+                    restored_seq = change['seq']
+                continue
+            flush_restored()
+            if op == 'cycle_reset':
+                continue  # 未投稿に戻ったメッセージは restored で、周回数は stats で知らせる
+            if op != 'deleted' and change['message'] is None:
+                continue  # 後で削除されたメッセージは deleted で反映する
+            data = {'id': change['tweet_id']}
+            if op in ('posted', 'inserted', 'edited'):
+                data.update(message=change['message'], is_deleted=change['is_deleted'], media_path=change['media_path'])
+            events.append(format_event(op, data, change['seq']))
+        if len(changes) < CHANGE_BATCH_SIZE:
+            break
+    flush_restored()
+    if cursor != since:
+        # 件数の表示を更新する（スキップした変更も含めて再接続時の開始位置にする）
+        events.append(format_event('stats', get_account_stats(account_id), cursor))
+    return events, cursor
+
+# アカウントのメッセージの変更を Server-Sent Events 形式で送り続ける
+def stream_events(account_id, since, feed=change_feed, heartbeat=HEARTBEAT_SECONDS):
+    feed.subscribe()
+    try:
+        yield f"retry: {RECONNECT_MILLISECONDS}\n\n"
+        cursor = since
+        version = feed.version
+        while True:
+            events, cursor = _pending_events(account_id, cursor)
+            for event in events:
+                yield event
+            new_version = feed.wait(version, heartbeat)
+            if new_version == version:
+                yield ": keepalive\n\n"  # プロキシに切断されないよう定期的に送る
+            version = new_version
+    finally:
+        feed.unsubscribe()
+        close_db_connection()
@@ -1,58 +1,11 @@
-import sqlite3
-
-# データベースに接続（存在しない場合は新規作成）
-conn = sqlite3.connect('tweets.db')
-
-# カーソルオブジェクトを作成
-cursor = conn.cursor()
-
-# tweetsテーブルを作成（存在しない場合は新規作成）
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS tweets (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    message TEXT NOT NULL,
-    is_deleted INTEGER DEFAULT 0,
-    account_id INTEGER,
-    FOREIGN KEY(account_id) REFERENCES accounts(id)
-)
-''')
-
-# settingsテーブルを作成（存在しない場合は新規作成）
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS settings (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    interval_type TEXT,
-    interval INTEGER,
-    specific_time TEXT,
-    account_id INTEGER,
-    FOREIGN KEY(account_id) REFERENCES accounts(id)
-)
-''')
-
-# accountsテーブルを作成（存在しない場合は新規作成）
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS accounts (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    consumer_api_key TEXT NOT NULL,
-    consumer_api_secret TEXT NOT NULL,
-    bearer_token TEXT NOT NULL,
-    access_token TEXT NOT NULL,
-    access_token_secret TEXT NOT NULL
-)
-''')
-
-# auto_post_statusテーブルを作成（存在しない場合は新規作成）
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS auto_post_status (
-    account_id INTEGER PRIMARY KEY,
-    status BOOLEAN NOT NULL,
-    FOREIGN KEY (account_id) REFERENCES accounts (id)
-)
-''')
-
-# 変更を保存
-conn.commit()
-conn.close()
-
-print("データベースとテーブルが作成されました")
+from db_manager import get_db_connection
+from migrations import run_migrations, get_schema_version
+
+if __name__ == '__main__':
+    # データベースに接続（存在しない場合は新規作成）し、未適用のマイグレーションを適用
+    conn = get_db_connection()
+    applied = run_migrations(conn)
+    if applied:
+        print(f"データベースを更新しました: バージョン {get_schema_version(conn)} (適用: {', '.join(map(str, applied))})")
+    else:
+        print(f"データベースは最新です: バージョン {get_schema_version(conn)}")
@@ -1,46 +1,147 @@
-import csv
-from db_manager import get_db_connection
+import io
+import json
+import time
+import uuid
+import threading
+from db_manager import get_db_connection, close_db_connection, adjust_account_stats, notify_changes
+from import_manager import iter_file_records, iter_stream_records, iter_records, iter_table_chunks, is_supported_filename
 from flask import flash, redirect, url_for
-from werkzeug.utils import secure_filename
 import logging
-from db_manager import insert_messages_from_csv
 
+logger = logging.getLogger(__name__)
+
+CSV_CHUNK_SIZE = 500  # 1回のクエリで重複チェック・挿入する行数
+MAX_IMPORT_JOBS = 20  # 保持する取り込みジョブの最大数
+DUPLICATE_PREVIEW_SIZE = 5  # 進捗に表示する重複メッセージの件数
+
+# CSV / TSV / JSONL（gzip 圧縮も可）のファイルからメッセージを取り込み、重複したメッセージのリストを返す
 def insert_messages_from_csv(filename, account_id):
     failed_messages = []
-    with open(filename, newline='', encoding='utf-8') as csvfile:
-        reader = csv.reader(csvfile)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        for row in reader:
-            if row:  # 空の行を無視
-                cursor.execute("SELECT COUNT(*) FROM tweets WHERE message = ? AND account_id = ?", (row[0], account_id))
-                count = cursor.fetchone()[0]
-                if count == 0:
-                    cursor.execute("INSERT INTO tweets (message, account_id) VALUES (?, ?)", (row[0], account_id))
+    for _, duplicates in iter_insert_records(iter_file_records(filename), account_id):
+        failed_messages.extend(duplicates)
+    return failed_messages
+
+# レコードのリストを CSV_CHUNK_SIZE 件ずつに分ける
+def _batches(record_chunks, size):
+    for records in record_chunks:
+        for start in range(0, len(records), size):
+            yield records[start:start + size]
+
+# 変換済みのレコード（ImportRecord）をチャンク単位で挿入し、チャンクごとに（処理した行数, 重複したメッセージ）を返す
+# （行の変換はプロセスプールで並列に行い、書き込みはこの関数だけがまとめて行う）
+def iter_insert_records(record_chunks, account_id):
+    conn = get_db_connection()
+    for chunk in _batches(record_chunks, CSV_CHUNK_SIZE):
+        # チャンクごとにコミットし、長い取り込み中も他の書き込みを待たせない
+        with conn:
+            cursor = conn.cursor()
+            # 本文は全アカウントで共有するので、まだ保存されていない本文だけを追加する
+            cursor.executemany(
+                "INSERT OR IGNORE INTO message_contents (hash, body) VALUES (?, ?)",
+                [(record.hash, record.message) for record in chunk]
+            )
+            unique_hashes = {record.hash for record in chunk}
+            placeholders = ', '.join('?' * len(unique_hashes))
+            cursor.execute(f"SELECT id, hash FROM message_contents WHERE hash IN ({placeholders})", tuple(unique_hashes))
+            content_ids = {row['hash']: row['id'] for row in cursor.fetchall()}
+            cursor.execute(
+                f"SELECT content_id FROM tweets WHERE account_id = ? AND content_id IN ({placeholders})",
+                (account_id, *content_ids.values())
+            )
+            seen = {row['content_id'] for row in cursor.fetchall()}
+
+            duplicates = []
+            new_rows = []
+            for record in chunk:
+                content_id = content_ids[record.hash]
+                if content_id in seen:
+                    duplicates.append(record.message)
                 else:
-                    failed_messages.append(row[0])
-        conn.commit()
-        conn.close()
+                    seen.add(content_id)
+                    new_rows.append((content_id, account_id, record.weight, record.media_path, record.weight, record.tags,
+                                     record.priority, record.weight))
+            cursor.executemany("""
+            INSERT INTO tweets (content_id, account_id, shuffle_key, media_path, weight, tags, priority, draws_left)
+            VALUES (?, ?, weighted_key(?), ?, ?, ?, ?, draws_per_cycle(?))
+            """, new_rows)
+            adjust_account_stats(conn, account_id, total=len(new_rows), remaining=len(new_rows))
+        if new_rows:
+            notify_changes(account_id)
+        yield len(chunk), duplicates
+
+# CSVの行（文字列のリスト）のメッセージを挿入し、チャンクごとに（処理した行数, 重複したメッセージ）を返す
+def iter_insert_messages(rows, account_id):
+    return iter_insert_records(iter_records(iter_table_chunks(rows)), account_id)
+
+# メッセージを一括挿入し、重複したメッセージのリストを返す
+def insert_messages(rows, account_id):
+    failed_messages = []
+    for _, duplicates in iter_insert_messages(rows, account_id):
+        failed_messages.extend(duplicates)
     return failed_messages
 
+# 取り込みジョブを作成してバックグラウンドで実行（進捗はどのプロセスからも見えるようDBに保存する）
+def start_import_job(stream, account_id, filename=''):
+    job_id = uuid.uuid4().hex
+    conn = get_db_connection()
+    with conn:
+        # 完了済みの古いジョブを削除
+        conn.execute("""
+        DELETE FROM import_jobs WHERE account_id = ? AND status != 'running' AND id NOT IN (
+            SELECT id FROM import_jobs WHERE account_id = ? ORDER BY started_at DESC LIMIT ?
+        )
+        """, (account_id, account_id, MAX_IMPORT_JOBS - 1))
+        conn.execute("INSERT INTO import_jobs (id, account_id, filename, status, started_at) VALUES (?, ?, ?, 'running', ?)",
+                     (job_id, account_id, filename, time.time()))
+
+    thread = threading.Thread(target=_run_import_job, args=(job_id, stream, account_id, filename), daemon=True)
+    thread.start()
+    return job_id
+
+def _run_import_job(job_id, stream, account_id, filename=''):
+    conn = get_db_connection()
+    preview = []
+    try:
+        for processed, duplicates in iter_insert_records(iter_stream_records(stream, filename), account_id):
+            preview.extend(duplicates[:DUPLICATE_PREVIEW_SIZE - len(preview)])
+            with conn:
+                conn.execute("""
+                UPDATE import_jobs SET rows = rows + ?, inserted = inserted + ?, duplicates = duplicates + ?, duplicate_preview = ?
+                WHERE id = ?
+                """, (processed, processed - len(duplicates), len(duplicates), json.dumps(preview, ensure_ascii=False), job_id))
+        status = 'done'
+    except Exception as e:
+        logger.error("ファイルの取り込み中にエラーが発生しました: %s", e)
+        status = 'error'
+    finally:
+        stream.close()
+    try:
+        with conn:
+            conn.execute("UPDATE import_jobs SET status = ?, finished_at = ? WHERE id = ?", (status, time.time(), job_id))
+    finally:
+        close_db_connection()
+
+# アカウントの取り込みジョブの進捗を新しい順に取得
+def get_import_jobs(account_id):
+    cursor = get_db_connection().execute(
+        "SELECT * FROM import_jobs WHERE account_id = ? ORDER BY started_at DESC LIMIT ?", (account_id, MAX_IMPORT_JOBS))
+    return [dict(row, duplicate_preview=json.loads(row['duplicate_preview'])) for row in cursor.fetchall()]
+
 def upload_csv(file, current_account_id):
     try:
         if file.filename == '':
             flash('ファイルが選択されていません')
             return redirect(url_for('index'))
 
-        if file and file.filename.endswith('.csv'):
-            filename = secure_filename(file.filename)
-            file.save(filename)
-            failed_messages = insert_messages_from_csv(filename, current_account_id)
-            flash('CSVファイルのメッセージが追加されました')
-            if failed_messages:
-                # Limit the size of the flash message
-                failed_message_preview = ', '.join(failed_messages[:5])
-                flash(f"重複のため保存できなかったメッセージ: {failed_message_preview} 他 {len(failed_messages) - 5} 件" if len(failed_messages) > 5 else f"重複のため保存できなかったメッセージ: {failed_message_preview}")
+        if file and is_supported_filename(file.filename):
+            # リクエスト終了時にアップロードされたストリームが閉じられないよう切り離して取り込みジョブに渡す
+            stream = file.stream
+            file.stream = io.BytesIO()
+            start_import_job(stream, current_account_id, file.filename)
+            flash('CSVファイルの取り込みを開始しました')
         else:
-            flash('無効なファイル形式です。CSVファイルをアップロードしてください')
+            flash('無効なファイル形式です。CSV・TSV・JSONLファイル（gzip圧縮も可）をアップロードしてください')
     except Exception as e:
-        logging.error(f"CSVファイルのアップロード中にエラーが発生しました: {e}")
+        logger.error("CSVファイルのアップロード中にエラーが発生しました: %s", e)
         flash("CSVファイルのアップロード中にエラーが発生しました")
     return redirect(url_for('index'))
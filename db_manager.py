@@ -1,144 +1,599 @@
+import os
+import math
+import time
+import random
+import hashlib
 import sqlite3
 import logging
+import threading
+from cache_manager import accounts_cache, settings_cache, auto_post_status_cache, sync_cache_versions
+from metrics import registry, timed
 
-def get_db_connection():
-    conn = sqlite3.connect('tweets.db')
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv('TWEETS_DB_PATH', 'tweets.db')
+BUSY_TIMEOUT_MS = 5000  # ロック待ちの最大時間（ミリ秒）
+MAX_TWEET_CHANGES = 100000  # 保持するメッセージの変更履歴の件数
+MAX_DRAWS_PER_CYCLE = 10  # 1サイクルに同じメッセージを投稿する最大回数
+
+_local = threading.local()  # スレッドごとの接続を保持
+_change_listeners = []  # メッセージを書き換えた後に呼ぶ関数（アカウントIDを受け取る）
+
+# 新しい接続を作成してプラグマを設定
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")          # 読み込みと書き込みを並行して実行できるようにする
+    conn.execute("PRAGMA synchronous = NORMAL")        # WALモードではNORMALで十分な耐久性がある
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -16000")         # 約16MBのページキャッシュ
+    conn.create_function('weighted_key', 1, weighted_key)
+    conn.create_function('draws_per_cycle', 1, draws_per_cycle, deterministic=True)
+    return conn
+
+# スレッドごとに再利用される接続を取得
+def get_db_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _connect(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
     return conn
 
+# 重複チェック用のメッセージのハッシュ値（message_contents のキー）
+def message_hash(message):
+    return hashlib.sha1(message.encode('utf-8')).hexdigest()
+
+# 1サイクルに投稿する回数（重みを四捨五入した 1 〜 MAX_DRAWS_PER_CYCLE の整数）
+def draws_per_cycle(weight):
+    if not weight or weight <= 0:
+        return 1
+    return min(MAX_DRAWS_PER_CYCLE, max(1, math.floor(weight + 0.5)))
+
+# サイクルの最初の投稿順を決める shuffle_key の値（小さいほど先に投稿される）
+# d 回投稿するメッセージは [0, 1/d) の一様乱数から始め、投稿するたびに 1/d ずつ後ろにずらす（_CONSUME_DRAW）ので、
+# d 回の投稿がサイクル全体に散らばり、サイクルのどの時点でも重みに比例した回数だけ投稿されている
+# 1件ずつ取り出すときは (account_id, is_deleted, priority, shuffle_key) のインデックスの先頭を読むだけで済む
+def weighted_key(weight):
+    return random.random() / draws_per_cycle(weight)
+
+# 投稿したメッセージの残りの投稿回数を減らす SET 句（最後の1回で投稿済みにし、それまでは次の投稿位置にずらす）
+_CONSUME_DRAW = "draws_left = draws_left - 1, is_deleted = draws_left <= 1, shuffle_key = shuffle_key + 1.0 / draws_per_cycle(weight)"
+
+# 本文を message_contents に保存してIDを返す（同じ本文があればそのIDを返す。呼び出し元のトランザクション内で実行する）
+def get_content_id(conn, message):
+    return conn.execute("""
+    INSERT INTO message_contents (hash, body) VALUES (?, ?)
+    ON CONFLICT (hash) DO UPDATE SET hash = excluded.hash
+    RETURNING id
+    """, (message_hash(message), message)).fetchone()['id']
+
+# どのアカウントのメッセージにも使われなくなった本文を削除する（呼び出し元のトランザクション内で実行する）
+def prune_message_contents(conn, content_ids):
+    conn.executemany("""
+    DELETE FROM message_contents
+    WHERE id = ? AND NOT EXISTS (SELECT 1 FROM tweets WHERE content_id = ?)
+    """, [(content_id, content_id) for content_id in set(content_ids)])
+
+# メッセージの変更を知らせる関数を登録する（他のプロセスの書き込みは tweet_changes で検知する）
+def add_change_listener(listener):
+    _change_listeners.append(listener)
+
+# メッセージを書き換えたトランザクションのコミット後に呼ぶ
+def notify_changes(account_id):
+    for listener in _change_listeners:
+        try:
+            listener(account_id)
+        except Exception as e:
+            logger.error("変更の通知に失敗しました: アカウント %s: %s", account_id, e)
+
+# 現在のスレッドの接続を閉じる
+def close_db_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@timed
 def get_all_account_ids():
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT id FROM accounts')
     account_ids = [row['id'] for row in cursor.fetchall()]
-    conn.close()
     return account_ids
 
+@timed
 def get_account(account_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM accounts WHERE id = ?", (account_id,))
-    account = cursor.fetchone()
-    conn.close()
-    return account
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM accounts WHERE id = ?", (account_id,))
+        return cursor.fetchone()
+    return accounts_cache.get(account_id, load)
 
+@timed
+def get_accounts():
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM accounts")
+        return cursor.fetchall()
+    return accounts_cache.get('all', load)
+
+@timed
 def get_settings(account_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT interval_type, interval, specific_time FROM settings WHERE account_id = ?", (account_id,))
-    settings = cursor.fetchall()
-    conn.close()
-    return settings
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT interval_type, interval, specific_time FROM settings WHERE account_id = ?", (account_id,))
+        return cursor.fetchall()
+    return settings_cache.get(account_id, load)
 
+@timed
 def get_auto_post_status(account_id):
+    def load():
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT status FROM auto_post_status WHERE account_id = ?', (account_id,))
+        return cursor.fetchone()
+    return auto_post_status_cache.get(account_id, load)
+
+# アカウントの件数集計を増減する（呼び出し元のトランザクション内で実行する）
+def adjust_account_stats(conn, account_id, total=0, remaining=0):
+    conn.execute("""
+    INSERT INTO account_stats (account_id, total, remaining, posted) VALUES (?, ?, ?, ?)
+    ON CONFLICT (account_id) DO UPDATE SET
+        total = total + excluded.total,
+        remaining = remaining + excluded.remaining,
+        posted = posted + excluded.posted
+    """, (account_id, total, remaining, total - remaining))
+
+# アカウントの件数集計を取得
+@timed
+def get_account_stats(account_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT status FROM auto_post_status WHERE account_id = ?', (account_id,))
-    status_row = cursor.fetchone()
-    conn.close()
-    return status_row
+    cursor.execute("SELECT total, remaining, posted, cycle FROM account_stats WHERE account_id = ?", (account_id,))
+    stats = cursor.fetchone()
+    if stats:
+        return dict(stats)
+    return {'total': 0, 'remaining': 0, 'posted': 0, 'cycle': 0}
 
+# 優先度の高い順、同じ優先度ではシャッフルした順に次の未投稿メッセージを取り出し、1つの文で投稿回数を減らす
+# （重みの回数だけ投稿したメッセージは投稿済みになる）
+@timed
 def get_message(account_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, message FROM tweets WHERE is_deleted = 0 AND account_id = ? ORDER BY RANDOM() LIMIT 1", (account_id,))
-    result = cursor.fetchone()
-    if result:
-        cursor.execute("UPDATE tweets SET is_deleted = 1 WHERE id = ?", (result['id'],))
-        conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.execute(f"""
+        UPDATE tweets SET {_CONSUME_DRAW}
+        WHERE id = (
+            SELECT id FROM tweets
+            WHERE account_id = ? AND is_deleted = 0
+            ORDER BY priority DESC, shuffle_key
+            LIMIT 1
+        )
+        RETURNING (SELECT body FROM message_contents WHERE id = content_id) AS message, is_deleted
+        """, (account_id,))
+        result = cursor.fetchone()
+        if result and result['is_deleted']:
+            adjust_account_stats(conn, account_id, remaining=-1)
+    if result and result['is_deleted']:
+        notify_changes(account_id)
     return result['message'] if result else None
 
+# 未投稿のメッセージを1件、lease_seconds 秒のリース付きで確保する（投稿済みにはしない）
+@timed
+def claim_message(account_id, lease_seconds, now=None):
+    if now is None:
+        now = time.time()
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute("""
+        UPDATE tweets SET claimed_until = ?, attempts = attempts + 1
+        WHERE id = (
+            SELECT id FROM tweets
+            WHERE account_id = ? AND is_deleted = 0
+              AND (claimed_until IS NULL OR claimed_until <= ?)
+              AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+            ORDER BY priority DESC, shuffle_key
+            LIMIT 1
+        )
+        RETURNING id, (SELECT body FROM message_contents WHERE id = content_id) AS message, attempts, media_path, content_id
+        """, (now + lease_seconds, account_id, now, now))
+        return cursor.fetchone()
+
+# 投稿に成功したメッセージの投稿回数を減らす（重みの回数だけ投稿したら投稿済みにする）
+@timed
+def ack_message(tweet_id):
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute(f"""
+        UPDATE tweets SET {_CONSUME_DRAW}, claimed_until = NULL, next_attempt_at = NULL, attempts = 0
+        WHERE id = ? AND is_deleted = 0
+        RETURNING account_id, is_deleted
+        """, (tweet_id,))
+        result = cursor.fetchone()
+        if result and result['is_deleted']:
+            adjust_account_stats(conn, result['account_id'], remaining=-1)
+    if result and result['is_deleted']:
+        notify_changes(result['account_id'])
+    return result is not None
+
+# 投稿できないメッセージを諦め、投稿済みと同じく今のサイクルから外す
+# （failed_at が付いたメッセージは編集されるまで次のサイクルでも投稿しない）
+@timed
+def fail_message(tweet_id, error, now=None):
+    if now is None:
+        now = time.time()
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute("""
+        UPDATE tweets SET is_deleted = 1, draws_left = 0, claimed_until = NULL, next_attempt_at = NULL, failed_at = ?, last_error = ?
+        WHERE id = ? AND is_deleted = 0
+        RETURNING account_id
+        """, (now, error, tweet_id))
+        result = cursor.fetchone()
+        if result:
+            adjust_account_stats(conn, result['account_id'], remaining=-1)
+    if result:
+        notify_changes(result['account_id'])
+    return result is not None
+
+# 投稿に失敗したメッセージのリースを外し、retry_at 以降に再び確保できるようにする
+@timed
+def release_message(tweet_id, retry_at=None):
+    conn = get_db_connection()
+    with conn:
+        conn.execute("UPDATE tweets SET claimed_until = NULL, next_attempt_at = ? WHERE id = ?", (retry_at, tweet_id))
+
+# 全メッセージを未投稿に戻して重みの回数だけ投稿できるようにし、次のサイクル用に順序をシャッフルし直す
+@timed
 def reset_messages(account_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE tweets SET is_deleted = 0 WHERE account_id = ?", (account_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("""
+        UPDATE tweets SET is_deleted = failed_at IS NOT NULL, draws_left = CASE WHEN failed_at IS NULL THEN draws_per_cycle(weight) ELSE 0 END,
+            shuffle_key = weighted_key(weight), claimed_until = NULL, next_attempt_at = NULL, attempts = 0
+        WHERE account_id = ?
+        """, (account_id,))
+        # 投稿を諦めたメッセージは未投稿に戻さない
+        failed = conn.execute("SELECT COUNT(*) FROM tweets WHERE account_id = ? AND failed_at IS NOT NULL", (account_id,)).fetchone()[0]
+        conn.execute("UPDATE account_stats SET remaining = total - ?, posted = ?, cycle = cycle + 1 WHERE account_id = ?",
+                     (failed, failed, account_id))
+        # 未投稿に戻ったメッセージがなくても（全て投稿を諦めた場合）画面の件数が更新されるよう、リセットしたことも記録する
+        conn.execute("INSERT INTO tweet_changes (account_id, tweet_id, op) VALUES (?, 0, 'cycle_reset')", (account_id,))
+    notify_changes(account_id)
+    prune_tweet_changes()
 
+# 他のプロセスのキャッシュも無効化されるよう、書き込みと同じトランザクションでバージョンを上げる
+def bump_cache_version(conn, cache):
+    conn.execute("""
+    INSERT INTO cache_versions (name, version) VALUES (?, 1)
+    ON CONFLICT(name) DO UPDATE SET version = version + 1
+    """, (cache.name,))
+
+# 他のプロセスの書き込みでバージョンが変わったキャッシュを無効化する（リクエストの開始時に呼ぶ）
+@timed
+def sync_caches():
+    rows = get_db_connection().execute("SELECT name, version FROM cache_versions").fetchall()
+    versions = {row['name']: row['version'] for row in rows}
+    sync_cache_versions(versions)
+    return versions
+
+@timed
 def insert_account(name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-    INSERT INTO accounts (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret)
-    VALUES (?, ?, ?, ?, ?, ?)
-    ''', (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute('''
+        INSERT INTO accounts (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret))
+        bump_cache_version(conn, accounts_cache)
+    accounts_cache.invalidate()
 
+@timed
 def update_account(name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret, account_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-    UPDATE accounts
-    SET name = ?, consumer_api_key = ?, consumer_api_secret = ?, bearer_token = ?, access_token = ?, access_token_secret = ?
-    WHERE id = ?
-    """, (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret, account_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("""
+        UPDATE accounts
+        SET name = ?, consumer_api_key = ?, consumer_api_secret = ?, bearer_token = ?, access_token = ?, access_token_secret = ?
+        WHERE id = ?
+        """, (name, consumer_api_key, consumer_api_secret, bearer_token, access_token, access_token_secret, account_id))
+        bump_cache_version(conn, accounts_cache)
+    accounts_cache.invalidate()
 
-def insert_message(message, account_id):
+# メッセージを追加（同じアカウントに同じメッセージがある場合は追加せずFalseを返す）
+# weight はメッセージを1サイクルに投稿する回数（draws_per_cycle を参照）、priority が大きいメッセージは小さいものより先に投稿される
+@timed
+def insert_message(message, account_id, media_path=None, weight=1, priority=0):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO tweets (message, account_id) VALUES (?, ?)", (message, account_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        content_id = get_content_id(conn, message)
+        cursor = conn.execute("""
+        INSERT OR IGNORE INTO tweets (content_id, account_id, shuffle_key, media_path, weight, priority, draws_left)
+        VALUES (?, ?, weighted_key(?), ?, ?, ?, draws_per_cycle(?))
+        """, (content_id, account_id, weight, media_path, weight, priority, weight))
+        if cursor.rowcount > 0:
+            adjust_account_stats(conn, account_id, total=1, remaining=1)
+    if cursor.rowcount > 0:
+        notify_changes(account_id)
+    return cursor.rowcount > 0
 
+@timed
 def set_interval(interval_type, interval, specific_times, account_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM settings WHERE account_id = ?", (account_id,))
-    if interval_type == 'interval':
-        cursor.execute("INSERT INTO settings (interval_type, interval, account_id) VALUES (?, ?, ?)", (interval_type, interval, account_id))
-    else:
-        for time_value in specific_times:
-            cursor.execute("INSERT INTO settings (interval_type, specific_time, account_id) VALUES (?, ?, ?)", (interval_type, time_value, account_id))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM settings WHERE account_id = ?", (account_id,))
+        if interval_type == 'interval':
+            cursor.execute("INSERT INTO settings (interval_type, interval, account_id) VALUES (?, ?, ?)", (interval_type, interval, account_id))
+        else:
+            for time_value in specific_times:
+                cursor.execute("INSERT INTO settings (interval_type, specific_time, account_id) VALUES (?, ?, ?)", (interval_type, time_value, account_id))
+        # 古い設定で計算した次回の投稿時刻は使わない（新しいリーダーは新しい設定から計算し直す）
+        cursor.execute("DELETE FROM schedule_state WHERE account_id = ?", (account_id,))
+        bump_cache_version(conn, settings_cache)
+    settings_cache.invalidate(account_id)
 
+@timed
 def update_auto_post_status(account_id, status):
     conn = get_db_connection()
-    conn.execute('INSERT OR REPLACE INTO auto_post_status (account_id, status) VALUES (?, ?)', (account_id, status))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO auto_post_status (account_id, status) VALUES (?, ?)', (account_id, status))
+        bump_cache_version(conn, auto_post_status_cache)
+    auto_post_status_cache.invalidate(account_id)
+
+# 全アカウントの自動投稿状態・設定・保存済みの次回投稿時刻を1回のクエリで取得（起動時の読み込み用）
+@timed
+def get_auto_post_rows():
+    conn = get_db_connection()
+    cursor = conn.execute("""
+    SELECT a.id AS account_id, COALESCE(s.status, 0) AS status, n.next_fire_at,
+           t.interval_type, t.interval, t.specific_time
+    FROM accounts a
+    LEFT JOIN auto_post_status s ON s.account_id = a.id
+    LEFT JOIN schedule_state n ON n.account_id = a.id
+    LEFT JOIN settings t ON t.account_id = a.id
+    ORDER BY a.id, t.id
+    """)
+    return cursor.fetchall()
+
+# 画像の変換結果を取得（元のファイルが変わっていれば None）
+@timed
+def get_media_variant(source_path, mtime_ns, size):
+    conn = get_db_connection()
+    return conn.execute("""
+    SELECT variant_hash, mime_type, size FROM media_variants
+    WHERE source_path = ? AND source_mtime_ns = ? AND source_size = ?
+    """, (source_path, mtime_ns, size)).fetchone()
+
+@timed
+def save_media_variant(source_path, mtime_ns, size, variant_hash, mime_type, variant_size):
+    conn = get_db_connection()
+    with conn:
+        conn.execute("""
+        INSERT OR REPLACE INTO media_variants (source_path, source_mtime_ns, source_size, variant_hash, mime_type, size)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (source_path, mtime_ns, size, variant_hash, mime_type, variant_size))
+
+# 期限内のアップロード済み media_id を取得（なければ None）
+@timed
+def get_media_upload(variant_hash, owner, now=None):
+    if now is None:
+        now = time.time()
+    conn = get_db_connection()
+    row = conn.execute(
+        "SELECT media_id FROM media_uploads WHERE variant_hash = ? AND owner = ? AND expires_at > ?",
+        (variant_hash, owner, now)
+    ).fetchone()
+    return row['media_id'] if row else None
+
+# アップロードした media_id を使えるアカウント（owners）ごとに保存し、期限切れのものを削除する
+@timed
+def save_media_upload(variant_hash, owners, media_id, expires_at, now=None):
+    if now is None:
+        now = time.time()
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("""
+        INSERT OR REPLACE INTO media_uploads (variant_hash, owner, media_id, expires_at) VALUES (?, ?, ?, ?)
+        """, [(variant_hash, owner, media_id, expires_at) for owner in owners])
+        conn.execute("DELETE FROM media_uploads WHERE expires_at <= ?", (now,))
+
+# アカウントごとの未投稿メッセージ数（キューの長さ）
+@timed
+def get_queue_depths():
+    conn = get_db_connection()
+    cursor = conn.execute("SELECT account_id, remaining FROM account_stats")
+    return {row['account_id']: row['remaining'] for row in cursor.fetchall()}
 
-def get_messages(account_id):
+# 次回の投稿時刻をまとめて保存（items は (アカウントID, エポック秒) のリスト）
+@timed
+def save_next_fire_times(items):
+    conn = get_db_connection()
+    with conn:
+        conn.executemany("""
+        INSERT INTO schedule_state (account_id, next_fire_at) VALUES (?, ?)
+        ON CONFLICT(account_id) DO UPDATE SET next_fire_at = excluded.next_fire_at
+        """, items)
+
+# メッセージをID順に取得（limitを指定した場合はafter_idより後のlimit件）
+@timed
+def get_messages(account_id, after_id=0, limit=None):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, message, is_deleted FROM tweets WHERE account_id = ?", (account_id,))
+    if limit is None:
+        cursor.execute("""
+        SELECT t.id, c.body AS message, t.is_deleted, t.media_path
+        FROM tweets t JOIN message_contents c ON c.id = t.content_id
+        WHERE t.account_id = ? ORDER BY t.id
+        """, (account_id,))
+    else:
+        cursor.execute("""
+        SELECT t.id, c.body AS message, t.is_deleted, t.media_path
+        FROM tweets t JOIN message_contents c ON c.id = t.content_id
+        WHERE t.account_id = ? AND t.id > ? ORDER BY t.id LIMIT ?
+        """, (account_id, after_id, limit))
     messages = cursor.fetchall()
-    conn.close()
     return messages
 
-def delete_message(id, account_id):
+# アカウントの最新の変更番号を取得（変更がなければ0）
+@timed
+def get_latest_change_seq(account_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM tweets WHERE id = ? AND account_id = ?", (id, account_id))
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT MAX(seq) FROM tweet_changes WHERE account_id = ?", (account_id,))
+    return cursor.fetchone()[0] or 0
 
-def update_message(new_message, id, account_id):
+# since より後の変更を取得し、(変更されたメッセージ, 削除されたID, 最後の変更番号, 続きがあるか, 履歴が失われているか) を返す
+@timed
+def get_message_changes(account_id, since, limit):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("UPDATE tweets SET message = ? WHERE id = ? AND account_id = ?", (new_message, id, account_id))
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT MIN(seq) FROM tweet_changes")
+    oldest_seq = cursor.fetchone()[0]
+    if oldest_seq is not None and since < oldest_seq - 1:
+        return [], [], since, False, True
+
+    cursor.execute("""
+    SELECT c.seq, c.tweet_id, c.op, m.body AS message, t.is_deleted, t.media_path
+    FROM tweet_changes c LEFT JOIN tweets t ON t.id = c.tweet_id LEFT JOIN message_contents m ON m.id = t.content_id
+    WHERE c.account_id = ? AND c.seq > ?
+    ORDER BY c.seq
+    LIMIT ?
+    """, (account_id, since, limit))
+    rows = cursor.fetchall()
+
+    # 同じメッセージへの複数の変更は最後の状態だけを返す
+    changed = {}
+    deleted_ids = set()
+    for row in rows:
+        if row['op'] == 'cycle_reset':
+            continue  # 各メッセージの変更も記録されている
+        if row['message'] is None:
+            changed.pop(row['tweet_id'], None)
+            deleted_ids.add(row['tweet_id'])
+        else:
+            deleted_ids.discard(row['tweet_id'])
+            changed[row['tweet_id']] = {'id': row['tweet_id'], 'message': row['message'], 'is_deleted': row['is_deleted'],
+                                        'media_path': row['media_path']}
+    cursor_seq = rows[-1]['seq'] if rows else since
+    return list(changed.values()), sorted(deleted_ids), cursor_seq, len(rows) == limit, False
+
+# since より後の変更を変更番号順に取得し、(変更のリスト, 最後の変更番号, 履歴が失われているか) を返す
+# （各変更にはメッセージの現在の状態を付ける。削除済みのメッセージは message が None）
+@timed
+def get_change_events(account_id, since, limit):
+    conn = get_db_connection()
+    oldest_seq = conn.execute("SELECT MIN(seq) FROM tweet_changes").fetchone()[0]
+    if oldest_seq is not None and since < oldest_seq - 1:
+        return [], get_latest_change_seq(account_id), True
+    rows = conn.execute("""
+    SELECT c.seq, c.tweet_id, c.op, m.body AS message, t.is_deleted, t.media_path
+    FROM tweet_changes c LEFT JOIN tweets t ON t.id = c.tweet_id LEFT JOIN message_contents m ON m.id = t.content_id
+    WHERE c.account_id = ? AND c.seq > ?
+    ORDER BY c.seq
+    LIMIT ?
+    """, (account_id, since, limit)).fetchall()
+    return [dict(row) for row in rows], rows[-1]['seq'] if rows else since, False
+
+# 全アカウントの最新の変更番号（他のプロセスの書き込みの検知用）
+@timed
+def get_max_change_seq():
+    return get_db_connection().execute("SELECT MAX(seq) FROM tweet_changes").fetchone()[0] or 0
+
+# 古い変更履歴を削除する
+@timed
+def prune_tweet_changes(keep=MAX_TWEET_CHANGES):
+    conn = get_db_connection()
+    with conn:
+        conn.execute("DELETE FROM tweet_changes WHERE seq <= (SELECT MAX(seq) FROM tweet_changes) - ?", (keep,))
+
+@timed
+def delete_message(id, account_id):
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute("DELETE FROM tweets WHERE id = ? AND account_id = ? RETURNING is_deleted, content_id", (id, account_id))
+        deleted = cursor.fetchone()
+        if deleted:
+            adjust_account_stats(conn, account_id, total=-1, remaining=0 if deleted['is_deleted'] else -1)
+            prune_message_contents(conn, [deleted['content_id']])
+    if deleted:
+        notify_changes(account_id)
+
+@timed
+def update_message(new_message, id, account_id):
+    conn = get_db_connection()
+    with conn:
+        # 他のアカウントと共有している本文は書き換えず、このメッセージだけ新しい本文を参照させる
+        old = conn.execute("SELECT content_id, failed_at FROM tweets WHERE id = ? AND account_id = ?", (id, account_id)).fetchone()
+        if old is None:
+            return
+        content_id = get_content_id(conn, new_message)
+        conn.execute("UPDATE tweets SET content_id = ? WHERE id = ? AND account_id = ?", (content_id, id, account_id))
+        if old['failed_at'] is not None:
+            # 投稿を諦めたメッセージは編集されたら未投稿に戻して再び投稿する
+            conn.execute("""
+            UPDATE tweets SET is_deleted = 0, draws_left = draws_per_cycle(weight), failed_at = NULL, last_error = NULL, attempts = 0
+            WHERE id = ?
+            """, (id,))
+            adjust_account_stats(conn, account_id, remaining=1)
+        prune_message_contents(conn, [old['content_id']])
+    notify_changes(account_id)
 
 def insert_messages_from_csv(filename, account_id):
     # この関数は csv_manager.py に移動しました
     pass
 
+@timed
 def delete_all_messages(account_id):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM tweets WHERE account_id = ?", (account_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        cursor = conn.execute("DELETE FROM tweets WHERE account_id = ? RETURNING content_id", (account_id,))
+        prune_message_contents(conn, [row['content_id'] for row in cursor.fetchall()])
+        conn.execute("UPDATE account_stats SET total = 0, remaining = 0, posted = 0 WHERE account_id = ?", (account_id,))
+    notify_changes(account_id)
+    prune_tweet_changes()
 
+@timed
 def get_tweets(account_id):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, message, is_deleted FROM tweets WHERE account_id = ?", (account_id,))
+    cursor.execute("""
+    SELECT t.id, c.body AS message, t.is_deleted
+    FROM tweets t JOIN message_contents c ON c.id = t.content_id
+    WHERE t.account_id = ? ORDER BY t.id
+    """, (account_id,))
     messages = cursor.fetchall()
-    conn.close()
     return messages
+
+# source_account_id のメッセージを各アカウントに割り当て、{アカウントID: 追加した件数} を返す
+# （本文は共有するのでアカウントごとにコピーせず、1つの INSERT ... SELECT で済む。既にある本文は追加しない）
+@timed
+def copy_messages(source_account_id, target_account_ids):
+    conn = get_db_connection()
+    inserted = {}
+    with conn:
+        for account_id in target_account_ids:
+            if account_id == source_account_id:
+                continue
+            cursor = conn.execute("""
+            INSERT OR IGNORE INTO tweets (content_id, account_id, shuffle_key, media_path, weight, tags, priority, draws_left)
+            SELECT content_id, ?, weighted_key(weight), media_path, weight, tags, priority, draws_per_cycle(weight)
+            FROM tweets WHERE account_id = ? ORDER BY id
+            """, (account_id, source_account_id))
+            inserted[account_id] = cursor.rowcount
+            adjust_account_stats(conn, account_id, total=cursor.rowcount, remaining=cursor.rowcount)
+    for account_id, count in inserted.items():
+        if count:
+            notify_changes(account_id)
+    prune_tweet_changes()
+    return inserted
+
+registry.gauge('tweetbot_queue_depth', 'アカウントごとの未投稿メッセージ数', ['account_id'],
+               callback=lambda: {(account_id,): remaining for account_id, remaining in get_queue_depths().items()})
@@ -0,0 +1,321 @@
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import atexit
+import shutil
+import logging
+import tempfile
+import threading
+from db_manager import get_db_connection, close_db_connection
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BATCH_SIZE = 500          # 1回のトランザクションで書き込む最大件数
+HISTORY_FLUSH_SECONDS = 1.0       # 件数が揃わなくても書き込むまでの時間（秒）
+HISTORY_QUEUE_SIZE = 10000        # 書き込み待ちの上限（超えた分は捨てて投稿を止めない）
+HISTORY_ARCHIVE_INTERVAL_SECONDS = 3600  # 古い月の保管を確認する間隔（秒）
+HISTORY_ARCHIVE_STALE_SECONDS = 3600     # 保管中のまま止まった月をやり直すまでの時間（秒）
+HISTORY_RETENTION_MONTHS = int(os.getenv('HISTORY_RETENTION_MONTHS', '3'))  # DBに残す月数（今月を含む）
+HISTORY_ARCHIVE_DIR = os.getenv('HISTORY_ARCHIVE_DIR', 'history_archive')   # 保管した月の gzip 圧縮 JSONL の保存先
+
+OUTCOMES = ('posted', 'duplicate', 'failed', 'rejected', 'rate_limited')
+# message は記録した時点の本文（後で本文が編集・削除されても履歴は変わらない）
+COLUMNS = ('account_id', 'message_id', 'content_id', 'message', 'tweet_id', 'posted_at', 'latency_ms', 'outcome')
+_POSTED_AT = COLUMNS.index('posted_at')
+
+_MONTH_PATTERN = re.compile(r'^\d{6}$')
+_FLUSH = object()
+_STOP = object()
+
+history_records_total = registry.counter(
+    'tweetbot_history_records_total', '投稿履歴の件数（written / dropped / failed）', ['result'])
+history_archived_total = registry.counter(
+    'tweetbot_history_archived_partitions_total', 'ファイルに保管して削除した月ごとの履歴テーブルの数')
+
+
+# UNIX時間が属する月（UTC、YYYYMM）
+def partition_month(timestamp):
+    return time.strftime('%Y%m', time.gmtime(timestamp))
+
+# 月を delta か月ずらす
+def shift_month(month, delta):
+    index = int(month[:4]) * 12 + int(month[4:]) - 1 + delta
+    return f"{index // 12:04d}{index % 12 + 1:02d}"
+
+# 月ごとの履歴テーブルの名前（テーブル名は埋め込むしかないので形式を確認する）
+def partition_table(month):
+    if not _MONTH_PATTERN.match(month):
+        raise ValueError(f"月の形式が正しくありません: {month}")
+    return f"post_history_{month}"
+
+def archive_path(month):
+    return os.path.join(HISTORY_ARCHIVE_DIR, f"{partition_table(month)}.jsonl.gz")
+
+# 月のテーブルがなければ作成して一覧に登録する（保管済みの月に書き込む場合は再び live に戻す）
+def ensure_partition(conn, month):
+    table = partition_table(month)
+    conn.execute(f'''
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY,
+        account_id INTEGER NOT NULL,
+        message_id INTEGER,
+        content_id INTEGER,
+        message TEXT,
+        tweet_id TEXT,
+        posted_at REAL NOT NULL,
+        latency_ms REAL,
+        outcome TEXT NOT NULL
+    )
+    ''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_account ON {table} (account_id, posted_at)")
+    conn.execute("""
+    INSERT INTO post_history_partitions (month, status) VALUES (?, 'live')
+    ON CONFLICT(month) DO UPDATE SET status = 'live' WHERE status = 'archived'
+    """, (month,))
+    return table
+
+# 履歴を月ごとのテーブルに1つのトランザクションで書き込む（rows は COLUMNS の順のタプル）
+def write_history(rows):
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(partition_month(row[_POSTED_AT]), []).append(row)
+    conn = get_db_connection()
+    with conn:
+        for month, month_rows in by_month.items():
+            table = ensure_partition(conn, month)
+            conn.executemany(f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", month_rows)
+            conn.execute("UPDATE post_history_partitions SET rows = rows + ? WHERE month = ?", (len(month_rows), month))
+    return len(rows)
+
+
+class HistoryWriter:
+    """投稿の結果をキューに入れ、別スレッドでまとめて書き込む（投稿するスレッドはDBへの書き込みを待たない）"""
+
+    def __init__(self, batch_size=HISTORY_BATCH_SIZE, flush_seconds=HISTORY_FLUSH_SECONDS, maxsize=HISTORY_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._next_archive = 0.0
+
+    # 投稿1件の結果を書き込み待ちにする（キューがいっぱいなら捨てる）
+    def record(self, account_id, message_id, content_id, message, tweet_id, latency_ms, outcome, posted_at=None):
+        if posted_at is None:
+            posted_at = time.time()
+        self._start()
+        try:
+            self.queue.put_nowait((account_id, message_id, content_id, message, tweet_id, posted_at, latency_ms, outcome))
+        except queue.Full:
+            history_records_total.inc(result='dropped')
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                items = [self.queue.get()]
+                deadline = time.monotonic() + self.flush_seconds
+                # 件数が揃うか時間が来るか、flush / stop が呼ばれるまで集める
+                while items[-1] is not _FLUSH and items[-1] is not _STOP and len(items) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        items.append(self.queue.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+                self._write([item for item in items if item is not _FLUSH and item is not _STOP])
+                for _ in items:
+                    self.queue.task_done()
+                if items[-1] is _STOP:
+                    return
+                self._maybe_archive()
+        finally:
+            close_db_connection()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            history_records_total.inc(write_history(batch), result='written')
+        except Exception as e:
+            history_records_total.inc(len(batch), result='failed')
+            logger.error("投稿履歴の書き込みでエラーが発生しました: %s件: %s", len(batch), e)
+
+    def _maybe_archive(self):
+        now = time.time()
+        if now < self._next_archive:
+            return
+        self._next_archive = now + HISTORY_ARCHIVE_INTERVAL_SECONDS
+        try:
+            archive_partitions(now)
+        except Exception as e:
+            logger.error("投稿履歴の保管でエラーが発生しました: %s", e)
+
+    # 書き込み待ちの履歴をすぐに書き込み、終わるまで待つ
+    def flush(self):
+        if self._thread is None:
+            return
+        self._start()
+        self.queue.put(_FLUSH)
+        self.queue.join()
+
+    # 残りを書き込んでスレッドを止める
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        thread.join()
+
+    def get_metrics(self):
+        return {'queued': self.queue.qsize(), 'running': bool(self._thread and self._thread.is_alive())}
+
+
+# 投稿履歴を新しい順に取得する（DBに残っている月だけ。include_archived なら保管したファイルも読む）
+def get_post_history(account_id, limit=100, before=None, include_archived=False):
+    conn = get_db_connection()
+    if before is None:
+        before = time.time() + 1
+    partitions = conn.execute(
+        "SELECT month, status FROM post_history_partitions WHERE month <= ? ORDER BY month DESC",
+        (partition_month(before),)
+    ).fetchall()
+    history = []
+    for partition in partitions:
+        if len(history) >= limit:
+            break
+        if partition['status'] != 'archived':
+            rows = conn.execute(f"""
+            SELECT account_id, message_id, content_id, message, tweet_id, posted_at, latency_ms, outcome
+            FROM {partition_table(partition['month'])}
+            WHERE account_id = ? AND posted_at < ?
+            ORDER BY posted_at DESC, id DESC
+            LIMIT ?
+            """, (account_id, before, limit - len(history))).fetchall()
+            history.extend(dict(row) for row in rows)
+        elif include_archived:
+            rows = [row for row in read_archive(partition['month'])
+                    if row['account_id'] == account_id and row['posted_at'] < before]
+            rows.sort(key=lambda row: row['posted_at'], reverse=True)
+            history.extend(rows[:limit - len(history)])
+    return history
+
+# 月ごと・結果ごとの投稿数と平均の処理時間（保管済みの月は集計だけが残る）
+def get_post_summary(account_id):
+    conn = get_db_connection()
+    summary = [dict(row) for row in conn.execute("""
+    SELECT month, outcome, posts, total_latency_ms FROM post_history_summary WHERE account_id = ?
+    """, (account_id,))]
+    live = conn.execute("SELECT month FROM post_history_partitions WHERE status != 'archived'").fetchall()
+    for row in live:
+        summary.extend(dict(row) for row in conn.execute(f"""
+        SELECT ? AS month, outcome, COUNT(*) AS posts, COALESCE(SUM(latency_ms), 0) AS total_latency_ms
+        FROM {partition_table(row['month'])} WHERE account_id = ? GROUP BY outcome
+        """, (row['month'], account_id)))
+    for row in summary:
+        row['avg_latency_ms'] = row.pop('total_latency_ms') / row['posts'] if row['posts'] else None
+    summary.sort(key=lambda row: (row['month'], row['outcome']), reverse=True)
+    return summary
+
+# 保管したファイルから月の履歴を読む
+def read_archive(month):
+    path = archive_path(month)
+    if not os.path.exists(path):
+        return []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _write_archive(month, rows):
+    path = archive_path(month)
+    os.makedirs(HISTORY_ARCHIVE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=HISTORY_ARCHIVE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for row in rows:
+                f.write(json.dumps(dict(row), ensure_ascii=False).encode('utf-8') + b'\n')
+        if os.path.exists(path):
+            # 保管後に書き込まれた分は gzip のメンバーとして後ろに足す（gzip.open はまとめて読める）
+            with open(path, 'ab') as out, open(tmp_path, 'rb') as src:
+                shutil.copyfileobj(src, out)
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+# 保管する月を1つ確保する（他のプロセスと同じ月を保管しないよう、状態を archiving に変える）
+def _claim_partition(conn, month, now):
+    with conn:
+        cursor = conn.execute("""
+        UPDATE post_history_partitions SET status = 'archiving', archived_at = ?
+        WHERE month = ? AND (status = 'live' OR (status = 'archiving' AND archived_at < ?))
+        """, (now, month, now - HISTORY_ARCHIVE_STALE_SECONDS))
+        return cursor.rowcount == 1
+
+# 保持期間より古い月の履歴を gzip 圧縮の JSONL に書き出し、集計だけを残してテーブルを削除する
+def archive_partitions(now=None, retention_months=HISTORY_RETENTION_MONTHS):
+    if now is None:
+        now = time.time()
+    cutoff = shift_month(partition_month(now), -(retention_months - 1))
+    conn = get_db_connection()
+    months = [row['month'] for row in conn.execute(
+        "SELECT month FROM post_history_partitions WHERE month < ? AND status != 'archived' ORDER BY month", (cutoff,))]
+    archived = []
+    for month in months:
+        if not _claim_partition(conn, month, now):
+            continue
+        table = partition_table(month)
+        try:
+            rows = conn.execute(f"""
+            SELECT id, account_id, message_id, content_id, message, tweet_id, posted_at, latency_ms, outcome
+            FROM {table} ORDER BY id
+            """).fetchall()
+            path = _write_archive(month, rows)
+            last_id = rows[-1]['id'] if rows else 0
+            with conn:
+                conn.execute(f"""
+                INSERT INTO post_history_summary (month, account_id, outcome, posts, total_latency_ms)
+                SELECT ?, account_id, outcome, COUNT(*), COALESCE(SUM(latency_ms), 0) FROM {table}
+                WHERE id <= ? GROUP BY account_id, outcome
+                ON CONFLICT(month, account_id, outcome) DO UPDATE SET
+                    posts = posts + excluded.posts, total_latency_ms = total_latency_ms + excluded.total_latency_ms
+                """, (month, last_id))
+                conn.execute(f"DELETE FROM {table} WHERE id <= ?", (last_id,))
+                # 読み出した後に書き込まれた行があれば、テーブルを残して次の確認で保管する
+                remaining = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                if not remaining:
+                    conn.execute(f"DROP TABLE {table}")
+                conn.execute("""
+                UPDATE post_history_partitions SET status = ?, archive_path = ?, archived_at = ?
+                WHERE month = ?
+                """, ('live' if remaining else 'archived', path, now, month))
+        except Exception:
+            # 次の確認でやり直せるよう live に戻す（ファイルに書き出した後に失敗した場合は、やり直すと同じ履歴がファイルに重複する）
+            with conn:
+                conn.execute("UPDATE post_history_partitions SET status = 'live' WHERE month = ?", (month,))
+            raise
+        history_archived_total.inc()
+        logger.info("投稿履歴を保管しました: %s: %s件: %s", month, len(rows), path)
+        archived.append(month)
+    return archived
+
+post_history = HistoryWriter()  # このプロセスの投稿履歴の書き込み
+
+registry.gauge('tweetbot_history_queue_size', '書き込み待ちの投稿履歴の件数',
+               callback=lambda: {(): post_history.queue.qsize()})
+
+atexit.register(post_history.stop)
@@ -0,0 +1,315 @@
+import os
+import csv
+import gzip
+import json
+import math
+import logging
+import itertools
+import threading
+import unicodedata
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from db_manager import message_hash
+
+logger = logging.getLogger(__name__)
+
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', str(os.cpu_count() or 1)))  # 取り込み時に行を変換するプロセス数
+IMPORT_CHUNK_ROWS = 5000    # 1つのプロセスにまとめて渡す行数
+# これより少ない行数のファイルはプロセスプールを使わずに変換する（プールの起動の方が時間がかかる）
+IMPORT_PARALLEL_MIN_ROWS = int(os.getenv('IMPORT_PARALLEL_MIN_ROWS', '20000'))
+DEFAULT_WEIGHT = 1.0
+DEFAULT_PRIORITY = 0
+
+EXTENSIONS = {'.csv': 'csv', '.tsv': 'tsv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}  # 拡張子 -> 形式（.gz を付けてもよい）
+COLUMNS = ('message', 'media_path', 'weight', 'tags', 'priority')  # 見出し行がない場合の列の順序
+
+# 見出し行やJSONのキーとして使える名前
+COLUMN_ALIASES = {
+    'message': 'message', 'messages': 'message', 'text': 'message', 'body': 'message',
+    'メッセージ': 'message', '本文': 'message', '名言': 'message', 'ツイート': 'message',
+    'media_path': 'media_path', 'media': 'media_path', 'image': 'media_path', '画像': 'media_path',
+    'weight': 'weight', '重み': 'weight',
+    'tags': 'tags', 'tag': 'tags', 'タグ': 'tags',
+    'priority': 'priority', '優先度': 'priority',
+}
+
+# 取り込む1件分のメッセージ（hash は message_hash の値、tags はカンマ区切り）
+ImportRecord = namedtuple('ImportRecord', ['message', 'hash', 'media_path', 'weight', 'tags', 'priority'])
+
+
+# ファイル名から形式と gzip 圧縮の有無を判定する（判定できなければ形式は None）
+def format_from_filename(filename):
+    name = (filename or '').lower()
+    compressed = name.endswith('.gz')
+    if compressed:
+        name = name[:-3]
+    return EXTENSIONS.get(os.path.splitext(name)[1]), compressed
+
+# 取り込めるファイル名か
+def is_supported_filename(filename):
+    return format_from_filename(filename)[0] is not None
+
+# 最初の行の内容から形式を推測する
+def sniff_format(line):
+    stripped = line.lstrip()
+    if stripped.startswith('{'):
+        return 'jsonl'
+    if '\t' in line and ',' not in line:
+        return 'tsv'
+    return 'csv'
+
+# 前後の空白を除き、全角英数字や半角カナなどを NFKC で正規化する
+def normalize_text(text):
+    return unicodedata.normalize('NFKC', text).strip()
+
+def _parse_weight(value):
+    if value is None or value == '':
+        return DEFAULT_WEIGHT
+    try:
+        weight = float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_WEIGHT
+    return weight if math.isfinite(weight) and weight > 0 else DEFAULT_WEIGHT
+
+def _parse_priority(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return DEFAULT_PRIORITY
+
+# タグをカンマ区切りの文字列にする（"#" は除き、重複は1つにまとめる）
+def _parse_tags(value):
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.replace('、', ',').replace(',', ' ').split()
+    tags = []
+    for tag in value:
+        tag = normalize_text(str(tag)).lstrip('#')
+        if tag and tag not in tags:
+            tags.append(tag)
+    return ','.join(tags) or None
+
+def _record(fields):
+    message = fields.get('message')
+    if not isinstance(message, str):
+        return None
+    message = normalize_text(message)
+    if not message:
+        return None
+    media_path = fields.get('media_path')
+    media_path = media_path.strip() if isinstance(media_path, str) else None
+    return ImportRecord(message, message_hash(message), media_path or None,
+                        _parse_weight(fields.get('weight')), _parse_tags(fields.get('tags')),
+                        _parse_priority(fields.get('priority')))
+
+# 見出し行なら {列名: 列番号} を、そうでなければ None を返す
+def _header_columns(row):
+    names = [COLUMN_ALIASES.get(normalize_text(cell).lower()) for cell in row]
+    if 'message' not in names:
+        return None
+    columns = {}
+    for index, name in enumerate(names):
+        if name:
+            columns.setdefault(name, index)
+    return columns
+
+# CSV / TSV のテキストの行を項目のリストに分割する（空の行は除く）
+def _split_rows(lines, file_format):
+    # 行頭の空白の後の引用符も囲みとして扱う（" 名言" のように字下げされたファイルがある）
+    reader = csv.reader(lines, delimiter='\t' if file_format == 'tsv' else ',', skipinitialspace=True)
+    return (row for row in reader if any(cell.strip() for cell in row))
+
+# 行のチャンクを ImportRecord のリストに変換し、(レコード, 読み飛ばした行数) を返す（プロセスプールで実行される）
+# （csv / tsv はテキストの行のまま受け取ってここで分割する。'rows' は分割済みの行）
+def parse_chunk(file_format, columns, rows):
+    if file_format in ('csv', 'tsv'):
+        rows = _split_rows(rows, file_format)
+    records = []
+    skipped = 0
+    for row in rows:
+        if file_format == 'jsonl':
+            try:
+                value = json.loads(row)
+            except ValueError:
+                skipped += 1
+                continue
+            if isinstance(value, str):
+                value = {'message': value}
+            elif isinstance(value, dict):
+                value = {COLUMN_ALIASES[key.lower()]: item for key, item in value.items() if key.lower() in COLUMN_ALIASES}
+            else:
+                value = {}
+        else:
+            value = {name: row[index] for name, index in columns.items() if index < len(row)}
+        record = _record(value)
+        if record is None:
+            skipped += 1
+        else:
+            records.append(record)
+    return records, skipped
+
+# バイト列のストリームを1行ずつ文字列に変換する（先頭のBOMは除く）
+def decode_lines(stream, encoding='utf-8'):
+    first = True
+    for line in stream:
+        line = line.decode(encoding)
+        if first:
+            line = line.lstrip('\ufeff')
+            first = False
+        yield line
+
+# gzip 圧縮されていれば展開するストリームを返す（compressed が None なら先頭のバイト列で判定する）
+def _open_stream(stream, compressed):
+    if compressed is None and stream.seekable():
+        compressed = stream.read(2) == b'\x1f\x8b'
+        stream.seek(0)
+    return gzip.GzipFile(fileobj=stream) if compressed else stream
+
+# 1行目から (列の対応, 見出し行か) を返す（見出し行でなければ COLUMNS の順とみなす）
+def _columns_from_first_row(first_row):
+    columns = _header_columns(first_row)
+    if columns is None:
+        return {name: index for index, name in enumerate(COLUMNS)}, False
+    logger.debug("見出し行を読み飛ばしました: %s", first_row)
+    return columns, True
+
+# 分割済みの CSV の行（文字列のリスト）をチャンクにまとめ、(形式, 列の対応, 行のリスト) を順に返す
+# （1行目が見出し行なら列の対応に使い、そうでなければ COLUMNS の順とみなす。空の行は読み飛ばす）
+def iter_table_chunks(rows, chunk_rows=IMPORT_CHUNK_ROWS):
+    rows = (row for row in rows if any(cell.strip() for cell in row))
+    first_row = next(rows, None)
+    if first_row is None:
+        return
+    columns, is_header = _columns_from_first_row(first_row)
+    if not is_header:
+        rows = itertools.chain([first_row], rows)
+    yield from _chunked('rows', columns, rows, chunk_rows)
+
+# テキストの行を CSV の1行分（引用符で囲まれた改行を含む項目は複数行）ずつまとめて返す
+# （引用符の数が偶数になった所で区切るので、項目の途中に単独の引用符がある RFC 4180 外のファイルは区切りがずれることがある）
+def _iter_text_records(lines):
+    record = []
+    quotes = 0
+    for line in lines:
+        record.append(line)
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            yield record
+            record = []
+            quotes = 0
+    if record:
+        yield record
+
+# CSV / TSV のテキストの行を、項目の途中で切らないようにチャンクにまとめる
+# （分割は変換するプロセスで行い、ここでは見出し行の判定のために最初の1行だけを分割する）
+def _iter_text_chunks(lines, file_format, chunk_rows):
+    records = _iter_text_records(lines)
+    for first_record in records:
+        first_row = next(_split_rows(first_record, file_format), None)
+        if first_row is not None:
+            break
+    else:
+        return
+    columns, is_header = _columns_from_first_row(first_row)
+    chunk = [] if is_header else list(first_record)
+    for record in records:
+        chunk.extend(record)
+        if len(chunk) >= chunk_rows:
+            yield file_format, columns, chunk
+            chunk = []
+    if chunk:
+        yield file_format, columns, chunk
+
+# ファイルの行をチャンクにまとめ、(形式, 列の対応, 行のリスト) を順に返す（形式が None なら1行目から推測する）
+def iter_line_chunks(lines, file_format=None, chunk_rows=IMPORT_CHUNK_ROWS):
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+    file_format = file_format or sniff_format(first_line)
+    lines = itertools.chain([first_line], lines)
+    if file_format == 'jsonl':
+        yield from _chunked(file_format, None, (line for line in lines if line.strip()), chunk_rows)
+    else:
+        yield from _iter_text_chunks(lines, file_format, chunk_rows)
+
+def _chunked(file_format, columns, rows, chunk_rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_rows:
+            yield file_format, columns, chunk
+            chunk = []
+    if chunk:
+        yield file_format, columns, chunk
+
+_pools = {}  # プロセス数 -> 取り込み用のプロセスプール（起動に時間がかかるので取り込みのたびに作り直さない）
+_pools_lock = threading.Lock()
+
+def _get_pool(workers):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # スレッドから fork すると子プロセスが固まることがあるため spawn で起動する
+            context = multiprocessing.get_context('spawn')
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        return pool
+
+def _discard_pool(workers, pool):
+    with _pools_lock:
+        if _pools.get(workers) is pool:
+            del _pools[workers]
+    pool.shutdown(wait=False)
+
+# チャンクを変換し、元の順序で ImportRecord のリストを返す
+# （min_rows 行以上かつ2チャンク以上ある場合はプロセスプールで並列に変換する）
+def iter_records(chunks, workers=IMPORT_WORKERS, min_rows=IMPORT_PARALLEL_MIN_ROWS):
+    chunks = iter(chunks)
+    head = []
+    rows = 0
+    for chunk in chunks:
+        head.append(chunk)
+        rows += len(chunk[2])
+        if rows >= min_rows and len(head) >= 2:
+            break
+    chunks = itertools.chain(head, chunks)
+    if rows < min_rows or len(head) < 2 or workers <= 1:
+        for chunk in chunks:
+            yield _logged(parse_chunk(*chunk))
+        return
+
+    pool = _get_pool(workers)
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(parse_chunk, *chunk))
+            # 読み込みが書き込みより先に進みすぎないよう、処理中のチャンク数を抑える
+            if len(pending) >= workers * 2:
+                yield _logged(pending.popleft().result())
+        while pending:
+            yield _logged(pending.popleft().result())
+    except BrokenProcessPool:
+        _discard_pool(workers, pool)  # 子プロセスが異常終了したプールは次の取り込みで作り直す
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _logged(result):
+    records, skipped = result
+    if skipped:
+        logger.info("空または読み込めない行を %s 行読み飛ばしました", skipped)
+    return records
+
+# アップロードされたストリームやファイルを読み、ImportRecord のリストを順に返す
+def iter_stream_records(stream, filename='', workers=IMPORT_WORKERS, chunk_rows=IMPORT_CHUNK_ROWS):
+    file_format, compressed = format_from_filename(filename)
+    lines = decode_lines(_open_stream(stream, compressed or None))
+    return iter_records(iter_line_chunks(lines, file_format, chunk_rows), workers)
+
+def iter_file_records(filename, workers=IMPORT_WORKERS, chunk_rows=IMPORT_CHUNK_ROWS):
+    with open(filename, 'rb') as f:
+        yield from iter_stream_records(f, filename, workers, chunk_rows)
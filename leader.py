@@ -0,0 +1,112 @@
+import os
+import uuid
+import socket
+import logging
+import threading
+import time
+from db_manager import get_db_connection, close_db_connection
+
+logger = logging.getLogger(__name__)
+
+LEADER_LEASE_SECONDS = int(os.getenv('LEADER_LEASE_SECONDS', '30'))  # リーダーのリースの有効期間（秒）
+LEADER_TICK_SECONDS = 5  # リースの更新とリーダーの定期処理の間隔（秒）
+
+
+class LeaderElector:
+    """SQLite の leases テーブルのリースで、複数プロセスのうち1つだけをリーダーにする"""
+
+    def __init__(self, name, on_demoted=None, lease_seconds=LEADER_LEASE_SECONDS, tick_seconds=LEADER_TICK_SECONDS):
+        self.name = name
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.on_demoted = on_demoted      # リーダーでなくなったときに呼ぶ関数
+        self.on_tick = None               # リーダーの間、定期的に呼ぶ関数
+        self.lease_seconds = lease_seconds
+        self.tick_seconds = min(tick_seconds, lease_seconds / 3)
+        self._leader = False
+        self._valid_until = 0.0           # 自分が確認できているリースの期限
+        self.term = 0                     # リーダーに選ばれた回数
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    # リースの期限内のときだけリーダーとみなす（更新が遅れたら自分から降りる）
+    @property
+    def is_leader(self):
+        return self._leader and time.time() < self._valid_until
+
+    # リースを取得または更新し、リーダーかどうかを返す
+    def try_acquire(self, now=None):
+        if now is None:
+            now = time.time()
+        conn = get_db_connection()
+        with conn:
+            conn.execute("""
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at <= ?
+            """, (self.name, self.holder, now + self.lease_seconds, now))
+            row = conn.execute("SELECT holder FROM leases WHERE name = ?", (self.name,)).fetchone()
+        acquired = row is not None and row['holder'] == self.holder
+        if acquired:
+            self._valid_until = now + self.lease_seconds
+        return acquired
+
+    # リースを手放して、他のプロセスがすぐにリーダーになれるようにする
+    def release(self):
+        conn = get_db_connection()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder))
+        self._valid_until = 0.0
+
+    def start(self, on_tick=None):
+        with self._lock:
+            if on_tick is not None:
+                self.on_tick = on_tick
+            if self._thread is not None:
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=f'leader-{self.name}', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop_event.set()
+        thread.join()
+
+    def _run(self):
+        try:
+            while not self._stop_event.is_set():
+                self._tick()
+                self._stop_event.wait(self.tick_seconds)
+            if self._leader:
+                self.release()
+                self._demote()
+        finally:
+            close_db_connection()
+
+    def _tick(self):
+        try:
+            acquired = self.try_acquire()
+        except Exception as e:
+            logger.error("リースの更新に失敗しました: %s: %s", self.name, e)
+            acquired = self.is_leader  # 期限内なら次の更新までリーダーを続ける
+        if acquired and not self._leader:
+            self._leader = True
+            self.term += 1
+            logger.info("リーダーになりました: %s (%s)", self.name, self.holder)
+        elif not acquired and self._leader:
+            self._demote()
+        if self._leader and self.on_tick:
+            try:
+                self.on_tick()
+            except Exception as e:
+                logger.error("リーダーの定期処理でエラーが発生しました: %s: %s", self.name, e)
+
+    def _demote(self):
+        self._leader = False
+        logger.info("リーダーではなくなりました: %s (%s)", self.name, self.holder)
+        if self.on_demoted:
+            self.on_demoted()
@@ -0,0 +1,114 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+LOG_FILENAME = os.getenv('LOG_FILENAME', 'app.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')            # 全体のログレベル
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')              # サブシステムごとのレベル（例: "post_manager=DEBUG,scheduler=WARNING"）
+LOG_ROTATION = os.getenv('LOG_ROTATION', 'size')      # size: サイズで、time: 日付でローテーションする
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))  # size のときの1ファイルの最大サイズ
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '7'))              # 残す古いログファイルの数
+LOG_QUEUE_SIZE = 10000  # 書き込み待ちのログの最大件数（超えた分は捨てる）
+
+# LogRecord が標準で持つ属性（これ以外は extra で渡された項目として出力する）
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_listener = None
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """1件のログを1行のJSONにする"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """ログをキューに入れるだけのハンドラー（書式化と書き込みはリスナーのスレッドで行う）
+
+    標準の QueueHandler は呼び出し元のスレッドでメッセージを書式化するが、
+    プロセス内のキューなので LogRecord をそのまま渡し、例外の traceback だけ先に文字列にする。
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # 書き込みが追いつかない場合は投稿処理を止めずにログを捨てる
+
+
+# "name=LEVEL,name=LEVEL" 形式の設定を辞書にする
+def parse_levels(value):
+    levels = {}
+    for item in value.split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def _file_handler(filename, rotation):
+    if rotation == 'time':
+        return TimedRotatingFileHandler(filename, when='midnight', backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+    return RotatingFileHandler(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True)
+
+# ルートロガーにキュー経由のJSONログを設定する（呼び直すと前の設定を置き換える）
+def setup_logging(filename=LOG_FILENAME, level=LOG_LEVEL, levels=None, rotation=LOG_ROTATION, handlers=None):
+    global _listener
+    if levels is None:
+        levels = parse_levels(LOG_LEVELS)
+    if handlers is None:
+        handlers = [_file_handler(filename, rotation)]
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+
+    with _lock:
+        stop_logging()
+        root = logging.getLogger()
+        for handler in [h for h in root.handlers if isinstance(h, _QueueHandler)]:
+            root.removeHandler(handler)
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        root.addHandler(_QueueHandler(log_queue))
+        root.setLevel(level)
+        # 無効なレベルのログは呼び出し元で捨てられ、メッセージの書式化も行われない
+        for name, subsystem_level in levels.items():
+            logging.getLogger(name).setLevel(subsystem_level)
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    return _listener
+
+# キューに残っているログを書き出してリスナーを止める
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+atexit.register(stop_logging)
@@ -0,0 +1,179 @@
+import io
+import os
+import mmap
+import time
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from db_manager import (
+    get_account, get_all_account_ids, get_media_variant, save_media_variant, get_media_upload, save_media_upload
+)
+from account_manager import get_media_api, get_media_owner
+from metrics import registry
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow がなければ上限を超える画像は添付できない（上限内の画像はそのまま使う）
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_ROOTS = [root for root in os.getenv('MEDIA_ROOTS', 'img,picuture').split(',') if root]  # 添付できる画像の置き場所
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', 'media_cache')  # 変換済みの画像の保存先（内容のハッシュをファイル名にする）
+MAX_IMAGE_BYTES = 5 * 1024 * 1024   # 画像1枚のアップロードの上限
+MAX_GIF_BYTES = 15 * 1024 * 1024    # GIFのアップロードの上限
+MAX_IMAGE_DIMENSION = 4096          # 縮小するときの長辺の上限（ピクセル）
+DEFAULT_MEDIA_EXPIRY_SECONDS = 86400  # レスポンスに期限がない場合の media_id の有効期間
+MEDIA_EXPIRY_MARGIN_SECONDS = 600   # 期限の少し前に再アップロードする
+MAX_ADDITIONAL_OWNERS = 100         # media_id を共有できる他のユーザーの最大数
+
+MIME_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp', '.gif': 'image/gif'}
+EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/gif': '.gif'}
+
+MediaVariant = namedtuple('MediaVariant', ['hash', 'mime_type', 'path', 'size'])  # アップロードする変換済みの画像
+
+media_uploads_total = registry.counter(
+    'tweetbot_media_uploads_total', '画像の media_id を取得した方法ごとの回数（uploaded / reused）', ['result'])
+media_upload_seconds = registry.histogram(
+    'tweetbot_media_upload_seconds', '画像のアップロードの処理時間（秒）')
+
+_upload_locks = {}  # 変換済みの画像のハッシュ -> 同じ画像を同時にアップロードしないためのロック
+_upload_locks_lock = threading.Lock()
+
+
+class MediaError(Exception):
+    """添付する画像が見つからない・変換できない場合の例外"""
+
+
+# 画像のパスを確認し、実際のパスを返す（置き場所の外のファイルは添付させない）
+def resolve_media_path(media_path):
+    path = os.path.realpath(media_path)
+    for root in MEDIA_ROOTS:
+        root = os.path.realpath(root)
+        if os.path.commonpath([path, root]) == root:
+            if os.path.splitext(path)[1].lower() not in MIME_TYPES:
+                raise MediaError(f"対応していない画像の形式です: {media_path}")
+            if not os.path.isfile(path):
+                raise MediaError(f"画像が見つかりません: {media_path}")
+            return path
+    raise MediaError(f"画像は {', '.join(MEDIA_ROOTS)} の中に置いてください: {media_path}")
+
+# 添付できる画像の一覧
+def list_media_files():
+    files = []
+    for root in MEDIA_ROOTS:
+        for dirpath, _, filenames in os.walk(root):
+            files.extend(os.path.join(dirpath, filename) for filename in filenames
+                         if os.path.splitext(filename)[1].lower() in MIME_TYPES)
+    return sorted(files)
+
+def variant_path(variant_hash, mime_type):
+    return os.path.join(MEDIA_CACHE_DIR, variant_hash[:2], variant_hash + EXTENSIONS[mime_type])
+
+def _size_limit(mime_type):
+    return MAX_GIF_BYTES if mime_type == 'image/gif' else MAX_IMAGE_BYTES
+
+# 上限に収まる画像はそのまま、収まらない画像は縮小・再圧縮したJPEGにする
+def _encode(path, mime_type, data):
+    if len(data) <= _size_limit(mime_type):
+        return data, mime_type
+    if Image is None:
+        raise MediaError(f"画像が上限（{_size_limit(mime_type)}バイト）を超えています。縮小には Pillow が必要です: {path}")
+    with Image.open(path) as image:
+        image = image.convert('RGB')
+        image.thumbnail((MAX_IMAGE_DIMENSION, MAX_IMAGE_DIMENSION))
+        while min(image.size) >= 64:
+            for quality in (90, 80, 70, 60):
+                buffer = io.BytesIO()
+                image.save(buffer, 'JPEG', quality=quality, optimize=True)
+                if buffer.tell() <= MAX_IMAGE_BYTES:
+                    return buffer.getvalue(), 'image/jpeg'
+            image = image.resize((image.width // 2, image.height // 2))
+    raise MediaError(f"画像を上限まで縮小できませんでした: {path}")
+
+# ファイルを一時ファイル経由で書き込む（途中まで書かれたファイルを読ませない）
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+# アップロードできる形に変換した画像を返す（元のファイルが変わらない限り変換は1回だけ）
+def prepare_media(media_path):
+    source = resolve_media_path(media_path)
+    stat = os.stat(source)
+    row = get_media_variant(source, stat.st_mtime_ns, stat.st_size)
+    if row:
+        path = variant_path(row['variant_hash'], row['mime_type'])
+        if os.path.exists(path):
+            return MediaVariant(row['variant_hash'], row['mime_type'], path, row['size'])
+
+    with open(source, 'rb') as f:
+        data = f.read()
+    data, mime_type = _encode(source, MIME_TYPES[os.path.splitext(source)[1].lower()], data)
+    variant_hash = hashlib.sha256(data).hexdigest()
+    path = variant_path(variant_hash, mime_type)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    save_media_variant(source, stat.st_mtime_ns, stat.st_size, variant_hash, mime_type, len(data))
+    logger.debug("画像を変換しました: %s -> %s", media_path, path)
+    return MediaVariant(variant_hash, mime_type, path, len(data))
+
+def _upload_lock(variant_hash):
+    with _upload_locks_lock:
+        lock = _upload_locks.get(variant_hash)
+        if lock is None:
+            lock = _upload_locks[variant_hash] = threading.Lock()
+        return lock
+
+# 登録されている他のアカウントのユーザーID（アップロードした media_id を共有する相手）
+def _other_owners(owner):
+    owners = []
+    for account_id in get_all_account_ids():
+        other = get_media_owner(get_account(account_id))
+        if other != owner and other.isdigit() and other not in owners:
+            owners.append(other)
+    return owners[:MAX_ADDITIONAL_OWNERS]
+
+# 変換済みの画像をメモリマップしてアップロードし、media_id を返す
+def _upload(account_id, variant, additional_owners):
+    api = get_media_api(account_id)
+    if api is None:
+        raise MediaError(f"画像をアップロードできません: アカウント {account_id}")
+    with media_upload_seconds.time(), open(variant.path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        media = api.simple_upload(os.path.basename(variant.path), file=data,
+                                  additional_owners=','.join(additional_owners) or None)
+    expires_in = getattr(media, 'expires_after_secs', None) or DEFAULT_MEDIA_EXPIRY_SECONDS
+    return str(getattr(media, 'media_id_string', None) or media.media_id), expires_in
+
+# アカウントが画像を添付するための media_id を返す（期限内にアップロード済みなら使い回す）
+def upload_media(account_id, media_path):
+    variant = prepare_media(media_path)
+    owner = get_media_owner(get_account(account_id))
+    media_id = get_media_upload(variant.hash, owner)
+    if media_id is None:
+        with _upload_lock(variant.hash):
+            media_id = get_media_upload(variant.hash, owner)  # 待っている間に他のスレッドがアップロードした場合
+            if media_id is None:
+                additional_owners = _other_owners(owner)
+                media_id, expires_in = _upload(account_id, variant, additional_owners)
+                save_media_upload(variant.hash, [owner] + additional_owners, media_id,
+                                  time.time() + expires_in - MEDIA_EXPIRY_MARGIN_SECONDS)
+                media_uploads_total.inc(result='uploaded')
+                logger.debug("画像をアップロードしました: アカウント %s: %s (%s)", account_id, media_path, media_id)
+                return media_id
+    media_uploads_total.inc(result='reused')
+    return media_id
+
+# 投稿に添付する media_id のリスト（画像が使えなければ警告して画像なしで投稿する）
+def get_media_ids(account_id, media_path):
+    if not media_path:
+        return None
+    try:
+        return [upload_media(account_id, media_path)]
+    except MediaError as e:
+        logger.warning("画像を添付せずに投稿します: アカウント %s: %s", account_id, e)
+        return None
@@ -0,0 +1,205 @@
+import math
+import functools
+import time
+import threading
+from contextlib import contextmanager
+
+# 秒単位の処理時間のヒストグラムの既定の区切り
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # Prometheus のテキスト形式
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ラベルの組ごとに値を持つメトリクスの共通部分"""
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # ラベルの値のタプル -> 値
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} のラベルは {self.labelnames} です: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+    def collect(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, value in self.collect():
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    """増えるだけの回数"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, self._labels(key), value) for key, value in items]
+
+
+class Histogram(Metric):
+    """観測値の分布（累積のバケット・合計・件数）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    # with ブロックの処理時間を観測する（例外で抜けた場合も記録する）
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return {'count': state['count'], 'sum': state['sum']} if state else {'count': 0, 'sum': 0.0}
+
+    def collect(self):
+        with self._lock:
+            items = sorted((key, dict(state, counts=list(state['counts']))) for key, state in self._values.items())
+        samples = []
+        for key, state in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', labels + [('le', _format_value(float(bound)))], cumulative))
+            samples.append((f'{self.name}_sum', labels, state['sum']))
+            samples.append((f'{self.name}_count', labels, state['count']))
+        return samples
+
+
+class Gauge(Metric):
+    """出力するときに callback で値を集める現在値
+
+    callback は {ラベルの値のタプル: 値} を返す（ラベルがなければキーは ()）。
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def collect(self):
+        values = self.callback() if self.callback else {}
+        return [(self.name, self._labels(tuple(str(v) for v in key)), value)
+                for key, value in sorted(values.items(), key=lambda item: tuple(map(str, item[0])))]
+
+
+class Registry:
+    """登録されたメトリクスをまとめてテキスト形式で出力する"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"メトリクス {metric.name} は登録済みです")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames=(), callback=None):
+        return self.register(Gauge(name, help, labelnames, callback))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # 1つのメトリクスの収集に失敗しても他は出力する
+                lines.append(f'# {metric.name} の収集に失敗しました: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()  # プロセス全体のメトリクス
+
+posts_total = registry.counter(
+    'tweetbot_posts_total', '投稿処理の結果ごとの回数', ['result'])
+create_tweet_seconds = registry.histogram(
+    'tweetbot_create_tweet_seconds', 'create_tweet の処理時間（秒）', ['backend'])
+db_query_seconds = registry.histogram(
+    'tweetbot_db_query_seconds', 'db_manager の関数ごとの処理時間（秒）', ['function'])
+scheduler_lag_seconds = registry.histogram(
+    'tweetbot_scheduler_lag_seconds', '予定の投稿時刻から実際に投稿を呼び出すまでの遅れ（秒）',
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0))
+
+# db_manager の関数の処理時間を記録するデコレーター
+def timed(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with db_query_seconds.time(function=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def render_metrics():
+    return registry.render()
@@ -0,0 +1,439 @@
+import logging
+from db_manager import message_hash, weighted_key, draws_per_cycle
+
+logger = logging.getLogger(__name__)
+
+# 初期テーブルの作成
+def _create_base_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tweets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT NOT NULL,
+        is_deleted INTEGER DEFAULT 0,
+        account_id INTEGER,
+        FOREIGN KEY(account_id) REFERENCES accounts(id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS settings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        interval_type TEXT,
+        interval INTEGER,
+        specific_time TEXT,
+        account_id INTEGER,
+        FOREIGN KEY(account_id) REFERENCES accounts(id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        consumer_api_key TEXT NOT NULL,
+        consumer_api_secret TEXT NOT NULL,
+        bearer_token TEXT NOT NULL,
+        access_token TEXT NOT NULL,
+        access_token_secret TEXT NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS auto_post_status (
+        account_id INTEGER PRIMARY KEY,
+        status BOOLEAN NOT NULL,
+        FOREIGN KEY (account_id) REFERENCES accounts (id)
+    )
+    ''')
+
+# シャッフル順の列と重複チェック用のハッシュ列を追加
+def _add_queue_columns(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tweets)")]
+    if 'shuffle_key' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN shuffle_key INTEGER")
+    if 'message_hash' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN message_hash TEXT")
+    conn.execute("UPDATE tweets SET shuffle_key = random() WHERE shuffle_key IS NULL")
+    conn.execute("UPDATE tweets SET message_hash = message_hash(message) WHERE message_hash IS NULL")
+
+# 検索用のインデックスを追加
+def _add_indexes(conn):
+    # 未投稿メッセージをシャッフル順に取り出す・数える
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tweets_queue ON tweets (account_id, is_deleted, shuffle_key)")
+    # アカウントのメッセージをID順に一覧表示する
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tweets_account ON tweets (account_id)")
+    # アカウント内で同じメッセージを持てないようにする（既存の重複は最も古いものだけ残す）
+    conn.execute("DROP INDEX IF EXISTS idx_tweets_message_hash")
+    conn.execute('''
+    DELETE FROM tweets WHERE id NOT IN (
+        SELECT MIN(id) FROM tweets GROUP BY account_id, message_hash
+    )
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_tweets_account_message_hash ON tweets (account_id, message_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_settings_account ON settings (account_id)")
+
+# メッセージの変更履歴テーブルとトリガーを追加（一覧の差分取得用）
+def _add_tweet_changes(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tweet_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER,
+        tweet_id INTEGER NOT NULL,
+        op TEXT NOT NULL
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tweet_changes_account ON tweet_changes (account_id, seq)")
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_tweets_insert AFTER INSERT ON tweets
+    BEGIN
+        INSERT INTO tweet_changes (account_id, tweet_id, op) VALUES (NEW.account_id, NEW.id, 'inserted');
+    END
+    ''')
+    # 表示に関係する列が変わったときだけ記録する（シャッフル順の変更は記録しない）
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_tweets_update AFTER UPDATE ON tweets
+    WHEN NEW.message IS NOT OLD.message OR NEW.is_deleted IS NOT OLD.is_deleted
+    BEGIN
+        INSERT INTO tweet_changes (account_id, tweet_id, op) VALUES (
+            NEW.account_id, NEW.id,
+            CASE
+                WHEN NEW.message IS NOT OLD.message THEN 'edited'
+                WHEN NEW.is_deleted = 1 THEN 'posted'
+                ELSE 'restored'
+            END
+        );
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_tweets_delete AFTER DELETE ON tweets
+    BEGIN
+        INSERT INTO tweet_changes (account_id, tweet_id, op) VALUES (OLD.account_id, OLD.id, 'deleted');
+    END
+    ''')
+
+# アカウントごとのメッセージ件数の集計テーブルを追加
+def _add_account_stats(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS account_stats (
+        account_id INTEGER PRIMARY KEY,
+        total INTEGER NOT NULL DEFAULT 0,
+        remaining INTEGER NOT NULL DEFAULT 0,
+        posted INTEGER NOT NULL DEFAULT 0,
+        cycle INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (account_id) REFERENCES accounts (id)
+    )
+    ''')
+    conn.execute('''
+    INSERT OR REPLACE INTO account_stats (account_id, total, remaining, posted, cycle)
+    SELECT account_id, COUNT(*), SUM(is_deleted = 0), SUM(is_deleted != 0), 0
+    FROM tweets WHERE account_id IS NOT NULL GROUP BY account_id
+    ''')
+
+# 投稿の確保（リース）と再試行用の列を追加
+def _add_claim_columns(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tweets)")]
+    if 'claimed_until' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN claimed_until REAL")    # リースの期限（エポック秒）
+    if 'next_attempt_at' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN next_attempt_at REAL")  # 次に再試行できる時刻（エポック秒）
+    if 'attempts' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+# 複数プロセスで共有する状態のテーブルを追加（キャッシュのバージョンと取り込みジョブの進捗）
+def _add_shared_state_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS cache_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS import_jobs (
+        id TEXT PRIMARY KEY,
+        account_id INTEGER,
+        filename TEXT,
+        status TEXT NOT NULL,
+        rows INTEGER NOT NULL DEFAULT 0,
+        inserted INTEGER NOT NULL DEFAULT 0,
+        duplicates INTEGER NOT NULL DEFAULT 0,
+        duplicate_preview TEXT NOT NULL DEFAULT '[]',
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        FOREIGN KEY (account_id) REFERENCES accounts (id)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_import_jobs_account ON import_jobs (account_id, started_at)")
+
+# リーダー選出用のリースのテーブルを追加
+def _add_leases(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    ''')
+
+# アカウントごとの次回の投稿時刻を保存するテーブルを追加（再起動後も予定を引き継ぐ）
+def _add_schedule_state(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schedule_state (
+        account_id INTEGER PRIMARY KEY,
+        next_fire_at REAL,
+        FOREIGN KEY (account_id) REFERENCES accounts (id)
+    )
+    ''')
+
+# メッセージに添付する画像と、画像の変換結果・アップロード済みの media_id のテーブルを追加
+def _add_media_tables(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tweets)")]
+    if 'media_path' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN media_path TEXT")  # 添付する画像のパス（なければ NULL）
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS media_variants (
+        source_path TEXT PRIMARY KEY,
+        source_mtime_ns INTEGER NOT NULL,
+        source_size INTEGER NOT NULL,
+        variant_hash TEXT NOT NULL,
+        mime_type TEXT NOT NULL,
+        size INTEGER NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS media_uploads (
+        variant_hash TEXT NOT NULL,
+        owner TEXT NOT NULL,
+        media_id TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (variant_hash, owner)
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_media_uploads_expires ON media_uploads (expires_at)")
+
+# AUTOINCREMENT の連番の現在値（テーブルを作り直す前に読んでおく）
+def _get_sequence(conn, table):
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    return row[0] if row else 0
+
+# 作り直したテーブルの連番を seq 以上に戻す（削除された最大のIDが再利用されないようにする）
+def _restore_sequence(conn, table, seq):
+    if not seq:
+        return
+    cursor = conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (seq, table))
+    if cursor.rowcount == 0:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq))
+
+# メッセージ本文をハッシュをキーにした message_contents に1回だけ保存し、tweets は本文のIDと投稿状態だけを持つようにする
+# （同じ本文を複数のアカウントに割り当てても本文は1つで済む）
+def _add_message_contents(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS message_contents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hash TEXT NOT NULL UNIQUE,
+        body TEXT NOT NULL
+    )
+    ''')
+    conn.execute('''
+    INSERT OR IGNORE INTO message_contents (hash, body)
+    SELECT message_hash, message FROM tweets ORDER BY id
+    ''')
+    conn.execute('''
+    CREATE TABLE tweets_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content_id INTEGER NOT NULL,
+        is_deleted INTEGER DEFAULT 0,
+        account_id INTEGER,
+        shuffle_key INTEGER,
+        claimed_until REAL,
+        next_attempt_at REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        media_path TEXT,
+        FOREIGN KEY(account_id) REFERENCES accounts(id),
+        FOREIGN KEY(content_id) REFERENCES message_contents(id)
+    )
+    ''')
+    conn.execute('''
+    INSERT INTO tweets_new (id, content_id, is_deleted, account_id, shuffle_key, claimed_until, next_attempt_at, attempts, media_path)
+    SELECT t.id, c.id, t.is_deleted, t.account_id, t.shuffle_key, t.claimed_until, t.next_attempt_at, t.attempts, t.media_path
+    FROM tweets t JOIN message_contents c ON c.hash = t.message_hash
+    ''')
+    # 変更履歴が指している削除済みのIDも再利用しないよう、連番を引き継ぐ
+    sequence = max(_get_sequence(conn, 'tweets'),
+                   conn.execute("SELECT COALESCE(MAX(tweet_id), 0) FROM tweet_changes").fetchone()[0])
+    # 古いテーブルと一緒にインデックスとトリガーも削除される
+    conn.execute("DROP TABLE tweets")
+    conn.execute("ALTER TABLE tweets_new RENAME TO tweets")
+    _restore_sequence(conn, 'tweets', sequence)
+
+    conn.execute("CREATE INDEX idx_tweets_queue ON tweets (account_id, is_deleted, shuffle_key)")
+    conn.execute("CREATE INDEX idx_tweets_account ON tweets (account_id)")
+    # アカウント内で同じ本文を持てないようにする
+    conn.execute("CREATE UNIQUE INDEX idx_tweets_account_content ON tweets (account_id, content_id)")
+    # どのアカウントにも使われなくなった本文を探す
+    conn.execute("CREATE INDEX idx_tweets_content ON tweets (content_id)")
+    conn.execute('''
+    CREATE TRIGGER trg_tweets_insert AFTER INSERT ON tweets
+    BEGIN
+        INSERT INTO tweet_changes (account_id, tweet_id, op) VALUES (NEW.account_id, NEW.id, 'inserted');
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER trg_tweets_update AFTER UPDATE ON tweets
+    WHEN NEW.content_id IS NOT OLD.content_id OR NEW.is_deleted IS NOT OLD.is_deleted
+    BEGIN
+        INSERT INTO tweet_changes (account_id, tweet_id, op) VALUES (
+            NEW.account_id, NEW.id,
+            CASE
+                WHEN NEW.content_id IS NOT OLD.content_id THEN 'edited'
+                WHEN NEW.is_deleted = 1 THEN 'posted'
+                ELSE 'restored'
+            END
+        );
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER trg_tweets_delete AFTER DELETE ON tweets
+    BEGIN
+        INSERT INTO tweet_changes (account_id, tweet_id, op) VALUES (OLD.account_id, OLD.id, 'deleted');
+    END
+    ''')
+
+# 取り込み時に指定できる重みとタグの列を追加
+def _add_import_columns(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tweets)")]
+    if 'weight' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN weight REAL NOT NULL DEFAULT 1")  # 1サイクルに投稿する回数（1が標準）
+    if 'tags' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN tags TEXT")  # カンマ区切りのタグ（なければ NULL）
+
+# 優先度の列を追加し、優先度の高い順・重み付きの順に取り出せるようインデックスと未投稿の順序を作り直す
+def _add_priority(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tweets)")]
+    if 'priority' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")  # 大きいほど先に投稿する
+    conn.execute("DROP INDEX IF EXISTS idx_tweets_queue")
+    conn.execute("CREATE INDEX idx_tweets_queue ON tweets (account_id, is_deleted, priority DESC, shuffle_key)")
+    conn.execute("UPDATE tweets SET shuffle_key = weighted_key(weight) WHERE is_deleted = 0")
+
+# 投稿履歴の月ごとの分割テーブルの一覧と、保管済みの月の集計を追加する
+# （履歴そのものは history_manager が post_history_YYYYMM に書き込む）
+def _add_post_history(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS post_history_partitions (
+        month TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'live',
+        rows INTEGER NOT NULL DEFAULT 0,
+        archive_path TEXT,
+        archived_at REAL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS post_history_summary (
+        month TEXT NOT NULL,
+        account_id INTEGER NOT NULL,
+        outcome TEXT NOT NULL,
+        posts INTEGER NOT NULL,
+        total_latency_ms REAL NOT NULL,
+        PRIMARY KEY (month, account_id, outcome)
+    )
+    ''')
+
+# バージョン11で失われた tweets の連番を戻し、message_contents を AUTOINCREMENT で作り直す
+# （削除されたIDが別のメッセージや本文に再利用されると、変更履歴や投稿履歴が別のものを指してしまう）
+def _keep_deleted_ids(conn):
+    tweet_ids = [conn.execute("SELECT COALESCE(MAX(tweet_id), 0) FROM tweet_changes").fetchone()[0]]
+    content_ids = [conn.execute("SELECT COALESCE(MAX(id), 0) FROM message_contents").fetchone()[0]]
+    for (month,) in conn.execute("SELECT month FROM post_history_partitions WHERE status != 'archived'").fetchall():
+        row = conn.execute(
+            f"SELECT COALESCE(MAX(message_id), 0), COALESCE(MAX(content_id), 0) FROM post_history_{int(month):06d}"
+        ).fetchone()
+        tweet_ids.append(row[0])
+        content_ids.append(row[1])
+    _restore_sequence(conn, 'tweets', max(tweet_ids))
+
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'message_contents'").fetchone()[0]
+    if 'AUTOINCREMENT' not in sql.upper():
+        conn.execute('''
+        CREATE TABLE message_contents_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hash TEXT NOT NULL UNIQUE,
+            body TEXT NOT NULL
+        )
+        ''')
+        conn.execute("INSERT INTO message_contents_new (id, hash, body) SELECT id, hash, body FROM message_contents")
+        conn.execute("DROP TABLE message_contents")
+        conn.execute("ALTER TABLE message_contents_new RENAME TO message_contents")
+    _restore_sequence(conn, 'message_contents', max(content_ids))
+
+# 投稿履歴に記録した時点の本文を持たせる（本文が編集・削除されても履歴が変わらないようにする）
+def _add_post_history_message(conn):
+    for (month,) in conn.execute("SELECT month FROM post_history_partitions WHERE status != 'archived'").fetchall():
+        table = f"post_history_{int(month):06d}"
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if columns and 'message' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN message TEXT")
+            conn.execute(f"UPDATE {table} SET message = (SELECT body FROM message_contents WHERE id = content_id)")
+
+# 投稿できないメッセージを再試行の対象から外すための列を追加
+def _add_failure_columns(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tweets)")]
+    if 'failed_at' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN failed_at REAL")   # 投稿を諦めた時刻（なければ NULL）
+    if 'last_error' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN last_error TEXT")  # 諦めた理由
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tweets_failed ON tweets (account_id) WHERE failed_at IS NOT NULL")
+
+# 重みの回数だけ投稿できるよう、今のサイクルで残っている投稿回数の列を追加し、未投稿の順序を作り直す
+def _add_draws_left(conn):
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(tweets)")]
+    if 'draws_left' not in columns:
+        conn.execute("ALTER TABLE tweets ADD COLUMN draws_left INTEGER NOT NULL DEFAULT 1")  # 投稿済みなら 0
+    conn.execute("UPDATE tweets SET draws_left = 0 WHERE is_deleted = 1")
+    conn.execute("UPDATE tweets SET draws_left = draws_per_cycle(weight), shuffle_key = weighted_key(weight) WHERE is_deleted = 0")
+
+# (バージョン, 説明, 関数) の順に適用される
+MIGRATIONS = [
+    (1, '初期テーブルの作成', _create_base_tables),
+    (2, 'シャッフル順と重複チェック用の列を追加', _add_queue_columns),
+    (3, '検索用インデックスを追加', _add_indexes),
+    (4, 'メッセージの変更履歴を追加', _add_tweet_changes),
+    (5, 'アカウントごとの件数集計を追加', _add_account_stats),
+    (6, '投稿の確保と再試行用の列を追加', _add_claim_columns),
+    (7, 'キャッシュのバージョンと取り込みジョブのテーブルを追加', _add_shared_state_tables),
+    (8, 'リーダー選出用のリースを追加', _add_leases),
+    (9, '次回の投稿時刻の保存先を追加', _add_schedule_state),
+    (10, '画像の添付と media_id のキャッシュを追加', _add_media_tables),
+    (11, 'メッセージ本文をアカウント間で共有', _add_message_contents),
+    (12, '重みとタグの列を追加', _add_import_columns),
+    (13, '優先度と重み付きの投稿順を追加', _add_priority),
+    (14, '投稿履歴の分割テーブルの管理と集計を追加', _add_post_history),
+    (15, '削除されたメッセージと本文のIDを再利用しない', _keep_deleted_ids),
+    (16, '投稿履歴に投稿した本文を保存', _add_post_history_message),
+    (17, '投稿できないメッセージの記録用の列を追加', _add_failure_columns),
+    (18, '重みの回数だけ投稿するための残りの投稿回数の列を追加', _add_draws_left),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# 未適用のマイグレーションを順に適用する
+def run_migrations(conn):
+    conn.create_function('message_hash', 1, message_hash, deterministic=True)
+    conn.create_function('weighted_key', 1, weighted_key)
+    conn.create_function('draws_per_cycle', 1, draws_per_cycle, deterministic=True)
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        # 他のプロセスと同時に実行されても二重に適用しないよう、書き込みロックを取ってから確認する
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("マイグレーションを適用しました: %s %s", version, description)
+        applied.append(version)
+    return applied
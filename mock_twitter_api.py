@@ -0,0 +1,138 @@
+"""POST /2/tweets を模倣するローカルのテスト用HTTPサーバー
+
+遅延、レート制限（429）、重複投稿（403）を再現できる。
+実行方法: python mock_twitter_api.py --port 8765 --latency 0.05
+"""
+import re
+import json
+import time
+import argparse
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockTwitterAPI:
+    """投稿の状態を保持し、リクエストごとの応答を決める"""
+
+    def __init__(self, latency=0.0, rate_limit=None, rate_limit_window=900):
+        self.latency = latency                      # 1リクエストあたりの遅延（秒）
+        self.rate_limit = rate_limit                # ウィンドウあたりの投稿数の上限（Noneなら無制限）
+        self.rate_limit_window = rate_limit_window  # レート制限のウィンドウ（秒）
+        self.tweets = {}                            # アクセストークン -> 投稿済みの本文
+        self.requests = 0
+        self._windows = {}                          # アクセストークン -> (ウィンドウ開始時刻, 投稿数)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def handle_post(self, token, text):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            now = time.time()
+            started, count = self._windows.get(token, (now, 0))
+            if now - started >= self.rate_limit_window:
+                started, count = now, 0
+            reset = int(started + self.rate_limit_window)
+            headers = {}
+            if self.rate_limit is not None:
+                if count >= self.rate_limit:
+                    headers = {
+                        'x-rate-limit-limit': str(self.rate_limit),
+                        'x-rate-limit-remaining': '0',
+                        'x-rate-limit-reset': str(reset),
+                        'retry-after': str(max(reset - int(now), 1)),
+                    }
+                    return 429, {'title': 'Too Many Requests', 'detail': 'Too Many Requests', 'status': 429}, headers
+                headers = {
+                    'x-rate-limit-limit': str(self.rate_limit),
+                    'x-rate-limit-remaining': str(self.rate_limit - count - 1),
+                    'x-rate-limit-reset': str(reset),
+                }
+            posted = self.tweets.setdefault(token, set())
+            if text in posted:
+                body = {'title': 'Forbidden', 'status': 403,
+                        'detail': 'You are not allowed to create a Tweet with duplicate content.'}
+                return 403, body, headers
+            posted.add(text)
+            self._windows[token] = (started, count + 1)
+            return 201, {'data': {'id': str(next(self._ids)), 'text': text, 'edit_history_tweet_ids': []}}, headers
+
+
+def _make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive を有効にする
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = self.rfile.read(length)
+            if self.path != '/2/tweets':
+                return self._respond(404, {'title': 'Not Found'})
+            match = re.search(r'oauth_token="([^"]+)"', self.headers.get('Authorization', ''))
+            if not match:
+                return self._respond(401, {'title': 'Unauthorized', 'status': 401})
+            try:
+                text = json.loads(payload)['text']
+            except (ValueError, KeyError):
+                return self._respond(400, {'title': 'Invalid Request', 'status': 400})
+            status, body, headers = api.handle_post(match.group(1), text)
+            self._respond(status, body, headers)
+
+        def _respond(self, status, body, headers=None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class MockTwitterServer:
+    """バックグラウンドのスレッドでモックAPIを起動する"""
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.api = MockTwitterAPI(**options)
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self.api))
+        self._server.daemon_threads = True
+        self._server.request_queue_size = 1024
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='POST /2/tweets のモックサーバー')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=None)
+    args = parser.parse_args()
+    server = MockTwitterServer(port=args.port, latency=args.latency, rate_limit=args.rate_limit)
+    print(f"モックAPIを起動しました: {server.base_url}")
+    server._server.serve_forever()
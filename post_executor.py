@@ -0,0 +1,72 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MAX_POST_WORKERS = int(os.getenv('MAX_POST_WORKERS', '8'))      # 投稿ワーカースレッドの最大数
+MAX_INFLIGHT_TWEETS = int(os.getenv('MAX_INFLIGHT_TWEETS', '4'))  # 同時に実行する create_tweet の最大数（非同期のバックエンドでは応答待ちの投稿も数える）
+
+
+class PostExecutor:
+    """アカウント単位で排他しつつ、複数アカウントの投稿を並列に実行する"""
+
+    def __init__(self, post_func, max_workers=MAX_POST_WORKERS, max_inflight=MAX_INFLIGHT_TWEETS):
+        self.post_func = post_func
+        self.inflight = threading.BoundedSemaphore(max_inflight)  # create_tweet の同時実行数の上限
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='post-worker')
+        self._account_locks = {}
+        self._pending = set()  # キュー待ちまたは実行中のアカウントID
+        self._lock = threading.Lock()
+        self._metrics = {'queued': 0, 'skipped': 0, 'completed': 0}
+
+    # アカウントごとのロックを取得（なければ作成）
+    def account_lock(self, account_id):
+        with self._lock:
+            lock = self._account_locks.get(account_id)
+            if lock is None:
+                lock = self._account_locks[account_id] = threading.Lock()
+            return lock
+
+    # 投稿をキューに追加（同じアカウントの投稿が既に待機中ならスキップ）
+    def submit(self, account_id):
+        with self._lock:
+            if account_id in self._pending:
+                self._metrics['skipped'] += 1
+                logger.debug("同じアカウントの投稿が処理中のためスキップします: アカウント %s", account_id)
+                return None
+            self._pending.add(account_id)
+            self._metrics['queued'] += 1
+        return self._pool.submit(self._run, account_id)
+
+    # 非同期の投稿の完了処理などをワーカーで実行する（アカウントごとの重複チェックはしない）
+    def run_callback(self, func, *args):
+        try:
+            return self._pool.submit(func, *args)
+        except RuntimeError:
+            # 終了処理中でプールが使えなければ呼び出し元のスレッドで実行する
+            return func(*args)
+
+    def record_skip(self):
+        with self._lock:
+            self._metrics['skipped'] += 1
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['pending'] = len(self._pending)
+        return metrics
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def _run(self, account_id):
+        try:
+            self.post_func(account_id)
+        except Exception as e:
+            logger.error("投稿ワーカーでエラーが発生しました: アカウント %s: %s", account_id, e)
+        finally:
+            with self._lock:
+                self._pending.discard(account_id)
+                self._metrics['completed'] += 1
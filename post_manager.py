@@ -1,136 +1,329 @@
-import threading
+import os
+import time
 import logging
 from datetime import datetime, timedelta
 import tweepy
-from db_manager import get_message
-from account_manager import clients
+from db_manager import get_account, claim_message, ack_message, release_message, fail_message, save_next_fire_times
+from account_manager import get_client
+from media_manager import get_media_ids
+from scheduler import PostScheduler
+from post_executor import PostExecutor
+from async_poster import AsyncPoster, TweetPostError, aiohttp
+from rate_limiter import RateLimiter
+from leader import LeaderElector
+from history_manager import post_history
+from metrics import registry, posts_total, create_tweet_seconds
+
+logger = logging.getLogger(__name__)
 
-INTERVAL_IN_SECONDS = 3600  # 1時間（秒単位）
-CHECK_INTERVAL = 60         # 1分（秒単位）
 MINIMUM_POST_INTERVAL_MINUTES = 1  # 重複回避のための最小投稿間隔（分単位）を1分に変更
-DEFAULT_INTERVAL_HOURS = 3  # デフォルトの投稿間隔（時間単位）
 
-post_lock = threading.Lock()  # 投稿用のロック
 post_disable_until = {}  # アカウントごとの投稿停止時間
-auto_post_threads = {}  # アカウントごとのスレッド（スレッドと停止用のイベントを格納）
 last_post_time = {}     # アカウントごとの最後の投稿時間
 
-# 次の投稿時間の計算
-def get_seconds_until_next_post(specific_times):
-    now = datetime.now().time()
-    future_times = [datetime.strptime(t, "%H:%M").time() for t in specific_times if datetime.strptime(t, "%H:%M").time() > now]
-    if future_times:
-        next_time = min(future_times)
+CLAIM_LEASE_SECONDS = 300         # 投稿中のメッセージを他のワーカーに渡さない時間（秒）
+RETRY_BACKOFF_SECONDS = 60        # 投稿に失敗したメッセージを再試行するまでの最初の待ち時間（秒）
+MAX_RETRY_BACKOFF_SECONDS = 3600  # 再試行までの待ち時間の上限（秒）
+MAX_DUPLICATE_SKIPS = 3           # 1回の投稿で重複を飛ばして次を試す最大回数
+MAX_POST_ATTEMPTS = 5             # 投稿を諦めるまでの最大試行回数
+# 何度送っても同じ結果になるため再試行しないエラー（本文が長すぎる・投稿が禁止されているなど）
+NON_RETRYABLE_STATUSES = {400, 403, 413, 422}
+
+# 投稿バックエンドの選択（POST_BACKEND=async で全アカウント共通の接続プールを使う非同期投稿）
+POST_BACKEND = os.getenv('POST_BACKEND', 'tweepy')
+if POST_BACKEND == 'async' and aiohttp is None:
+    logger.warning("aiohttp がインストールされていないため tweepy で投稿します")
+async_poster = AsyncPoster() if POST_BACKEND == 'async' and aiohttp is not None else None
+
+# tweepy でツイートを投稿して完了まで待つ（media_ids はアップロード済みの画像）
+# （非同期バックエンドでは _submit_claimed_message が完了を待たずに投稿する）
+def create_tweet(account_id, client, message, media_ids=None):
+    options = {'media_ids': media_ids} if media_ids else {}
+    with create_tweet_seconds.time(backend='tweepy'):
+        return client.create_tweet(text=message, **options)
+
+# APIエラーのステータスコードとレスポンスヘッダーを取得
+def _error_response(e):
+    if isinstance(e, TweetPostError):
+        return e.status, e.headers
+    response = getattr(e, 'response', None)
+    if response is not None:
+        return response.status_code, response.headers
+    return None, None
+
+# 投稿されたツイートのID（tweepy のレスポンス、非同期投稿の TweetResponse のどちらでも。取得できなければ None）
+def _posted_tweet_id(response):
+    data = getattr(response, 'data', None)
+    if data is None and callable(getattr(response, 'json', None)):
+        try:
+            data = response.json().get('data')
+        except (ValueError, AttributeError):
+            data = None
+    if isinstance(data, dict) and data.get('id') is not None:
+        return str(data['id'])
+    return None
+
+# 投稿の結果を履歴に記録する（書き込みは別スレッドで行う）
+def _record_history(account_id, claimed, started, outcome, response=None):
+    latency_ms = (time.perf_counter() - started) * 1000
+    post_history.record(account_id, claimed['id'], claimed['content_id'], claimed['message'],
+                        _posted_tweet_id(response), latency_ms, outcome)
+
+# 投稿できないメッセージを諦め、編集されるまで再試行しない
+def _reject_message(account_id, claimed, started, error):
+    logger.warning("投稿できないメッセージを再試行の対象から外しました: アカウント %s: メッセージ %s: %s",
+                   account_id, claimed['id'], error)
+    fail_message(claimed['id'], error)
+    _record_history(account_id, claimed, started, 'rejected')
+    return 'rejected'
+
+# 失敗した回数に応じた再試行までの秒数（指数バックオフ）
+def get_retry_delay(attempts):
+    return min(RETRY_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), MAX_RETRY_BACKOFF_SECONDS)
+
+# 投稿するメッセージを1件確保する（確保できなければ結果の文字列 deferred / empty を返す）
+def _claim_for_post(account_id, app_key):
+    # 上限に達していれば投稿を失敗させず、投稿できる時刻まで延期する
+    wait = rate_limiter.acquire(account_id, app_key)
+    if wait > 0:
+        logger.debug("投稿数の上限のため投稿を延期します: アカウント %s: %.0f秒", account_id, wait)
+        scheduler.defer(account_id, wait)
+        return 'deferred'
+
+    claimed = claim_message(account_id, CLAIM_LEASE_SECONDS)
+    if not claimed:
+        rate_limiter.release(account_id, app_key)
+        logger.debug("投稿するメッセージがありません: アカウント %s", account_id)
+        return 'empty'
+
+    logger.debug("投稿するメッセージ: アカウント %s: %s", account_id, claimed['message'])
+    posts_total.inc(result='attempted')
+    return claimed
+
+# 投稿の結果（response か error のどちらか）をDBと履歴に反映し、結果（posted / duplicate / deferred / failed / rejected）を返す
+def _finish_post(account_id, app_key, claimed, started, response=None, error=None):
+    tweet_id = claimed['id']
+    if error is None:
+        ack_message(tweet_id)
+        _record_history(account_id, claimed, started, 'posted', response)
+        rate_limiter.update_from_headers(account_id, app_key, response.headers)
+        logger.info("投稿完了: アカウント %s: %s", account_id, claimed['message'],
+                    extra={'account_id': account_id, 'tweet_id': tweet_id})
+        return 'posted'
+
+    status = None
+    if isinstance(error, tweepy.TweepyException):
+        status, headers = _error_response(error)
+        if status == 429:
+            # メッセージはキューに戻し、制限が解除される時刻に再実行する
+            release_message(tweet_id)
+            _record_history(account_id, claimed, started, 'rate_limited')
+            scheduler.defer(account_id, rate_limiter.record_rate_limited(account_id, app_key, headers))
+            return 'deferred'
+        rate_limiter.update_from_headers(account_id, app_key, headers)
+        if "duplicate" in str(error):
+            # 同じ内容は既に投稿されているので投稿済みとして扱う
+            logger.info("重複投稿エラーが発生しました。次のメッセージを試します: アカウント %s", account_id)
+            ack_message(tweet_id)
+            _record_history(account_id, claimed, started, 'duplicate')
+            return 'duplicate'
+        logger.error("メッセージの投稿でエラーが発生しました: アカウント %s: %s", account_id, error)
+        if status in NON_RETRYABLE_STATUSES:
+            return _reject_message(account_id, claimed, started, str(error))
     else:
-        next_time = min([datetime.strptime(t, "%H:%M").time() for t in specific_times])
-    next_post_time = datetime.combine(datetime.today(), next_time)
-    if next_post_time < datetime.now():
-        next_post_time += timedelta(days=1)
-    return (next_post_time - datetime.now()).total_seconds()
-
-# 自動投稿の実行関数
-def job(account_id, stop_event, account_settings):
+        logger.error("メッセージの投稿で予期しないエラーが発生しました: アカウント %s: %s", account_id, error)
+
+    # 認証エラーはアカウントの問題なので、メッセージは諦めずに再試行し続ける
+    if claimed['attempts'] >= MAX_POST_ATTEMPTS and status != 401:
+        return _reject_message(account_id, claimed, started, str(error))
+
+    # 通信エラーなどで失敗したメッセージは失わず、バックオフ後に再試行する
+    _record_history(account_id, claimed, started, 'failed')
+    delay = get_retry_delay(claimed['attempts'])
+    release_message(tweet_id, time.time() + delay)
+    scheduler.defer(account_id, delay)
+    return 'failed'
+
+# 確保したメッセージを1件投稿して完了まで待ち、結果（posted / duplicate / deferred / failed / rejected / empty）を返す
+def _post_claimed_message(account_id, client, app_key):
+    claimed = _claim_for_post(account_id, app_key)
+    if isinstance(claimed, str):
+        return claimed
+    started = time.perf_counter()
     try:
-        logging.debug(f"ジョブ関数が開始されました: アカウント {account_id}")
-        while not stop_event.is_set():
-            settings = account_settings.get(account_id, {})
-            interval_type = settings.get('interval_type', 'interval')
-            interval = settings.get('interval', DEFAULT_INTERVAL_HOURS)
-            specific_times = settings.get('specific_times', [])
-
-            current_time = datetime.now()
-            if account_id in last_post_time:
-                time_since_last_post = current_time - last_post_time[account_id]
-                if time_since_last_post < timedelta(minutes=MINIMUM_POST_INTERVAL_MINUTES):
-                    logging.debug(f"最近の活動のためジョブをスキップします: アカウント {account_id}")
-                    if stop_event.wait(CHECK_INTERVAL):
-                        break
-                    continue
-
-            if interval_type == 'interval':
-                logging.debug(f"インターバルモードでメッセージを投稿します: アカウント {account_id}")
-                post_message(account_id)
-                if stop_event.wait(interval * INTERVAL_IN_SECONDS):
-                    break
+        with post_executor.inflight:
+            media_ids = get_media_ids(account_id, claimed['media_path'])
+            response = create_tweet(account_id, client, claimed['message'], media_ids)
+    except Exception as e:
+        return _finish_post(account_id, app_key, claimed, started, error=e)
+    return _finish_post(account_id, app_key, claimed, started, response)
+
+def _record_result(account_id, result, current_time):
+    posts_total.inc(result=result)
+    if result == 'posted':
+        last_post_time[account_id] = current_time
+        post_disable_until[account_id] = current_time + timedelta(minutes=MINIMUM_POST_INTERVAL_MINUTES)
+
+# 非同期バックエンドで確保したメッセージの投稿を依頼し、完了を待たずに戻る
+# 依頼できたら True を返し、アカウントのロックは投稿が完了したときに外す（それまで同じアカウントの投稿は重ならない）
+def _submit_claimed_message(account_id, account_lock, current_time, skips=0):
+    credentials = get_account(account_id)
+    app_key = credentials['consumer_api_key']
+    claimed = _claim_for_post(account_id, app_key)
+    if isinstance(claimed, str):
+        posts_total.inc(result=claimed)
+        return False
+    started = time.perf_counter()
+    post_executor.inflight.acquire()  # 同時に送る create_tweet の数は同期のバックエンドと同じ上限に従う
+    try:
+        media_ids = get_media_ids(account_id, claimed['media_path'])
+        future = async_poster.submit(credentials, claimed['message'], media_ids)
+    except Exception as e:
+        post_executor.inflight.release()
+        _record_result(account_id, _finish_post(account_id, app_key, claimed, started, error=e), current_time)
+        return False
+
+    def on_done(future):
+        # 枠はイベントループのスレッドで先に返す（ワーカーが全て枠待ちでも完了処理が詰まらないように）
+        post_executor.inflight.release()
+        post_executor.run_callback(
+            _complete_async_post, account_id, account_lock, current_time, skips, app_key, claimed, started, future)
+
+    future.add_done_callback(on_done)
+    return True
+
+# 非同期の投稿が完了したら投稿ワーカーで結果を反映する（イベントループのスレッドではDBに書き込まない）
+def _complete_async_post(account_id, account_lock, current_time, skips, app_key, claimed, started, future):
+    handed_off = False
+    try:
+        create_tweet_seconds.observe(time.perf_counter() - started, backend='async')
+        error = future.exception()
+        response = future.result() if error is None else None
+        result = _finish_post(account_id, app_key, claimed, started, response, error)
+        _record_result(account_id, result, current_time)
+        if result == 'duplicate':
+            # 重複で拒否されたメッセージは飛ばして、決められた回数まで次のメッセージを試す
+            if skips < MAX_DUPLICATE_SKIPS:
+                handed_off = _submit_claimed_message(account_id, account_lock, current_time, skips + 1)
             else:
-                current_time_str = current_time.strftime("%H:%M")
-                if current_time_str in specific_times:
-                    logging.debug(f"指定時間にメッセージを投稿します: {current_time_str} アカウント {account_id}")
-                    post_message(account_id)
-                if stop_event.wait(CHECK_INTERVAL):
-                    break
+                logger.warning("重複が続いたため投稿を中止しました: アカウント %s", account_id)
     except Exception as e:
-        logging.error(f"ジョブでエラーが発生しました: アカウント {account_id}: {e}")
+        logger.error("メッセージの投稿で予期しないエラーが発生しました: アカウント %s: %s", account_id, e)
+    finally:
+        if not handed_off:
+            account_lock.release()
 
 # メッセージの投稿関数
-def post_message(account_id, message=None):
+def post_message(account_id):
+    account_lock = post_executor.account_lock(account_id)  # アカウントごとの投稿用ロック
+    if not account_lock.acquire(blocking=False):
+        logger.debug("ロックのため投稿をスキップします: アカウント %s", account_id)
+        post_executor.record_skip()
+        posts_total.inc(result='skipped_lock')
+        return
+
+    handed_off = False  # 非同期の投稿に渡したロックは投稿の完了時に外す
     try:
-        if not post_lock.acquire(blocking=False):
-            logging.debug(f"ロックのため投稿をスキップします: アカウント {account_id}")
+        # リースが切れていれば他のプロセスが投稿するので何もしない
+        if not leader.is_leader:
+            logger.debug("リーダーではないため投稿をスキップします: アカウント %s", account_id)
             return
 
         current_time = datetime.now()
         if account_id in post_disable_until and current_time < post_disable_until[account_id]:
-            logging.debug(f"一時的な停止のため投稿をスキップします: アカウント {account_id}")
+            logger.debug("一時的な停止のため投稿をスキップします: アカウント %s", account_id)
+            posts_total.inc(result='skipped_cooldown')
             return
 
-        logging.debug(f"メッセージを投稿しようとしています: アカウント {account_id}")
+        logger.debug("メッセージを投稿しようとしています: アカウント %s", account_id)
 
         # 前回の投稿時間を確認
         if account_id in last_post_time:
             time_since_last_post = current_time - last_post_time[account_id]
             if time_since_last_post < timedelta(minutes=MINIMUM_POST_INTERVAL_MINUTES):
-                logging.debug(f"最近の活動のため投稿をスキップします: アカウント {account_id}")
+                logger.debug("最近の活動のため投稿をスキップします: アカウント %s", account_id)
+                posts_total.inc(result='skipped_cooldown')
                 return
 
-        if not message:
-            message = get_message(account_id)
-
-        if message:
-            logging.debug(f"投稿するメッセージ: アカウント {account_id}: {message}")
-            client = clients.get(account_id)
-            if client:
-                response = client.create_tweet(text=message)
-                # logging.debug(f"ツイートのレスポンス: アカウント {account_id}: {response}")
-                print(f"投稿完了: {message} \nアカウント {account_id} at {datetime.now()}")
-                # print(f"ツイートID: アカウント {account_id}: {response.data['id']}")
-                last_post_time[account_id] = current_time
-                post_disable_until[account_id] = current_time + timedelta(minutes=MINIMUM_POST_INTERVAL_MINUTES)  # 10分間投稿停止
-            else:
-                logging.error(f"Twitterクライアントが利用できません: アカウント {account_id}")
-        else:
-            logging.debug(f"投稿するメッセージがありません: アカウント {account_id}")
-    except tweepy.TweepyException as e:
-        logging.error(f"メッセージの投稿でエラーが発生しました: アカウント {account_id}: {e}")
-        print(f"エラーが発生しました: {e}")
-        if "duplicate" in str(e):
-            print(f"重複投稿エラーが発生しました。次のメッセージを試します。 アカウント {account_id}")
-            next_message = get_message(account_id)
-            if next_message:
-                post_message(account_id, message=next_message)
+        # 非同期バックエンドではワーカーは応答を待たずに次のアカウントに移る
+        if async_poster:
+            handed_off = _submit_claimed_message(account_id, account_lock, current_time)
+            return
+
+        client = get_client(account_id)  # 初めて投稿するときに作成する
+        if not client:
+            logger.error("Twitterクライアントが利用できません: アカウント %s", account_id)
+            return
+
+        # 重複で拒否されたメッセージは飛ばして、決められた回数まで次のメッセージを試す
+        for _ in range(MAX_DUPLICATE_SKIPS + 1):
+            result = _post_claimed_message(account_id, client, client.consumer_key)
+            _record_result(account_id, result, current_time)
+            if result != 'duplicate':
+                return
+        logger.warning("重複が続いたため投稿を中止しました: アカウント %s", account_id)
     except Exception as e:
-        logging.error(f"メッセージの投稿で予期しないエラーが発生しました: アカウント {account_id}: {e}")
+        logger.error("メッセージの投稿で予期しないエラーが発生しました: アカウント %s: %s", account_id, e)
     finally:
-        if post_lock.locked():
-            post_lock.release()
+        if not handed_off:
+            account_lock.release()
+
+rate_limiter = RateLimiter()  # アカウントごと・アプリごとの投稿数の上限
+post_executor = PostExecutor(post_message)  # 投稿用のワーカープール
+scheduler = PostScheduler(post_executor.submit, on_fire_times=save_next_fire_times)  # 全アカウント共通のスケジューラ（次回の投稿時刻はDBに保存）
+leader = LeaderElector('post_scheduler', on_demoted=scheduler.cancel_all)  # スケジューラを動かすプロセスの選出
+
+# /metrics で出力する現在値（このプロセスの投稿ワーカーとスケジューラの状態）
+registry.gauge('tweetbot_post_executor_pending', 'キュー待ちまたは投稿中のアカウント数',
+               callback=lambda: {(): post_executor.get_metrics()['pending']})
+registry.gauge('tweetbot_scheduled_accounts', 'スケジューラに予定が登録されているアカウント数',
+               callback=lambda: {(): len(scheduler)})
+registry.gauge('tweetbot_scheduler_leader', 'このプロセスがスケジューラのリーダーなら1',
+               callback=lambda: {(): int(leader.is_leader)})
+registry.gauge('tweetbot_rate_limit_tokens', 'アカウントごとの残り投稿可能数', ['account_id'],
+               callback=lambda: {(account_id,): status['tokens']
+                                 for account_id, status in rate_limiter.get_status()['accounts'].items()})
+
+# リーダー選出を開始し、リーダーの間は sync_schedules で予定をDBの状態に合わせる
+def start_post_scheduler(sync_schedules):
+    leader.start(on_tick=sync_schedules)
+
+# 投稿のキュー追加数・スキップ数などを取得
+def get_post_metrics():
+    return post_executor.get_metrics()
+
+# アカウントごとの残り投稿可能数を取得
+def get_rate_limit_status():
+    return rate_limiter.get_status()
 
 # 自動投稿スケジュールの更新
-def update_auto_post_schedule(account_id, account_settings):
-    global auto_post_threads
-
-    logging.debug(f"自動投稿スケジュールを更新しています: アカウント {account_id}")
-
-    # 現在のスレッドが存在し、動作中であれば停止
-    if account_id in auto_post_threads:
-        stop_event = auto_post_threads[account_id]['event']
-        stop_event.set()  # スレッドを停止させる
-        thread = auto_post_threads[account_id]['thread']
-        thread.join()     # スレッドが終了するのを待つ
-        logging.debug(f"既存のスレッドを停止しました: アカウント {account_id}")
-
-    # 新しいスレッドを開始
-    stop_event = threading.Event()
-    thread = threading.Thread(target=job, args=(account_id, stop_event, account_settings))
-    thread.start()
-    auto_post_threads[account_id] = {'thread': thread, 'event': stop_event}
-    logging.debug(f"新しいスレッドを開始しました: アカウント {account_id}")
+# （リーダーでないプロセスではDBの変更をリーダーが反映するので何もしない）
+def update_auto_post_schedule(account_id, settings):
+    if not leader.is_leader:
+        return
+    logger.debug("自動投稿スケジュールを更新しています: アカウント %s", account_id)
+    scheduler.schedule(account_id, settings)
+
+# 複数アカウントの予定をまとめて登録（items は (アカウントID, 設定, 投稿時刻) のリスト）
+def schedule_auto_posts(items):
+    if not leader.is_leader:
+        return
+    scheduler.schedule_many(items)
+
+# リーダーに選ばれた回数（選ばれ直したら予定を登録し直す）
+def get_leader_term():
+    return leader.term
+
+# 予定に登録されている設定（予定がなければ None）
+def get_scheduled_settings(account_id):
+    return scheduler.get_settings(account_id)
+
+def get_scheduled_account_ids():
+    return scheduler.scheduled_accounts()
+
+# 自動投稿スケジュールの取り消し
+def cancel_auto_post_schedule(account_id):
+    if not leader.is_leader:
+        return
+    if scheduler.cancel(account_id):
+        logger.debug("自動投稿スケジュールを取り消しました: アカウント %s", account_id)
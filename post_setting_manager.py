@@ -1,14 +1,24 @@
-from db_manager import get_settings, get_auto_post_status, set_interval, update_auto_post_status
+import os
+from db_manager import get_settings, get_auto_post_status, set_interval, update_auto_post_status, sync_caches, get_auto_post_rows
 from flask import request, flash, redirect, url_for
+import time
 import logging
-from account_manager import load_account, get_all_account_ids
-from post_manager import update_auto_post_schedule
+from scheduler import get_next_fire_time, stagger_fire_times
+from post_manager import (
+    update_auto_post_schedule, cancel_auto_post_schedule, get_scheduled_settings, get_scheduled_account_ids,
+    start_post_scheduler, schedule_auto_posts, get_leader_term
+)
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_INTERVAL_HOURS = 3  # デフォルトの投稿間隔（時間単位）
+# 止まっている間に過ぎた指定時刻の分を起動時に投稿するか（1 で投稿する。既定では次の指定時刻まで待つ）
+CATCH_UP_MISSED_POSTS = os.getenv('CATCH_UP_MISSED_POSTS', '0') == '1'
+
+_synced_state = {'term': None, 'versions': None}  # 最後に予定を合わせたときのリーダーの任期とキャッシュのバージョン
 
-# 設定の読み込み
-def load_settings(account_id, account_settings):
-    settings = get_settings(account_id)
+# settings テーブルの行から設定の辞書を作る
+def _build_settings(settings):
     if settings:
         interval_type = settings[0]['interval_type']
         if interval_type == 'interval':
@@ -22,18 +32,22 @@ def load_settings(account_id, account_settings):
         interval = DEFAULT_INTERVAL_HOURS  # デフォルトの間隔時間を使用
         specific_times = []
 
-    account_settings[account_id] = {
+    return {
         'interval_type': interval_type,
         'interval': interval,
         'specific_times': specific_times
     }
 
+# 設定の読み込み（DBの値はキャッシュされるため、プロセス内に別の状態は持たない）
+def load_settings(account_id):
+    return _build_settings(get_settings(account_id))
+
 # 自動投稿状態の取得
-def load_auto_post_status(account_id, is_auto_posting):
+def load_auto_post_status(account_id):
     status_row = get_auto_post_status(account_id)
-    is_auto_posting[account_id] = bool(status_row['status']) if status_row else False
+    return bool(status_row['status']) if status_row else False
 
-def set_interval_route(current_account_id, account_settings, is_auto_posting, update_auto_post_schedule):
+def set_interval_route(current_account_id, update_auto_post_schedule):
     try:
         interval_type = request.form['interval_type']
 
@@ -48,68 +62,109 @@ def set_interval_route(current_account_id, account_settings, is_auto_posting, up
 
         set_interval(interval_type, interval, specific_times, current_account_id)
 
-        # アカウント設定を更新
-        load_settings(current_account_id, account_settings)
-
-        # 自動投稿スケジュールを更新
-        update_auto_post_schedule(current_account_id, account_settings)
+        # 自動投稿中なら予定を更新
+        if load_auto_post_status(current_account_id):
+            update_auto_post_schedule(current_account_id, load_settings(current_account_id))
     except Exception as e:
-        logging.error(f"投稿間隔の設定中にエラーが発生しました: {e}")
+        logger.error("投稿間隔の設定中にエラーが発生しました: %s", e)
         flash("投稿間隔の設定中にエラーが発生しました")
     return redirect(url_for('index'))
 
-def start_auto_post(current_account_id, is_auto_posting, update_auto_post_schedule, account_settings):
+def start_auto_post(current_account_id, update_auto_post_schedule):
     try:
-        is_auto_posting[current_account_id] = True
-
         # 自動投稿スケジュールの更新
-        update_auto_post_schedule(current_account_id, account_settings)
+        update_auto_post_schedule(current_account_id, load_settings(current_account_id))
 
         # auto_post_statusテーブルにデータを保存
         update_auto_post_status(current_account_id, True)
 
         flash("自動投稿実行中")
     except Exception as e:
-        logging.error(f"自動投稿の開始中にエラーが発生しました: {e}")
+        logger.error("自動投稿の開始中にエラーが発生しました: %s", e)
         flash("自動投稿の開始中にエラーが発生しました")
     return redirect(url_for('index'))
 
-def stop_auto_post(current_account_id, auto_post_threads, is_auto_posting):
+def stop_auto_post(current_account_id, cancel_auto_post_schedule):
     try:
-        is_auto_posting[current_account_id] = False
-
-        # スレッドを停止
-        if current_account_id in auto_post_threads:
-            stop_event = auto_post_threads[current_account_id]['event']
-            stop_event.set()
-            thread = auto_post_threads[current_account_id]['thread']
-            thread.join()
-            logging.debug(f"スレッドを停止しました: アカウント {current_account_id}")
-            del auto_post_threads[current_account_id]
+        # スケジューラから予定を取り消す
+        cancel_auto_post_schedule(current_account_id)
 
         # auto_post_statusテーブルにデータを保存
         update_auto_post_status(current_account_id, False)
 
         flash("自動投稿を停止しました")
     except Exception as e:
-        logging.error(f"自動投稿の停止中にエラーが発生しました: {e}")
+        logger.error("自動投稿の停止中にエラーが発生しました: %s", e)
         flash("自動投稿の停止中にエラーが発生しました")
     return redirect(url_for('index'))
 
-def check_and_start_auto_post(account_settings, is_auto_posting):
-    account_ids = get_all_account_ids()
-    for account_id in account_ids:
-        load_account(account_id)
-        load_settings(account_id, account_settings)
-        load_auto_post_status(account_id, is_auto_posting)
-        if is_auto_posting.get(account_id, False):
-            update_auto_post_schedule(account_id, account_settings)
-
-def load_account_settings_and_status(account_id, account_settings, is_auto_posting):
-    load_settings(account_id, account_settings)
-    load_auto_post_status(account_id, is_auto_posting)
-    is_posting = is_auto_posting.get(account_id, False)
-    settings = account_settings.get(account_id, {})
+# 全アカウントの自動投稿状態・設定・保存済みの次回投稿時刻を1回のクエリで読み込む
+def load_auto_post_configs():
+    grouped = {}
+    for row in get_auto_post_rows():
+        config = grouped.setdefault(row['account_id'], {'status': bool(row['status']), 'next_fire_at': row['next_fire_at'], 'rows': []})
+        if row['interval_type'] is not None:
+            config['rows'].append(row)
+    return {
+        account_id: {'status': config['status'], 'next_fire_at': config['next_fire_at'], 'settings': _build_settings(config['rows'])}
+        for account_id, config in grouped.items()
+    }
+
+# リーダーになった直後に全アカウントの予定をまとめて登録する
+# 保存済みの次回投稿時刻があればそれを使い、時刻を過ぎたものと初めてのものは一斉に投稿しないよう分散させる
+# （時刻指定のアカウントで過ぎた時刻は、CATCH_UP_MISSED_POSTS でなければ投稿せず次の指定時刻に登録する）
+def _start_schedules(configs):
+    now = time.time()
+    items = []
+    due = []
+    for account_id, config in configs.items():
+        if not config['status']:
+            continue
+        settings = config['settings']
+        fire_at = config['next_fire_at']
+        missed = fire_at is not None and fire_at <= now and not CATCH_UP_MISSED_POSTS
+        if settings['interval_type'] != 'interval' and (fire_at is None or missed):
+            fire_at = get_next_fire_time(settings, now=now)
+            if fire_at is None:
+                continue
+        if fire_at is None or fire_at <= now:
+            due.append(account_id)
+        else:
+            items.append((account_id, settings, fire_at))
+    items.extend((account_id, configs[account_id]['settings'], fire_at)
+                 for account_id, fire_at in stagger_fire_times(due, now=now).items())
+    schedule_auto_posts(items)
+    logger.info("自動投稿の予定を登録しました: %s件（すぐに投稿するもの %s件）", len(items), len(due))
+
+# 全てのアカウントの自動投稿状態をチェックし、スケジューラの予定をDBの状態に合わせる
+# （リーダーのプロセスで定期的に呼ばれ、他のプロセスで変更された設定も反映する）
+def check_and_start_auto_post():
+    versions = sync_caches()
+    term = get_leader_term()
+    if _synced_state == {'term': term, 'versions': versions}:
+        return  # 前回から変更がない
+
+    configs = load_auto_post_configs()
+    if _synced_state['term'] != term:
+        _start_schedules(configs)
+    else:
+        for account_id, config in configs.items():
+            if not config['status']:
+                cancel_auto_post_schedule(account_id)
+            elif get_scheduled_settings(account_id) != config['settings']:
+                update_auto_post_schedule(account_id, config['settings'])
+    # 削除されたアカウントの予定を取り消す
+    for account_id in set(get_scheduled_account_ids()) - set(configs):
+        cancel_auto_post_schedule(account_id)
+    _synced_state.update(term=term, versions=versions)
+
+# 自動投稿のスケジューラを開始（リーダーに選ばれたプロセスだけが投稿する）
+def start_auto_post_scheduler():
+    start_post_scheduler(check_and_start_auto_post)
+
+def load_account_settings_and_status(account_id):
+    settings = load_settings(account_id)
+    is_posting = load_auto_post_status(account_id)
     interval = settings.get('interval')
     specific_times = settings.get('specific_times')
     interval_type = settings.get('interval_type')
@@ -0,0 +1,24 @@
+"""自動投稿だけを行うプロセス
+
+Webサーバーとは別に起動すると、Webのリクエストがなくても自動投稿を続けられる。
+複数起動してもリーダーに選ばれた1つのプロセスだけが投稿する。
+実行方法: python post_worker.py
+"""
+import logging
+import threading
+from dotenv import load_dotenv
+from log_manager import setup_logging
+from db_manager import get_db_connection
+from migrations import run_migrations
+from post_manager import leader
+from post_setting_manager import start_auto_post_scheduler
+
+if __name__ == '__main__':
+    load_dotenv()
+    setup_logging(handlers=[logging.StreamHandler()])
+    run_migrations(get_db_connection())
+    start_auto_post_scheduler()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        leader.stop()  # リースを手放して他のプロセスに引き継ぐ
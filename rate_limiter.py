@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_WINDOW_SECONDS = int(os.getenv('RATE_LIMIT_WINDOW_SECONDS', '86400'))  # 上限の集計期間（秒）
+ACCOUNT_POST_LIMIT = int(os.getenv('ACCOUNT_POST_LIMIT', '100'))  # アカウント（ユーザー）ごとの期間内の投稿数の上限
+APP_POST_LIMIT = int(os.getenv('APP_POST_LIMIT', '1667'))         # アプリ（consumer key）ごとの期間内の投稿数の上限
+DEFAULT_RETRY_AFTER_SECONDS = 900  # 429 にリセット時刻が含まれない場合の待ち時間
+
+
+class TokenBucket:
+    """投稿数の上限を表すトークンバケット
+
+    通常は期間あたりの上限から一定の速度で補充する。APIのレート制限ヘッダーを受け取った後は
+    残り回数をそのまま使い、リセット時刻になるまで補充しない。
+    """
+
+    def __init__(self, capacity, window, now):
+        self.capacity = capacity
+        self.window = window
+        self.tokens = float(capacity)
+        self.updated = now
+        self.reset_at = None  # ヘッダーから得たリセット時刻（エポック秒）
+
+    def _refill(self, now):
+        if self.reset_at is not None:
+            if now < self.reset_at:
+                return
+            self.tokens = float(self.capacity)
+            self.reset_at = None
+        elif now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.window)
+        self.updated = now
+
+    # トークンが1つ使えるようになるまでの秒数（0なら今すぐ使える）
+    def wait_time(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.reset_at is not None:
+            return self.reset_at - now
+        return (1 - self.tokens) * self.window / self.capacity
+
+    def take(self):
+        self.tokens -= 1
+
+    def give_back(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    # APIが返した上限・残り回数・リセット時刻で置き換える
+    def sync(self, limit, remaining, reset_at, now):
+        self.capacity = max(limit, 1)
+        self.tokens = float(min(remaining, self.capacity))
+        self.reset_at = reset_at if reset_at and reset_at > now else None
+        self.updated = now
+
+    def status(self, now):
+        wait = self.wait_time(now)
+        return {
+            'capacity': self.capacity,
+            'tokens': int(self.tokens),
+            'wait_seconds': round(wait, 1),
+            'reset_at': self.reset_at,
+        }
+
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """アカウントごととアプリごとのトークンバケットで投稿数を制限する"""
+
+    def __init__(self, account_limit=ACCOUNT_POST_LIMIT, app_limit=APP_POST_LIMIT,
+                 window=RATE_LIMIT_WINDOW_SECONDS, clock=time.time):
+        self.account_limit = account_limit
+        self.app_limit = app_limit
+        self.window = window
+        self.clock = clock
+        self._accounts = {}      # アカウントID -> TokenBucket
+        self._apps = {}          # consumer key -> TokenBucket
+        self._account_apps = {}  # アカウントID -> consumer key
+        self._lock = threading.Lock()
+        self.deferred = 0        # 上限のため後回しにした回数
+        self.rate_limited = 0    # APIから 429 が返った回数
+
+    def _buckets(self, account_id, app_key, now):
+        account = self._accounts.get(account_id)
+        if account is None:
+            account = self._accounts[account_id] = TokenBucket(self.account_limit, self.window, now)
+        app = self._apps.get(app_key)
+        if app is None:
+            app = self._apps[app_key] = TokenBucket(self.app_limit, self.window, now)
+        self._account_apps[account_id] = app_key
+        return account, app
+
+    # 投稿できればトークンを使って 0 を、できなければ待つべき秒数を返す
+    def acquire(self, account_id, app_key):
+        with self._lock:
+            now = self.clock()
+            account, app = self._buckets(account_id, app_key, now)
+            wait = max(account.wait_time(now), app.wait_time(now))
+            if wait > 0:
+                self.deferred += 1
+                return wait
+            account.take()
+            app.take()
+            return 0.0
+
+    # 投稿しなかった場合にトークンを戻す
+    def release(self, account_id, app_key):
+        with self._lock:
+            account, app = self._buckets(account_id, app_key, self.clock())
+            account.give_back()
+            app.give_back()
+
+    # レスポンスのレート制限ヘッダーでバケットを更新する
+    def update_from_headers(self, account_id, app_key, headers):
+        if not headers:
+            return
+        headers = {name.lower(): value for name, value in headers.items()}
+        with self._lock:
+            now = self.clock()
+            account, app = self._buckets(account_id, app_key, now)
+            self._sync(account, headers, 'x-rate-limit', now)
+            # 24時間あたりの上限の方が厳しければそちらに合わせる
+            remaining = _int_header(headers, 'x-user-limit-24hour-remaining')
+            if remaining is not None and remaining < account.tokens:
+                self._sync(account, headers, 'x-user-limit-24hour', now)
+            self._sync(app, headers, 'x-app-limit-24hour', now)
+
+    def _sync(self, bucket, headers, prefix, now):
+        limit = _int_header(headers, f'{prefix}-limit')
+        remaining = _int_header(headers, f'{prefix}-remaining')
+        if limit is None or remaining is None:
+            return
+        bucket.sync(limit, remaining, _int_header(headers, f'{prefix}-reset'), now)
+
+    # 429 が返った場合、リセット時刻（なければ Retry-After）まで投稿を止める
+    def record_rate_limited(self, account_id, app_key, headers):
+        self.update_from_headers(account_id, app_key, headers)
+        headers = {name.lower(): value for name, value in (headers or {}).items()}
+        with self._lock:
+            self.rate_limited += 1
+            now = self.clock()
+            account, app = self._buckets(account_id, app_key, now)
+            if max(account.wait_time(now), app.wait_time(now)) <= 0:
+                retry_after = _int_header(headers, 'retry-after') or DEFAULT_RETRY_AFTER_SECONDS
+                account.sync(account.capacity, 0, now + retry_after, now)
+            wait = max(account.wait_time(now), app.wait_time(now))
+        logger.warning("レート制限に達しました: アカウント %s: %.0f秒後まで投稿を延期します", account_id, wait)
+        return wait
+
+    # アカウントごとの残り投稿可能数
+    def get_status(self):
+        with self._lock:
+            now = self.clock()
+            accounts = {}
+            for account_id, bucket in self._accounts.items():
+                status = bucket.status(now)
+                app = self._apps[self._account_apps[account_id]].status(now)
+                status['app'] = app
+                status['wait_seconds'] = max(status['wait_seconds'], app['wait_seconds'])
+                accounts[account_id] = status
+            return {'accounts': accounts, 'deferred': self.deferred, 'rate_limited': self.rate_limited}
@@ -0,0 +1,209 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from metrics import scheduler_lag_seconds
+
+logger = logging.getLogger(__name__)
+
+INTERVAL_IN_SECONDS = 3600  # 1時間（秒単位）
+DEFAULT_INTERVAL_HOURS = 3  # デフォルトの投稿間隔（時間単位）
+STARTUP_STAGGER_SECONDS = 300  # 起動時にすぐ投稿するアカウントを分散させる時間幅（秒）
+
+# 次の投稿時刻（エポック秒）の計算
+def get_next_fire_time(settings, now=None, first=False):
+    if now is None:
+        now = time.time()
+    interval_type = settings.get('interval_type', 'interval')
+
+    if interval_type == 'interval':
+        # インターバルモードは開始直後に1回投稿し、その後は間隔ごとに投稿する
+        if first:
+            return now
+        interval = settings.get('interval') or DEFAULT_INTERVAL_HOURS
+        return now + interval * INTERVAL_IN_SECONDS
+
+    specific_times = settings.get('specific_times') or []
+    if not specific_times:
+        return None
+
+    current = datetime.fromtimestamp(now)
+    candidates = []
+    for t in specific_times:
+        post_time = datetime.strptime(t, "%H:%M").time()
+        candidate = datetime.combine(current.date(), post_time)
+        if candidate <= current:
+            candidate += timedelta(days=1)
+        candidates.append(candidate)
+    return min(candidates).timestamp()
+
+# すぐに投稿するアカウントの投稿時刻を window 秒の間に均等に分散させる
+def stagger_fire_times(account_ids, now=None, window=STARTUP_STAGGER_SECONDS):
+    if now is None:
+        now = time.time()
+    count = len(account_ids)
+    return {account_id: now + window * i / count for i, account_id in enumerate(account_ids)}
+
+
+class PostScheduler:
+    """全アカウントの投稿予定を1本のスレッドとヒープで管理するスケジューラ"""
+
+    def __init__(self, dispatch, on_fire_times=None):
+        self.dispatch = dispatch          # 投稿時刻になったアカウントIDを受け取る関数
+        self.on_fire_times = on_fire_times  # 次回の投稿時刻 [(アカウントID, 時刻)] を受け取る関数（保存用）
+        self._heap = []                   # (投稿時刻, 連番, アカウントID, 世代, 定期実行か)
+        self._entries = {}                # アカウントID -> {'settings': アカウントの設定, 'generation': 世代, 'deferred': 再実行待ちか}
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        with self._condition:
+            return len(self._entries)
+
+    def is_scheduled(self, account_id):
+        with self._condition:
+            return account_id in self._entries
+
+    # アカウントの予定を登録または更新（O(log n)）
+    def schedule(self, account_id, settings, fire_at=None):
+        self.schedule_many([(account_id, settings, fire_at)])
+        logger.debug("投稿予定を更新しました: アカウント %s", account_id)
+
+    # 複数アカウントの予定をまとめて登録（items は (アカウントID, 設定, 投稿時刻またはNone) のリスト）
+    def schedule_many(self, items):
+        fire_times = []
+        with self._condition:
+            for account_id, settings, fire_at in items:
+                entry = self._entries.get(account_id)
+                generation = entry['generation'] + 1 if entry else 0
+                self._entries[account_id] = {'settings': settings, 'generation': generation, 'deferred': False}
+                if fire_at is None:
+                    fire_at = get_next_fire_time(settings, first=True)
+                if fire_at is not None:
+                    self._push(fire_at, account_id, generation)
+                    fire_times.append((account_id, fire_at))
+            self._compact()
+            self._ensure_thread()
+            self._condition.notify()
+        self._save_fire_times(fire_times)
+
+    # アカウントの予定を取り消す（ヒープ上の古い要素は取り出し時に破棄）
+    def cancel(self, account_id):
+        with self._condition:
+            removed = self._entries.pop(account_id, None) is not None
+            self._compact()
+            self._condition.notify()
+        return removed
+
+    # 全ての予定を取り消す
+    def cancel_all(self):
+        with self._condition:
+            self._entries.clear()
+            self._heap = []
+            self._condition.notify()
+
+    # 予定に登録されている設定（予定がなければ None）
+    def get_settings(self, account_id):
+        with self._condition:
+            entry = self._entries.get(account_id)
+            return entry['settings'] if entry else None
+
+    def scheduled_accounts(self):
+        with self._condition:
+            return list(self._entries)
+
+    # 投稿できなかったアカウントを delay 秒後に一度だけ再実行する（定期の予定はそのまま）
+    def defer(self, account_id, delay):
+        with self._condition:
+            entry = self._entries.get(account_id)
+            if entry is None or entry['deferred']:
+                return False
+            entry['deferred'] = True
+            self._push(time.time() + delay, account_id, entry['generation'], repeat=False)
+            self._condition.notify()
+        logger.debug("投稿を%.0f秒後に延期しました: アカウント %s", delay, account_id)
+        return True
+
+    def next_fire_time(self, account_id):
+        with self._condition:
+            entry = self._entries.get(account_id)
+            if not entry:
+                return None
+            times = [fire_at for fire_at, _, acc_id, generation, repeat in self._heap
+                     if acc_id == account_id and generation == entry['generation'] and repeat]
+            return min(times) if times else None
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _save_fire_times(self, fire_times):
+        if not (self.on_fire_times and fire_times):
+            return
+        try:
+            self.on_fire_times(fire_times)
+        except Exception as e:
+            logger.error("次回の投稿時刻の保存に失敗しました: %s", e)
+
+    def _push(self, fire_at, account_id, generation, repeat=True):
+        heapq.heappush(self._heap, (fire_at, next(self._counter), account_id, generation, repeat))
+
+    def _is_current(self, account_id, generation):
+        entry = self._entries.get(account_id)
+        return entry is not None and entry['generation'] == generation
+
+    # 取り消し済みの要素が溜まりすぎたらヒープを作り直す
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [item for item in self._heap if self._is_current(item[2], item[3])]
+            heapq.heapify(self._heap)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='post-scheduler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        logger.debug("スケジューラを開始しました")
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    while self._heap and not self._is_current(self._heap[0][2], self._heap[0][3]):
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if self._stopped:
+                    break
+
+                fire_at, _, account_id, generation, repeat = heapq.heappop(self._heap)
+                scheduler_lag_seconds.observe(max(time.time() - fire_at, 0.0))
+                entry = self._entries[account_id]
+                fire_times = []
+                if repeat:
+                    next_fire_at = get_next_fire_time(entry['settings'], now=max(fire_at, time.time()))
+                    if next_fire_at is not None:
+                        self._push(next_fire_at, account_id, generation)
+                        fire_times.append((account_id, next_fire_at))
+                else:
+                    entry['deferred'] = False
+
+            self._save_fire_times(fire_times)
+            try:
+                self.dispatch(account_id)
+            except Exception as e:
+                logger.error("スケジューラで投稿の呼び出しに失敗しました: アカウント %s: %s", account_id, e)
+        logger.debug("スケジューラを停止しました")
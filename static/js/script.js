@@ -1,52 +1,223 @@
 let isEditing = false;
+let changesCursor = 0;    // 差分取得に使う変更番号
+let nextAfterId = null;   // 次のページの開始位置（nullなら全件読み込み済み）
+let eventSource = null;   // /events の接続（対応していないブラウザでは null）
+let pendingEvents = [];   // 編集中に受け取った変更（編集が終わったら反映する）
 
-function fetchMessages() {
-    if (isEditing) return;  // 編集中の場合は更新を止める
-    fetch('/messages')
+const POLL_INTERVAL_MILLISECONDS = 30000;  // イベントストリームが使えない場合に差分を取得する間隔
+const CHANGE_EVENTS = ['posted', 'inserted', 'edited', 'restored', 'deleted', 'reload', 'stats'];
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML.replace(/"/g, '&quot;');
+}
+
+function createMessageItem(message) {
+    const li = document.createElement('li');
+    li.classList.add('list-group-item');
+    if (message.is_deleted) {
+        li.classList.add('deleted');
+    }
+    li.dataset.id = message.id;
+    const text = escapeHtml(message.message);
+    li.innerHTML = `
+        <span class="message-text">${text}${message.is_deleted ? ' (投稿済み)' : ''}</span>
+        ${message.media_path ? `<span class="badge badge-info media-path">画像: ${escapeHtml(message.media_path)}</span>` : ''}
+        <button
+            class="btn btn-sm btn-warning edit-btn"
+            data-id="${message.id}"
+            data-message="${text}"
+            onclick="editMessage(this)">編集</button>
+        <form action="/delete/${message.id}" method="post" style="display:inline;">
+            <button type="submit" class="btn btn-sm btn-danger delete-btn">削除</button>
+        </form>
+        <form action="/edit/${message.id}" method="post" class="edit-form" id="editForm-${message.id}" style="display:none;">
+            <input type="text" name="new_message" class="form-control d-inline w-75" value="${text}" placeholder="新しいメッセージ" style="display: none;">
+            <button type="submit" class="btn btn-sm btn-primary" style="display: none;">更新</button>
+            <button
+                type="button"
+                class="btn btn-sm btn-secondary"
+                style="display: none;"
+                data-id="${message.id}"
+                onclick="cancelEdit(this)">キャンセル</button>
+        </form>
+    `;
+    return li;
+}
+
+// 変更されたメッセージを一覧に反映する（ID順を保つ）
+function applyMessage(message) {
+    const messageList = document.getElementById('message-list');
+    const existing = messageList.querySelector(`li[data-id='${message.id}']`);
+    if (existing) {
+        existing.replaceWith(createMessageItem(message));
+        return;
+    }
+    // まだ読み込んでいないページのメッセージは、そのページを読み込んだときに表示される
+    if (nextAfterId !== null && message.id > nextAfterId) return;
+
+    const next = Array.from(messageList.children).find(li => Number(li.dataset.id) > message.id);
+    messageList.insertBefore(createMessageItem(message), next || null);
+}
+
+function removeMessage(id) {
+    const li = document.querySelector(`#message-list li[data-id='${id}']`);
+    if (li) li.remove();
+}
+
+// 未投稿に戻ったメッセージの表示を更新する（投稿を諦めたメッセージはサイクルのリセット後も投稿済みのまま）
+function restoreMessages(ids) {
+    ids.forEach(id => {
+        const li = document.querySelector(`#message-list li.deleted[data-id='${id}']`);
+        if (!li) return;
+        const message = li.querySelector('.edit-btn').getAttribute('data-message');
+        const media = li.querySelector('.media-path');
+        const mediaPath = media ? media.textContent.replace(/^画像: /, '') : null;
+        li.replaceWith(createMessageItem({ id: Number(li.dataset.id), message: message, is_deleted: 0, media_path: mediaPath }));
+    });
+}
+
+function updateQueueStats(stats) {
+    document.getElementById('queue-stats').textContent =
+        `未投稿: ${stats.remaining} 件 / 投稿済み: ${stats.posted} 件 / 全 ${stats.total} 件（${stats.cycle + 1} 周目）`;
+}
+
+// サーバーから送られた変更を一覧に反映する
+function applyEvent(type, data) {
+    switch (type) {
+        case 'posted':
+        case 'inserted':
+        case 'edited':
+            applyMessage(data);
+            break;
+        case 'deleted':
+            removeMessage(data.id);
+            break;
+        case 'restored':
+            restoreMessages(data.ids);
+            break;
+        case 'reload':
+            reloadMessages();  // 変更履歴が残っていない場合は読み込み直す
+            break;
+        case 'stats':
+            updateQueueStats(data);
+            break;
+    }
+}
+
+function handleChangeEvent(event) {
+    if (event.lastEventId) {
+        changesCursor = Number(event.lastEventId);
+    }
+    const data = JSON.parse(event.data);
+    if (isEditing) {
+        pendingEvents.push([event.type, data]);
+        return;
+    }
+    applyEvent(event.type, data);
+}
+
+function applyPendingEvents() {
+    const events = pendingEvents;
+    pendingEvents = [];
+    events.forEach(([type, data]) => applyEvent(type, data));
+}
+
+// メッセージの変更を受け取る接続を開く（切断されてもブラウザが続きから再接続する）
+function connectChangeEvents() {
+    eventSource = new EventSource(`/events?since=${changesCursor}`);
+    CHANGE_EVENTS.forEach(type => eventSource.addEventListener(type, handleChangeEvent));
+    eventSource.onerror = () => {
+        // サーバーが接続を断った場合（同時接続数の上限など）はブラウザが再接続しないので定期取得に切り替える
+        if (eventSource.readyState === EventSource.CLOSED) {
+            eventSource = null;
+            startPolling();
+        }
+    };
+}
+
+// 差分の定期取得を始める（イベントストリームが使えない場合）
+function startPolling() {
+    fetchMessages();
+    setInterval(fetchMessages, POLL_INTERVAL_MILLISECONDS);
+}
+
+function updateLoadMoreButton() {
+    document.getElementById('load-more-messages').classList.toggle('d-none', nextAfterId === null);
+}
+
+function loadMessagesPage(afterId) {
+    return fetch(`/messages?after_id=${afterId}`)
         .then(response => response.json())
         .then(data => {
             const messageList = document.getElementById('message-list');
-            messageList.innerHTML = '';
-            data.forEach(message => {
-                const li = document.createElement('li');
-                li.classList.add('list-group-item');
-                if (message.is_deleted) {
-                    li.classList.add('deleted');
-                }
-                li.dataset.id = message.id;
-                li.innerHTML = `
-                    <span class="message-text">${message.message}${message.is_deleted ? ' (投稿済み)' : ''}</span>
-                    <button
-                        class="btn btn-sm btn-warning edit-btn"
-                        data-id="${message.id}"
-                        data-message="${message.message}"
-                        onclick="editMessage(this)">編集</button>
-                    <form action="/delete/${message.id}" method="post" style="display:inline;">
-                        <button type="submit" class="btn btn-sm btn-danger delete-btn">削除</button>
-                    </form>
-                    <form action="/edit/${message.id}" method="post" class="edit-form" id="editForm-${message.id}" style="display:none;">
-                        <input type="text" name="new_message" class="form-control d-inline w-75" value="${message.message}" placeholder="新しいメッセージ" style="display: none;">
-                        <button type="submit" class="btn btn-sm btn-primary" style="display: none;">更新</button>
-                        <button
-                            type="button"
-                            class="btn btn-sm btn-secondary"
-                            style="display: none;"
-                            data-id="${message.id}"
-                            onclick="cancelEdit(this)">キャンセル</button>
-                    </form>
-                `;
-                messageList.appendChild(li);
-            });
+            data.messages.forEach(message => messageList.appendChild(createMessageItem(message)));
+            nextAfterId = data.next_after_id;
+            updateLoadMoreButton();
+            return data;
         });
 }
 
-function checkResetStatus() {
-    if (isEditing) return;  // 編集中の場合はリセットチェックを止める
-    fetch('/reset_status')
+function loadMoreMessages() {
+    if (nextAfterId !== null) {
+        loadMessagesPage(nextAfterId);
+    }
+}
+
+// 一覧を最初のページから読み込み直す
+function reloadMessages() {
+    document.getElementById('message-list').innerHTML = '';
+    loadMessagesPage(0).then(data => {
+        changesCursor = data.cursor;
+    });
+}
+
+// 前回からの差分だけを取得して一覧に反映する
+function fetchMessages() {
+    if (isEditing) return;  // 編集中の場合は更新を止める
+    fetch(`/messages?since=${changesCursor}`)
         .then(response => response.json())
         .then(data => {
             if (data.reset) {
-                fetchMessages();  // リセットされた場合にメッセージ一覧を更新
+                reloadMessages();  // 変更履歴が残っていない場合は読み込み直す
+                return;
+            }
+            data.deleted_ids.forEach(removeMessage);
+            data.changes.forEach(applyMessage);
+            changesCursor = data.cursor;
+            if (data.has_more) {
+                fetchMessages();
+            }
+        });
+}
+
+function fetchImportJobs() {
+    fetch('/import_jobs')
+        .then(response => response.json())
+        .then(jobs => {
+            const jobList = document.getElementById('import-jobs');
+            jobList.innerHTML = '';
+            jobs.forEach(job => {
+                const li = document.createElement('li');
+                li.classList.add('list-group-item');
+                const status = job.status === 'running' ? '取り込み中' : (job.status === 'done' ? '完了' : 'エラー');
+                let text = `${job.filename}: ${status} (処理 ${job.rows} 行 / 追加 ${job.inserted} 件 / 重複 ${job.duplicates} 件)`;
+                if (job.duplicate_preview.length) {
+                    text += ` 重複のため保存できなかったメッセージ: ${job.duplicate_preview.join(', ')}`;
+                    if (job.duplicates > job.duplicate_preview.length) {
+                        text += ` 他 ${job.duplicates - job.duplicate_preview.length} 件`;
+                    }
+                }
+                li.textContent = text;
+                jobList.appendChild(li);
+            });
+
+            // 取り込み中のジョブがあれば進捗の確認を続ける
+            if (jobs.some(job => job.status === 'running')) {
+                setTimeout(fetchImportJobs, 2000);
+            } else if (jobs.length && !eventSource) {
+                fetchMessages();  // イベントを受け取れない場合は差分を取得する
             }
         });
 }
@@ -82,11 +253,14 @@ function cancelEdit(button) {
 
     const form = li.querySelector('.edit-form');
     form.style.display = 'none';
+    applyPendingEvents();
 }
 
 function deleteMessage(id) {
     fetch(`/delete/${id}`, { method: 'POST' })
-        .then(() => fetchMessages());  // メッセージを削除した後メッセージ一覧を更新
+        .then(() => {
+            if (!eventSource) fetchMessages();  // イベントで届かない場合はメッセージ一覧を更新
+        });
 }
 
 function deleteAllMessages() {
@@ -155,13 +329,18 @@ $(document).ready(function () {
     }
 
     // 初期化処理
+    const messageList = document.getElementById('message-list');
+    changesCursor = Number(messageList.dataset.cursor) || 0;
+    nextAfterId = messageList.dataset.nextAfterId ? Number(messageList.dataset.nextAfterId) : null;
     toggleIntervalType();
-    fetchMessages();
+    if (window.EventSource) {
+        connectChangeEvents();  // 変更はサーバーから送られてくる
+    } else {
+        startPolling();
+    }
+    fetchImportJobs();
 });
 
-setInterval(fetchMessages, 3600000); // 1時間おきにメッセージを取得
-setInterval(checkResetStatus, 3600000); // 1時間おきにリセットフラグをチェック
-
 // 設定を保存ボタンのクリックイベントにaccount_idを追加
 document.querySelector('form[action="/set_interval"]').addEventListener('submit', function (e) {
     var accountIdInput = document.createElement('input');
@@ -0,0 +1,43 @@
+import unittest
+from async_poster import AsyncPoster, TweetPostError
+from mock_twitter_api import MockTwitterServer
+
+CREDENTIALS = {
+    'consumer_api_key': 'key',
+    'consumer_api_secret': 'secret',
+    'access_token': 'token',
+    'access_token_secret': 'token_secret',
+}
+
+class TestAsyncPoster(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockTwitterServer(rate_limit=3).start()
+        self.poster = AsyncPoster(base_url=self.server.base_url, timeout=5)
+
+    def tearDown(self):
+        self.poster.close()
+        self.server.stop()
+
+    def test_posts_concurrently_over_shared_session(self):
+        futures = [self.poster.submit(CREDENTIALS, f"message{i}") for i in range(3)]
+        texts = sorted(future.result(5).data['text'] for future in futures)
+        self.assertEqual(texts, ['message0', 'message1', 'message2'])
+        self.assertEqual(self.server.api.requests, 3)
+
+    def test_duplicate_and_rate_limit_errors(self):
+        self.poster.post(CREDENTIALS, 'hello')
+        with self.assertRaises(TweetPostError) as cm:
+            self.poster.post(CREDENTIALS, 'hello')
+        self.assertEqual(cm.exception.status, 403)
+        self.assertIn('duplicate', str(cm.exception))
+
+        self.poster.post(CREDENTIALS, 'second')
+        self.poster.post(CREDENTIALS, 'third')
+        with self.assertRaises(TweetPostError) as cm:
+            self.poster.post(CREDENTIALS, 'fourth')
+        self.assertEqual(cm.exception.status, 429)
+        self.assertIn('retry-after', {name.lower() for name in cm.exception.headers})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import unittest
+import db_manager
+from change_feed import ChangeFeed, stream_events
+from test_helpers import TempDatabaseTestCase
+
+def parse_event(text):
+    fields = dict(line.split(': ', 1) for line in text.strip().splitlines())
+    return fields['event'], json.loads(fields['data']), int(fields['id'])
+
+
+class TestStreamEvents(TempDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account()
+        self.feed = ChangeFeed(poll_seconds=0.05)
+        db_manager.add_change_listener(self.feed.notify)
+
+    def tearDown(self):
+        db_manager._change_listeners.remove(self.feed.notify)
+        super().tearDown()
+
+    def read_events(self, stream):
+        # 変更のイベントを stats まで読む
+        events = []
+        while True:
+            text = next(stream)
+            if text.startswith(':'):
+                continue
+            event, data, _ = parse_event(text)
+            if event == 'stats':
+                return events, data
+            events.append((event, data))
+
+    def test_pushes_changes_from_write_paths(self):
+        db_manager.insert_message('first', self.account_id)
+        stream = stream_events(self.account_id, 0, feed=self.feed, heartbeat=5)
+        self.assertTrue(next(stream).startswith('retry:'))
+        events, stats = self.read_events(stream)
+        first_id = events[0][1]['id']
+        self.assertEqual(events, [('inserted', {'id': first_id, 'message': 'first', 'is_deleted': 0, 'media_path': None})])
+        self.assertEqual(stats['remaining'], 1)
+
+        # 書き込みが通知されると待たずに次の変更が送られる
+        db_manager.insert_message('second', self.account_id)
+        db_manager.update_message('edited', first_id, self.account_id)
+        db_manager.get_message(self.account_id)
+        events, stats = self.read_events(stream)
+        self.assertEqual([event for event, _ in events], ['inserted', 'edited', 'posted'])
+        self.assertEqual(stats['remaining'], 1)
+
+        # サイクルのリセットで未投稿に戻ったメッセージは1件のイベントにまとめて送る
+        db_manager.get_message(self.account_id)
+        self.read_events(stream)
+        db_manager.reset_messages(self.account_id)
+        events, stats = self.read_events(stream)
+        self.assertEqual(events, [('restored', {'ids': sorted(row['id'] for row in db_manager.get_messages(self.account_id))})])
+        self.assertEqual((stats['remaining'], stats['cycle']), (2, 1))
+
+        # 投稿を諦めたメッセージはリセットしても未投稿に戻らない
+        db_manager.fail_message(first_id, 'rejected')
+        db_manager.get_message(self.account_id)
+        self.read_events(stream)
+        db_manager.reset_messages(self.account_id)
+        events, stats = self.read_events(stream)
+        self.assertEqual(events, [('restored', {'ids': [row['id'] for row in db_manager.get_messages(self.account_id)
+                                                        if row['id'] != first_id]})])
+        self.assertEqual((stats['remaining'], stats['cycle']), (1, 2))
+
+        # 差分取得のAPIにはリセットの記録は含まれない
+        changed, deleted_ids, _, _, _ = db_manager.get_message_changes(self.account_id, 0, 100)
+        self.assertEqual(deleted_ids, [])
+        self.assertEqual(len(changed), 2)
+
+        db_manager.delete_message(first_id, self.account_id)
+        events, _ = self.read_events(stream)
+        self.assertEqual(events, [('deleted', {'id': first_id})])
+        stream.close()
+
+    def test_detects_writes_from_other_processes(self):
+        stream = stream_events(self.account_id, 0, feed=self.feed, heartbeat=5)
+        next(stream)
+        # 通知を経由しない書き込み（他のプロセスからの書き込みに相当）
+        self.feed.wait(self.feed.version, 0.2)  # 変更番号の確認が一度行われるのを待つ
+        conn = db_manager.get_db_connection()
+        with conn:
+            content_id = db_manager.get_content_id(conn, 'other')
+            conn.execute("INSERT INTO tweets (content_id, account_id, shuffle_key) VALUES (?, ?, 0)",
+                         (content_id, self.account_id))
+        events, _ = self.read_events(stream)
+        self.assertEqual(events[0][0], 'inserted')
+        stream.close()
+        self.assertEqual(self.feed._subscribers, 0)
+
+    def test_limits_concurrent_streams(self):
+        streams = [stream_events(self.account_id, 0, feed=self.feed, heartbeat=5) for _ in range(2)]
+        for stream in streams:
+            next(stream)
+        self.assertFalse(self.feed.has_capacity(max_streams=2))
+        streams[0].close()
+        self.assertTrue(self.feed.has_capacity(max_streams=2))
+        streams[1].close()
+
+    def test_resumes_from_last_event_id_or_reloads(self):
+        db_manager.insert_message('first', self.account_id)
+        db_manager.insert_message('second', self.account_id)
+        stream = stream_events(self.account_id, 0, feed=self.feed, heartbeat=5)
+        next(stream)
+        _, _, first_seq = parse_event(next(stream))
+        stream.close()
+
+        stream = stream_events(self.account_id, first_seq, feed=self.feed, heartbeat=5)
+        next(stream)
+        events, _ = self.read_events(stream)
+        self.assertEqual([data['message'] for _, data in events], ['second'])
+        stream.close()
+
+        db_manager.prune_tweet_changes(keep=1)
+        stream = stream_events(self.account_id, -5, feed=self.feed, heartbeat=5)
+        next(stream)
+        self.assertEqual(parse_event(next(stream))[0], 'reload')
+        stream.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,46 +1,75 @@
+import io
+import gzip
+import os
 import unittest
-from unittest.mock import patch, mock_open, MagicMock
-from csv_manager import upload_csv, insert_messages_from_csv
+from unittest.mock import patch, MagicMock, ANY
+import db_manager
+from csv_manager import upload_csv, insert_messages_from_csv, start_import_job, get_import_jobs
+from test_helpers import TempDatabaseTestCase
 
-class TestCSVManager(unittest.TestCase):
+class TestCSVImport(TempDatabaseTestCase):
+
+    def test_insert_messages_from_csv(self):
+        db_manager.insert_message('message2', 1)
+        db_manager.insert_message('message2', 2)
+
+        filename = os.path.join(self.tmpdir.name, 'messages.csv')
+        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+            csvfile.write('message1\nmessage2\n\nmessage1\nmessage3\n')
+
+        with patch('csv_manager.CSV_CHUNK_SIZE', 2):
+            failed_messages = insert_messages_from_csv(filename, 1)
+
+        self.assertEqual(failed_messages, ['message2', 'message1'])
+        self.assertEqual(sorted(row['message'] for row in db_manager.get_messages(1)), ['message1', 'message2', 'message3'])
+        self.assertEqual([row['message'] for row in db_manager.get_messages(2)], ['message2'])
+
+    def test_insert_messages_from_gzip_jsonl_keeps_weight_and_tags(self):
+        filename = os.path.join(self.tmpdir.name, 'messages.jsonl.gz')
+        with gzip.open(filename, 'wt', encoding='utf-8') as f:
+            f.write('{"message": "重い", "weight": 3, "tags": "#a #b"}\n{"text": "軽い"}\n')
 
-    @patch('csv_manager.get_db_connection')
-    @patch('builtins.open', new_callable=mock_open, read_data='message1\nmessage2\n')
-    @patch('csv_manager.csv.reader')
-    def test_insert_messages_from_csv(self, mock_csv_reader, mock_open, mock_get_db_connection):
-        mock_csv_reader.return_value = [['message1'], ['message2']]
-        mock_conn = MagicMock()
-        mock_cursor = MagicMock()
-        mock_get_db_connection.return_value = mock_conn
-        mock_conn.cursor.return_value = mock_cursor
-        mock_cursor.fetchone.side_effect = [(0,), (1,)]
-
-        failed_messages = insert_messages_from_csv('dummy.csv', 1)
-
-        self.assertEqual(failed_messages, ['message2'])
-        mock_cursor.execute.assert_any_call("SELECT COUNT(*) FROM tweets WHERE message = ? AND account_id = ?", ('message1', 1))
-        mock_cursor.execute.assert_any_call("SELECT COUNT(*) FROM tweets WHERE message = ? AND account_id = ?", ('message2', 1))
-        mock_cursor.execute.assert_any_call("INSERT INTO tweets (message, account_id) VALUES (?, ?)", ('message1', 1))
-        mock_conn.commit.assert_called_once()
-        mock_conn.close.assert_called_once()
+        self.assertEqual(insert_messages_from_csv(filename, 1), [])
+        rows = db_manager.get_db_connection().execute("SELECT weight, tags FROM tweets ORDER BY id").fetchall()
+        self.assertEqual([tuple(row) for row in rows], [(3.0, 'a,b'), (1.0, None)])
+
+    def test_import_job_streams_upload_and_reports_progress(self):
+        db_manager.insert_message('message2', 1)
+        stream = io.BytesIO('message1\r\nmessage2\r\n"複数行の\r\nメッセージ"\r\n'.encode('utf-8'))
+
+        with patch('csv_manager.threading.Thread') as mock_thread:
+            job_id = start_import_job(stream, 1, 'test.csv')
+        target, args = mock_thread.call_args.kwargs['target'], mock_thread.call_args.kwargs['args']
+        self.assertEqual(get_import_jobs(1)[0]['status'], 'running')
+        target(*args)
+
+        job = get_import_jobs(1)[0]
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual((job['rows'], job['inserted'], job['duplicates']), (3, 2, 1))
+        self.assertEqual(job['duplicate_preview'], ['message2'])
+        self.assertIn('複数行の\r\nメッセージ', [row['message'] for row in db_manager.get_messages(1)])
+        self.assertTrue(stream.closed)
+        self.assertEqual(get_import_jobs(2), [])
+
+
+class TestCSVManager(unittest.TestCase):
 
     @patch('csv_manager.flash')
     @patch('csv_manager.redirect')
     @patch('csv_manager.url_for')
-    @patch('csv_manager.secure_filename')
-    @patch('csv_manager.insert_messages_from_csv')
-    @patch('csv_manager.logging')
-    def test_upload_csv(self, mock_logging, mock_insert_messages_from_csv, mock_secure_filename, mock_url_for, mock_redirect, mock_flash):
+    @patch('csv_manager.start_import_job')
+    @patch('csv_manager.logger')
+    def test_upload_csv(self, mock_logger, mock_start_import_job, mock_url_for, mock_redirect, mock_flash):
         mock_file = MagicMock()
         mock_file.filename = 'test.csv'
-        mock_secure_filename.return_value = 'test.csv'
-        mock_insert_messages_from_csv.return_value = []
+        stream = mock_file.stream
 
         response = upload_csv(mock_file, 1)
 
-        mock_file.save.assert_called_once_with('test.csv')
-        mock_insert_messages_from_csv.assert_called_once_with('test.csv', 1)
-        mock_flash.assert_called_once_with('CSVファイルのメッセージが追加されました')
+        mock_file.save.assert_not_called()
+        mock_start_import_job.assert_called_once_with(stream, 1, 'test.csv')
+        mock_flash.assert_called_once_with('CSVファイルの取り込みを開始しました')
         mock_redirect.assert_called_once_with(mock_url_for('index'))
 
         # Test case for empty filename
@@ -52,14 +81,15 @@ class TestCSVManager(unittest.TestCase):
         # Test case for invalid file type
         mock_file.filename = 'test.txt'
         response = upload_csv(mock_file, 1)
-        mock_flash.assert_called_with('無効なファイル形式です。CSVファイルをアップロードしてください')
+        mock_flash.assert_called_with('無効なファイル形式です。CSV・TSV・JSONLファイル（gzip圧縮も可）をアップロードしてください')
         mock_redirect.assert_called_with(mock_url_for('index'))
 
         # Test case for exception handling
         mock_file.filename = 'test.csv'
-        mock_file.save.side_effect = Exception('Test Exception')
+        mock_start_import_job.side_effect = Exception('Test Exception')
         response = upload_csv(mock_file, 1)
-        mock_logging.error.assert_called_with('CSVファイルのアップロード中にエラーが発生しました: Test Exception')
+        mock_logger.error.assert_called_with('CSVファイルのアップロード中にエラーが発生しました: %s', ANY)
+        self.assertEqual(str(mock_logger.error.call_args.args[1]), 'Test Exception')
         mock_flash.assert_called_with('CSVファイルのアップロード中にエラーが発生しました')
         mock_redirect.assert_called_with(mock_url_for('index'))
 
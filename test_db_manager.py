@@ -0,0 +1,263 @@
+import sqlite3
+import threading
+import unittest
+from unittest.mock import patch
+import db_manager
+from account_manager import reset_account_messages, load_account, clients, client_credentials
+from cache_manager import settings_cache
+from csv_manager import insert_messages
+from test_helpers import TempDatabaseTestCase
+
+class TestDBManager(TempDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account()
+
+    def test_claimed_message_is_leased_until_acked(self):
+        db_manager.insert_message('hello', self.account_id)
+        claimed = db_manager.claim_message(self.account_id, 60, now=1000)
+        self.assertEqual(claimed['message'], 'hello')
+        self.assertIsNone(db_manager.claim_message(self.account_id, 60, now=1030))  # リース中
+
+        # リースが切れれば再び確保できる（投稿後に落ちた場合など）
+        claimed = db_manager.claim_message(self.account_id, 60, now=1061)
+        self.assertEqual(claimed['attempts'], 2)
+        db_manager.release_message(claimed['id'], retry_at=2000)
+        self.assertIsNone(db_manager.claim_message(self.account_id, 60, now=1100))
+        self.assertEqual(db_manager.claim_message(self.account_id, 60, now=2000)['id'], claimed['id'])
+
+        self.assertTrue(db_manager.ack_message(claimed['id']))
+        self.assertFalse(db_manager.ack_message(claimed['id']))
+        self.assertEqual(db_manager.get_account_stats(self.account_id)['remaining'], 0)
+        self.assertIsNone(db_manager.claim_message(self.account_id, 60, now=5000))
+
+    def test_connection_is_reused_within_thread(self):
+        conn = db_manager.get_db_connection()
+        self.assertIs(db_manager.get_db_connection(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(conn.execute("PRAGMA busy_timeout").fetchone()[0], db_manager.BUSY_TIMEOUT_MS)
+
+    def test_each_thread_gets_its_own_connection(self):
+        main_conn = db_manager.get_db_connection()
+        other = []
+
+        def worker():
+            other.append(db_manager.get_db_connection())
+            db_manager.insert_message('from worker', self.account_id)
+            db_manager.close_db_connection()
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(other[0], main_conn)
+        self.assertEqual([row['message'] for row in db_manager.get_messages(self.account_id)], ['from worker'])
+
+    def test_get_message_marks_message_as_posted(self):
+        db_manager.insert_message('hello', self.account_id)
+        self.assertEqual(db_manager.get_message(self.account_id), 'hello')
+        self.assertIsNone(db_manager.get_message(self.account_id))
+
+        db_manager.reset_messages(self.account_id)
+        self.assertEqual(db_manager.get_message(self.account_id), 'hello')
+
+    def test_each_message_is_posted_once_per_cycle(self):
+        messages = {f"message{i}" for i in range(50)}
+        for message in messages:
+            db_manager.insert_message(message, self.account_id)
+
+        for _ in range(2):
+            posted = [db_manager.get_message(self.account_id) for _ in range(len(messages))]
+            self.assertEqual(set(posted), messages)
+            self.assertIsNone(db_manager.get_message(self.account_id))
+            db_manager.reset_messages(self.account_id)
+
+    def test_priority_messages_are_posted_first(self):
+        for i in range(5):
+            db_manager.insert_message(f"message{i}", self.account_id)
+        db_manager.insert_message('campaign', self.account_id, priority=1)
+        db_manager.insert_message('urgent', self.account_id, priority=2)
+
+        self.assertEqual(db_manager.get_message(self.account_id), 'urgent')
+        self.assertEqual(db_manager.claim_message(self.account_id, 60)['message'], 'campaign')
+
+    def test_messages_are_posted_weight_times_per_cycle(self):
+        db_manager.insert_message('heavy', self.account_id, weight=3)
+        db_manager.insert_message('medium', self.account_id, weight=1.6)  # 四捨五入して2回
+        db_manager.insert_message('light', self.account_id, weight=0.2)   # 少なくとも1回
+        for cycle in range(2):
+            posted = list(iter(lambda: db_manager.get_message(self.account_id), None))
+            self.assertEqual(sorted(posted), ['heavy'] * 3 + ['light'] + ['medium'] * 2)
+            self.assertEqual(db_manager.get_account_stats(self.account_id)['remaining'], 0)
+            db_manager.reset_messages(self.account_id)
+
+    def test_acked_message_moves_back_until_its_last_draw(self):
+        db_manager.insert_message('heavy', self.account_id, weight=2)
+        tweet_id = db_manager.get_messages(self.account_id)[0]['id']
+        conn = db_manager.get_db_connection()
+        state = lambda: tuple(conn.execute("SELECT shuffle_key, draws_left, is_deleted FROM tweets WHERE id = ?", (tweet_id,)).fetchone())
+
+        first_key, _, _ = state()
+        self.assertLess(first_key, 0.5)
+        # 1回目の投稿では未投稿のまま、次の投稿位置をサイクルの後半にずらす
+        self.assertTrue(db_manager.ack_message(tweet_id))
+        self.assertEqual(state(), (first_key + 0.5, 1, 0))
+        self.assertEqual(db_manager.get_account_stats(self.account_id)['remaining'], 1)
+        self.assertTrue(db_manager.ack_message(tweet_id))
+        self.assertEqual(state()[1:], (0, 1))
+        self.assertEqual(db_manager.get_account_stats(self.account_id)['remaining'], 0)
+
+    def test_get_messages_pages_by_id(self):
+        for i in range(5):
+            db_manager.insert_message(f"message{i}", self.account_id)
+
+        first = db_manager.get_messages(self.account_id, limit=2)
+        second = db_manager.get_messages(self.account_id, after_id=first[-1]['id'], limit=2)
+        self.assertEqual([row['message'] for row in first], ['message0', 'message1'])
+        self.assertEqual([row['message'] for row in second], ['message2', 'message3'])
+
+    def test_get_message_changes_returns_latest_state(self):
+        db_manager.insert_message('keep', self.account_id)
+        db_manager.insert_message('remove', self.account_id)
+        since = db_manager.get_latest_change_seq(self.account_id)
+        keep_id, remove_id = [row['id'] for row in db_manager.get_messages(self.account_id)]
+
+        db_manager.update_message('edited', keep_id, self.account_id)
+        db_manager.get_message(self.account_id)
+        db_manager.delete_message(remove_id, self.account_id)
+        db_manager.insert_message('other account', self.account_id + 1)
+
+        changed, deleted_ids, cursor, has_more, reset = db_manager.get_message_changes(self.account_id, since, 100)
+        self.assertEqual(deleted_ids, [remove_id])
+        self.assertEqual([(row['id'], row['message']) for row in changed], [(keep_id, 'edited')])
+        self.assertEqual(cursor, db_manager.get_latest_change_seq(self.account_id))
+        self.assertFalse(has_more)
+        self.assertFalse(reset)
+
+        # 履歴が削除された位置より前からの差分は取得できない
+        db_manager.prune_tweet_changes(keep=1)
+        self.assertTrue(db_manager.get_message_changes(self.account_id, since, 100)[4])
+
+    def test_message_bodies_are_shared_across_accounts(self):
+        conn = db_manager.get_db_connection()
+        count_contents = lambda: conn.execute("SELECT COUNT(*) FROM message_contents").fetchone()[0]
+        insert_messages([['shared'], ['only first']], self.account_id)
+        other_ids = [self.account_id + 1, self.account_id + 2]
+        self.assertEqual(db_manager.copy_messages(self.account_id, other_ids + [self.account_id]),
+                         {other_ids[0]: 2, other_ids[1]: 2})
+        self.assertEqual(db_manager.copy_messages(self.account_id, other_ids), {other_ids[0]: 0, other_ids[1]: 0})
+        self.assertEqual(count_contents(), 2)
+        self.assertEqual(db_manager.get_account_stats(other_ids[0])['remaining'], 2)
+        self.assertIn(db_manager.claim_message(other_ids[0], 60)['message'], ('shared', 'only first'))
+
+        # 編集は他のアカウントの本文に影響しない
+        shared_id = db_manager.get_messages(other_ids[0])[0]['id']
+        db_manager.update_message('edited', shared_id, other_ids[0])
+        self.assertEqual([row['message'] for row in db_manager.get_messages(self.account_id)], ['shared', 'only first'])
+        self.assertEqual([row['message'] for row in db_manager.get_messages(other_ids[0])], ['edited', 'only first'])
+        self.assertEqual(count_contents(), 3)
+
+        # どのアカウントにも使われなくなった本文は削除される
+        db_manager.delete_message(shared_id, other_ids[0])
+        self.assertEqual(count_contents(), 2)
+        db_manager.delete_all_messages(self.account_id)
+        db_manager.delete_all_messages(other_ids[0])
+        self.assertEqual(count_contents(), 2)  # 3つ目のアカウントがまだ使っている
+        db_manager.delete_all_messages(other_ids[1])
+        self.assertEqual(count_contents(), 0)
+
+    def test_pruned_content_ids_are_not_reused(self):
+        conn = db_manager.get_db_connection()
+        db_manager.insert_message('m1', self.account_id)
+        db_manager.insert_message('m2', self.account_id)
+        m1, m2 = db_manager.get_messages(self.account_id)
+        content_id = lambda tweet_id: conn.execute("SELECT content_id FROM tweets WHERE id = ?", (tweet_id,)).fetchone()[0]
+        pruned = content_id(m2['id'])
+        db_manager.delete_message(m2['id'], self.account_id)
+        db_manager.insert_message('m3', self.account_id)
+        self.assertGreater(content_id(db_manager.get_messages(self.account_id)[-1]['id']), pruned)
+
+    def assert_stats_match_table(self):
+        conn = db_manager.get_db_connection()
+        total, remaining = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(is_deleted = 0), 0) FROM tweets WHERE account_id = ?", (self.account_id,)
+        ).fetchone()
+        stats = db_manager.get_account_stats(self.account_id)
+        self.assertEqual((stats['total'], stats['remaining'], stats['posted']), (total, remaining, total - remaining))
+        return stats
+
+    def test_account_stats_follow_every_write(self):
+        for i in range(4):
+            db_manager.insert_message(f"message{i}", self.account_id)
+        db_manager.insert_message('message0', self.account_id)
+        insert_messages([['message1'], ['message4']], self.account_id)
+        self.assert_stats_match_table()
+
+        db_manager.get_message(self.account_id)
+        db_manager.get_message(self.account_id)
+        self.assertEqual(self.assert_stats_match_table()['posted'], 2)
+
+        ids = [row['id'] for row in db_manager.get_messages(self.account_id)]
+        db_manager.delete_message(ids[0], self.account_id)
+        db_manager.delete_message(ids[0], self.account_id)
+        self.assert_stats_match_table()
+
+        while db_manager.get_message(self.account_id):
+            pass
+        self.assertTrue(reset_account_messages(self.account_id))
+        stats = self.assert_stats_match_table()
+        self.assertEqual((stats['remaining'], stats['cycle']), (stats['total'], 1))
+        self.assertFalse(reset_account_messages(self.account_id))
+
+        db_manager.delete_all_messages(self.account_id)
+        self.assertEqual(self.assert_stats_match_table()['total'], 0)
+
+    def test_empty_account_is_not_reset(self):
+        since = db_manager.get_latest_change_seq(self.account_id)
+        for _ in range(3):
+            self.assertFalse(reset_account_messages(self.account_id))
+        self.assertEqual(db_manager.get_account_stats(self.account_id)['cycle'], 0)
+        self.assertEqual(db_manager.get_latest_change_seq(self.account_id), since)
+
+    def test_settings_are_cached_until_written(self):
+        db_manager.set_interval('interval', 3, [], self.account_id)
+        misses = settings_cache.misses
+        self.assertEqual(db_manager.get_settings(self.account_id)[0]['interval'], 3)
+        self.assertEqual(db_manager.get_settings(self.account_id)[0]['interval'], 3)
+        self.assertEqual(settings_cache.misses, misses + 1)
+
+        db_manager.set_interval('specific', None, ['09:00', '21:00'], self.account_id)
+        self.assertEqual([row['specific_time'] for row in db_manager.get_settings(self.account_id)], ['09:00', '21:00'])
+
+    def test_writes_from_other_process_invalidate_cache(self):
+        db_manager.set_interval('interval', 3, [], self.account_id)
+        db_manager.sync_caches()
+        self.assertEqual(db_manager.get_settings(self.account_id)[0]['interval'], 3)
+
+        # 別のプロセスの書き込みを別の接続で再現する
+        other = sqlite3.connect(db_manager.DB_PATH)
+        with other:
+            db_manager.bump_cache_version(other, settings_cache)
+            other.execute("UPDATE settings SET interval = 5 WHERE account_id = ?", (self.account_id,))
+        other.close()
+
+        self.assertEqual(db_manager.get_settings(self.account_id)[0]['interval'], 3)
+        db_manager.sync_caches()
+        self.assertEqual(db_manager.get_settings(self.account_id)[0]['interval'], 5)
+
+    @patch('account_manager.tweepy.Client')
+    def test_client_is_rebuilt_only_when_credentials_change(self, mock_client):
+        load_account(self.account_id)
+        load_account(self.account_id)
+        self.assertEqual(mock_client.call_count, 1)
+
+        db_manager.update_account('test', 'key', 'secret', 'bearer', 'new token', 'token_secret', self.account_id)
+        load_account(self.account_id)
+        self.assertEqual(mock_client.call_count, 2)
+        self.assertEqual(mock_client.call_args.kwargs['access_token'], 'new token')
+        clients.pop(self.account_id, None)
+        client_credentials.pop(self.account_id, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import db_manager
+from cache_manager import invalidate_all_caches
+from migrations import run_migrations
+
+
+class TempDatabaseTestCase(unittest.TestCase):
+    """一時ディレクトリのデータベースを使うテストの共通部分"""
+
+    # False にすると空のデータベースのまま始める（マイグレーション自体のテスト用）
+    migrate = True
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'tweets.db')
+        self.db_path_patch = patch('db_manager.DB_PATH', self.db_path)
+        self.db_path_patch.start()
+        if self.migrate:
+            run_migrations(db_manager.get_db_connection())
+
+    def tearDown(self):
+        db_manager.close_db_connection()
+        invalidate_all_caches()
+        self.db_path_patch.stop()
+        self.tmpdir.cleanup()
+
+    def add_account(self, name='test', access_token='token'):
+        # 追加したアカウントのIDを返す
+        db_manager.insert_account(name, 'key', 'secret', 'bearer', access_token, 'token_secret')
+        return max(db_manager.get_all_account_ids())
@@ -0,0 +1,95 @@
+import os
+import unittest
+from datetime import datetime, timezone
+from unittest.mock import patch
+import db_manager
+import history_manager
+from history_manager import (
+    HistoryWriter, write_history, get_post_history, get_post_summary, archive_partitions, read_archive, shift_month
+)
+from test_helpers import TempDatabaseTestCase
+
+def timestamp(year, month, day=1):
+    return datetime(year, month, day, tzinfo=timezone.utc).timestamp()
+
+
+class TestHistoryManager(TempDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.archive_patch = patch.object(history_manager, 'HISTORY_ARCHIVE_DIR',
+                                          os.path.join(self.tmpdir.name, 'history_archive'))
+        self.archive_patch.start()
+        db_manager.insert_message('hello', 1)
+        self.content_id = db_manager.get_db_connection().execute("SELECT content_id FROM tweets").fetchone()[0]
+
+    def tearDown(self):
+        self.archive_patch.stop()
+        super().tearDown()
+
+    def tables(self):
+        return [row[0] for row in db_manager.get_db_connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'post_history_2%' ORDER BY name")]
+
+    def test_writer_batches_records_into_monthly_tables(self):
+        writer = HistoryWriter(batch_size=2, flush_seconds=60, maxsize=3)
+        writer.record(1, 10, self.content_id, 'hello', '100', 120.0, 'posted', posted_at=timestamp(2026, 9, 30))
+        writer.record(1, 10, self.content_id, 'hello', None, 80.0, 'failed', posted_at=timestamp(2026, 10, 1))
+        writer.record(2, 11, self.content_id, 'hello', '101', 50.0, 'posted', posted_at=timestamp(2026, 10, 2))
+        writer.flush()
+        writer.stop()
+
+        self.assertEqual(self.tables(), ['post_history_202609', 'post_history_202610'])
+        history = get_post_history(1)
+        self.assertEqual([(row['outcome'], row['tweet_id'], row['message']) for row in history],
+                         [('failed', None, 'hello'), ('posted', '100', 'hello')])
+        self.assertEqual(len(get_post_history(1, limit=1)), 1)
+        self.assertEqual([row['outcome'] for row in get_post_history(1, before=timestamp(2026, 10, 1))], ['posted'])
+
+        # いっぱいのキューには入れずに捨てる（投稿を待たせない）
+        full = HistoryWriter(maxsize=1)
+        with patch.object(full, '_start'):
+            dropped = history_manager.history_records_total.get(result='dropped')
+            full.record(1, 10, self.content_id, 'hello', None, 1.0, 'posted')
+            full.record(1, 10, self.content_id, 'hello', None, 1.0, 'posted')
+        self.assertEqual(history_manager.history_records_total.get(result='dropped'), dropped + 1)
+
+    def test_old_months_are_archived_and_compacted(self):
+        write_history([
+            (1, 10, self.content_id, 'hello', '100', timestamp(2026, 6, 5), 100.0, 'posted'),
+            (1, 10, self.content_id, 'hello', '101', timestamp(2026, 6, 6), 300.0, 'posted'),
+            (2, 11, self.content_id, 'hello', None, timestamp(2026, 7, 5), 50.0, 'failed'),
+            (1, 10, self.content_id, 'hello', '102', timestamp(2026, 9, 1), 10.0, 'posted'),
+        ])
+
+        self.assertEqual(archive_partitions(now=timestamp(2026, 10, 18), retention_months=3), ['202606', '202607'])
+        self.assertEqual(self.tables(), ['post_history_202609'])
+        self.assertEqual([row['tweet_id'] for row in read_archive('202606')], ['100', '101'])
+        self.assertEqual(read_archive('202606')[0]['message'], 'hello')  # 本文が消えても読めるよう一緒に保存する
+        self.assertEqual(archive_partitions(now=timestamp(2026, 10, 18), retention_months=3), [])
+
+        self.assertEqual([row['tweet_id'] for row in get_post_history(1)], ['102'])
+        self.assertEqual([row['tweet_id'] for row in get_post_history(1, include_archived=True)], ['102', '101', '100'])
+        summary = {(row['month'], row['outcome']): (row['posts'], row['avg_latency_ms']) for row in get_post_summary(1)}
+        self.assertEqual(summary, {('202609', 'posted'): (1, 10.0), ('202606', 'posted'): (2, 200.0)})
+
+        # 保管した後に書き込まれた月はもう一度保管され、ファイルの後ろに足される
+        write_history([(1, 10, self.content_id, 'hello', '103', timestamp(2026, 6, 30), 100.0, 'posted')])
+        self.assertEqual(archive_partitions(now=timestamp(2026, 10, 18), retention_months=3), ['202606'])
+        self.assertEqual([row['tweet_id'] for row in read_archive('202606')], ['100', '101', '103'])
+        self.assertEqual(get_post_summary(1)[-1]['posts'], 3)
+
+    def test_history_keeps_posted_text_after_body_changes(self):
+        write_history([(1, 10, self.content_id, 'hello', '100', timestamp(2026, 10, 1), 10.0, 'posted')])
+        tweet_id = db_manager.get_messages(1)[0]['id']
+        db_manager.update_message('edited', tweet_id, 1)
+        db_manager.delete_message(tweet_id, 1)
+        db_manager.insert_message('unrelated', 1)
+        self.assertEqual([row['message'] for row in get_post_history(1)], ['hello'])
+
+    def test_shift_month_crosses_years(self):
+        self.assertEqual(shift_month('202601', -1), '202512')
+        self.assertEqual(shift_month('202611', 2), '202701')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import io
+import gzip
+import json
+import unittest
+from unittest.mock import patch
+from import_manager import (
+    ImportRecord, iter_stream_records, iter_records, iter_table_chunks, iter_line_chunks, format_from_filename,
+    normalize_text
+)
+from db_manager import message_hash
+
+def read_all(data, filename='', **kwargs):
+    return [record for chunk in iter_stream_records(io.BytesIO(data), filename, **kwargs) for record in chunk]
+
+
+class TestImportManager(unittest.TestCase):
+
+    def test_skips_header_and_normalizes_indented_quoted_csv(self):
+        # csv/20250111_meigen_gyaru.csv と同じ書き方
+        data = '\ufeff 名言\n "想像力は知識より大切っしょ〜☆"\n\n "ＡＢＣ　ｶﾀｶﾅ "\n'.encode('utf-8')
+        records = read_all(data, 'meigen.csv')
+        self.assertEqual([record.message for record in records], ['想像力は知識より大切っしょ〜☆', 'ABC カタカナ'])
+        self.assertEqual(records[0].hash, message_hash('想像力は知識より大切っしょ〜☆'))
+
+    def test_maps_extra_columns_by_header_or_position(self):
+        data = 'tags\tweight\ttext\timage\n#豆知識 #雑学 #豆知識\t2.5\tタコの心臓は3つ\timg/a.jpg\n\tabc\t猫\t\n'.encode('utf-8')
+        self.assertEqual(read_all(data, 'messages.tsv'), [
+            ImportRecord('タコの心臓は3つ', message_hash('タコの心臓は3つ'), 'img/a.jpg', 2.5, '豆知識,雑学', 0),
+            ImportRecord('猫', message_hash('猫'), None, 1.0, None, 0),
+        ])
+        # 見出し行がなければ メッセージ, 画像, 重み, タグ, 優先度 の順
+        records = read_all('hello,img/b.png,3,"a, b",5\n'.encode('utf-8'), 'messages.csv')
+        self.assertEqual(records[0][2:], ('img/b.png', 3.0, 'a,b', 5))
+
+    def test_reads_gzip_jsonl_and_skips_broken_lines(self):
+        lines = [json.dumps({'message': 'first', 'weight': 2, 'tags': ['x', 'y']}, ensure_ascii=False),
+                 '{broken', json.dumps('second'), json.dumps({'other': 1}), '']
+        data = gzip.compress('\n'.join(lines).encode('utf-8'))
+        self.assertEqual(format_from_filename('messages.jsonl.gz'), ('jsonl', True))
+        for filename in ('messages.jsonl.gz', ''):  # 名前がなくても中身から判定する
+            records = read_all(data, filename)
+            self.assertEqual([(record.message, record.weight, record.tags) for record in records],
+                             [('first', 2.0, 'x,y'), ('second', 1.0, None)])
+
+    def test_process_pool_keeps_file_order(self):
+        rows = [[f"メッセージ{i}"] for i in range(10)]
+        records = [record for chunk in iter_records(iter_table_chunks(rows, chunk_rows=3), workers=2, min_rows=0)
+                   for record in chunk]
+        self.assertEqual([record.message for record in records], [normalize_text(row[0]) for row in rows])
+
+    def test_csv_lines_are_split_in_workers_without_breaking_quoted_newlines(self):
+        text = 'message,weight\n"一行目\n二行目",2\n\n"引用符""入り",3\n"三行\nに\nわたる",1\nふつう,1\n'
+        chunks = list(iter_line_chunks(io.StringIO(text), 'csv', chunk_rows=2))
+        # 項目の途中では区切らず、行の分割はプロセスプールの側で行う
+        self.assertEqual([lines for _, _, lines in chunks],
+                         [['"一行目\n', '二行目",2\n'], ['\n', '"引用符""入り",3\n'], ['"三行\n', 'に\n', 'わたる",1\n'],
+                          ['ふつう,1\n']])
+        expected = [('一行目\n二行目', 2.0), ('引用符"入り', 3.0), ('三行\nに\nわたる', 1.0), ('ふつう', 1.0)]
+        for workers in (1, 2):
+            records = [record for chunk in iter_records(iter(chunks), workers=workers, min_rows=0) for record in chunk]
+            self.assertEqual([(record.message, record.weight) for record in records], expected)
+
+    def test_small_files_are_converted_without_process_pool(self):
+        with patch('import_manager._get_pool') as get_pool:
+            records = read_all('a\nb\nc\n'.encode('utf-8'), 'messages.csv', workers=2, chunk_rows=1)
+        self.assertEqual([record.message for record in records], ['a', 'b', 'c'])
+        get_pool.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import threading
+import unittest
+from leader import LeaderElector
+from test_helpers import TempDatabaseTestCase
+
+class TestLeaderElector(TempDatabaseTestCase):
+
+    def test_only_one_holder_until_lease_expires(self):
+        first = LeaderElector('test', lease_seconds=30)
+        second = LeaderElector('test', lease_seconds=30)
+        self.assertTrue(first.try_acquire(now=1000))
+        self.assertFalse(second.try_acquire(now=1010))
+        self.assertTrue(first.try_acquire(now=1020))   # 更新すると期限が延びる
+        self.assertFalse(second.try_acquire(now=1040))
+        self.assertTrue(second.try_acquire(now=1050))  # 更新が止まれば引き継がれる
+        self.assertFalse(first.try_acquire(now=1060))
+
+        second.release()
+        self.assertTrue(first.try_acquire(now=1061))
+
+    def test_only_leader_runs_tick_and_stop_hands_over(self):
+        ticks = {'first': 0, 'second': 0}
+        demoted = threading.Event()
+        first = LeaderElector('test', on_demoted=demoted.set, lease_seconds=3, tick_seconds=0.01)
+        second = LeaderElector('test', lease_seconds=3, tick_seconds=0.01)
+        first.start(on_tick=lambda: ticks.__setitem__('first', ticks['first'] + 1))
+        for _ in range(200):
+            if first.is_leader:
+                break
+            threading.Event().wait(0.01)
+        second.start(on_tick=lambda: ticks.__setitem__('second', ticks['second'] + 1))
+        threading.Event().wait(0.1)
+        self.assertTrue(first.is_leader)
+        self.assertFalse(second.is_leader)
+        self.assertEqual(ticks['second'], 0)
+
+        first.stop()
+        self.assertTrue(demoted.is_set())
+        for _ in range(200):
+            if second.is_leader:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(second.is_leader)
+        second.stop()
+        self.assertGreater(ticks['first'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
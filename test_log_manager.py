@@ -0,0 +1,82 @@
+import io
+import os
+import json
+import logging
+import tempfile
+import unittest
+import log_manager
+from log_manager import setup_logging, stop_logging, parse_levels
+
+class TestSetupLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.saved = (self.root.level, list(self.root.handlers))
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        stop_logging()
+        self.root.handlers = self.saved[1]
+        self.root.setLevel(self.saved[0])
+        for name in ('tweetbot.test.hot', 'tweetbot.test.other'):
+            logging.getLogger(name).setLevel(logging.NOTSET)
+
+    def records(self):
+        stop_logging()  # キューに残ったログを書き出す
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_writes_json_with_extra_fields(self):
+        setup_logging(level='INFO', levels={}, handlers=[logging.StreamHandler(self.stream)])
+        logger = logging.getLogger('tweetbot.test.other')
+        logger.info("投稿完了: アカウント %s: %s", 1, 'こんにちは', extra={'account_id': 1})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            logger.exception("失敗しました")
+
+        first, second = self.records()
+        self.assertEqual(first['message'], '投稿完了: アカウント 1: こんにちは')
+        self.assertEqual((first['level'], first['logger'], first['account_id']), ('INFO', 'tweetbot.test.other', 1))
+        self.assertIn('ValueError: boom', second['exception'])
+
+    def test_subsystem_levels_skip_formatting(self):
+        setup_logging(level='INFO', levels={'tweetbot.test.hot': 'WARNING'},
+                      handlers=[logging.StreamHandler(self.stream)])
+
+        formatted = []
+
+        class Expensive:
+            def __str__(self):
+                formatted.append(self)
+                return 'expensive'
+
+        logging.getLogger('tweetbot.test.hot').info("無効なログ %s", Expensive())
+        self.assertEqual(formatted, [])
+        logging.getLogger('tweetbot.test.other').info("有効なログ %s", Expensive())
+
+        self.assertEqual([record['message'] for record in self.records()], ['有効なログ expensive'])
+
+    def test_rotates_by_size(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'app.log')
+            handler = logging.handlers.RotatingFileHandler(filename, maxBytes=500, backupCount=2, encoding='utf-8')
+            setup_logging(level='INFO', levels={}, handlers=[handler])
+            for i in range(50):
+                logging.getLogger('tweetbot.test.other').info("メッセージ %s", i)
+            stop_logging()
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['app.log', 'app.log.1', 'app.log.2'])
+
+    def test_parse_levels(self):
+        self.assertEqual(parse_levels('post_manager=debug, scheduler=WARNING,,broken'),
+                         {'post_manager': 'DEBUG', 'scheduler': 'WARNING'})
+        self.assertEqual(parse_levels(''), {})
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = log_manager._QueueHandler(log_manager.queue.Queue(1))
+        record = logging.LogRecord('x', logging.INFO, '', 0, 'm', (), None)
+        handler.enqueue(record)
+        handler.enqueue(record)
+        self.assertEqual(handler.queue.qsize(), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+import media_manager
+from media_manager import MediaError, prepare_media, upload_media, get_media_ids
+from test_helpers import TempDatabaseTestCase
+
+class FakeMediaAPI:
+    """simple_upload の呼び出しを記録する tweepy.API の代わり"""
+
+    def __init__(self):
+        self.uploads = []
+
+    def simple_upload(self, filename, file, additional_owners=None):
+        self.uploads.append((filename, file.read(), additional_owners))
+        media_id = 1000 + len(self.uploads)
+        return SimpleNamespace(media_id=media_id, media_id_string=str(media_id), expires_after_secs=86400)
+
+
+class TestMediaManager(TempDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = os.path.join(self.tmpdir.name, 'img')
+        os.makedirs(self.media_root)
+        self.image = os.path.join(self.media_root, 'picture.jpg')
+        with open(self.image, 'wb') as f:
+            f.write(b'\xff\xd8jpeg data')
+        self.api = FakeMediaAPI()
+        self.patches = [
+            patch.object(media_manager, 'MEDIA_ROOTS', [self.media_root]),
+            patch.object(media_manager, 'MEDIA_CACHE_DIR', os.path.join(self.tmpdir.name, 'media_cache')),
+            patch.object(media_manager, 'get_media_api', lambda account_id: self.api),
+        ]
+        for p in self.patches:
+            p.start()
+        # アクセストークンの先頭がユーザーID
+        self.account_ids = [self.add_account('first', '111-token'), self.add_account('second', '222-token')]
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        super().tearDown()
+
+    def test_prepare_stores_content_addressed_variant_once(self):
+        variant = prepare_media(self.image)
+        self.assertTrue(variant.path.startswith(media_manager.MEDIA_CACHE_DIR))
+        self.assertIn(variant.hash, os.path.basename(variant.path))
+        with open(variant.path, 'rb') as f:
+            self.assertEqual(f.read(), b'\xff\xd8jpeg data')
+
+        with patch.object(media_manager, '_encode', side_effect=AssertionError('再変換しない')):
+            self.assertEqual(prepare_media(self.image), variant)
+
+        # 元の画像が変わったら変換し直す
+        with open(self.image, 'wb') as f:
+            f.write(b'\xff\xd8new jpeg data')
+        self.assertNotEqual(prepare_media(self.image).hash, variant.hash)
+
+    def test_rejects_files_outside_media_roots_and_oversized_images(self):
+        outside = os.path.join(self.tmpdir.name, 'secret.jpg')
+        with open(outside, 'wb') as f:
+            f.write(b'data')
+        with self.assertRaises(MediaError):
+            prepare_media(outside)
+        with self.assertRaises(MediaError):
+            prepare_media(os.path.join(self.media_root, 'missing.jpg'))
+        with patch.object(media_manager, 'MAX_IMAGE_BYTES', 4), patch.object(media_manager, 'Image', None):
+            with self.assertRaises(MediaError):
+                prepare_media(self.image)
+
+    def test_media_id_is_reused_across_accounts_until_expiry(self):
+        first, second = self.account_ids
+        media_id = upload_media(first, self.image)
+        self.assertEqual(self.api.uploads, [(os.path.basename(prepare_media(self.image).path), b'\xff\xd8jpeg data', '222')])
+
+        # 共有した別のアカウントや次のサイクルでは再アップロードしない
+        self.assertEqual(upload_media(second, self.image), media_id)
+        self.assertEqual(upload_media(first, self.image), media_id)
+        self.assertEqual(len(self.api.uploads), 1)
+
+        # 期限が近づいたらアップロードし直す
+        later = time.time() + 86400
+        with patch('media_manager.time.time', return_value=later), patch('db_manager.time.time', return_value=later):
+            self.assertNotEqual(upload_media(first, self.image), media_id)
+        self.assertEqual(len(self.api.uploads), 2)
+
+    def test_missing_media_posts_without_image(self):
+        self.assertIsNone(get_media_ids(self.account_ids[0], os.path.join(self.media_root, 'missing.jpg')))
+        self.assertIsNone(get_media_ids(self.account_ids[0], None))
+        self.assertEqual(len(self.api.uploads), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import db_manager
+from metrics import Registry, db_query_seconds, render_metrics
+from test_helpers import TempDatabaseTestCase
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge_text_format(self):
+        posts = self.registry.counter('posts_total', '投稿数', ['result'])
+        posts.inc(result='posted')
+        posts.inc(2, result='posted')
+        posts.inc(result='dup"licate')
+        self.registry.gauge('queue_depth', 'キューの長さ', ['account_id'], callback=lambda: {(2,): 5, (1,): 0})
+
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP posts_total 投稿数',
+            '# TYPE posts_total counter',
+            'posts_total{result="dup\\"licate"} 1',
+            'posts_total{result="posted"} 3',
+            '# HELP queue_depth キューの長さ',
+            '# TYPE queue_depth gauge',
+            'queue_depth{account_id="1"} 0',
+            'queue_depth{account_id="2"} 5',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.histogram('latency_seconds', '処理時間', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 3.0):
+            latency.observe(value)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn('latency_seconds_sum 4.25', lines)
+        self.assertIn('latency_seconds_count 4', lines)
+
+    def test_rejects_wrong_labels(self):
+        posts = self.registry.counter('posts_total', '投稿数', ['result'])
+        with self.assertRaises(ValueError):
+            posts.inc(status='posted')
+        with self.assertRaises(ValueError):
+            self.registry.counter('posts_total', '投稿数')
+
+    def test_failing_callback_does_not_break_output(self):
+        self.registry.gauge('broken', '失敗する値', callback=lambda: 1 / 0)
+        self.registry.counter('ok_total', '正常な値').inc()
+        self.assertIn('ok_total 1', self.registry.render().splitlines())
+
+
+class TestDbMetrics(TempDatabaseTestCase):
+
+    def test_query_latency_and_queue_depth(self):
+        account_id = self.add_account()
+        before = db_query_seconds.get(function='insert_message')['count']
+        for message in ('first', 'second'):
+            db_manager.insert_message(message, account_id)
+        db_manager.get_message(account_id)
+
+        self.assertEqual(db_query_seconds.get(function='insert_message')['count'], before + 2)
+        self.assertIn(f'tweetbot_queue_depth{{account_id="{account_id}"}} 1', render_metrics().splitlines())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import sqlite3
+import unittest
+import db_manager
+from account_manager import reset_account_messages
+from csv_manager import insert_messages
+from migrations import run_migrations, get_schema_version, LATEST_VERSION
+from test_helpers import TempDatabaseTestCase
+
+# 元の create_db.py が作成していたスキーマ
+LEGACY_SCHEMA = '''
+CREATE TABLE tweets (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL, is_deleted INTEGER DEFAULT 0, account_id INTEGER);
+CREATE TABLE settings (id INTEGER PRIMARY KEY AUTOINCREMENT, interval_type TEXT, interval INTEGER, specific_time TEXT, account_id INTEGER);
+CREATE TABLE accounts (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, consumer_api_key TEXT NOT NULL, consumer_api_secret TEXT NOT NULL, bearer_token TEXT NOT NULL, access_token TEXT NOT NULL, access_token_secret TEXT NOT NULL);
+CREATE TABLE auto_post_status (account_id INTEGER PRIMARY KEY, status BOOLEAN NOT NULL);
+'''
+
+class MigrationTestCase(TempDatabaseTestCase):
+
+    migrate = False
+
+
+class TestRunMigrations(MigrationTestCase):
+
+    def test_upgrades_legacy_database_in_place(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.executemany("INSERT INTO tweets (message, account_id, is_deleted) VALUES (?, ?, ?)",
+                         [('hello', 1, 1), ('hello', 1, 0), ('world', 1, 0), ('hello', 2, 0)])
+        conn.commit()
+        conn.close()
+
+        conn = db_manager.get_db_connection()
+        self.assertEqual(run_migrations(conn), list(range(1, LATEST_VERSION + 1)))
+        self.assertEqual(get_schema_version(conn), LATEST_VERSION)
+
+        rows = conn.execute("""
+        SELECT t.id, c.body, t.account_id, t.shuffle_key, t.content_id, c.hash, t.is_deleted, t.draws_left
+        FROM tweets t JOIN message_contents c ON c.id = t.content_id ORDER BY t.id
+        """).fetchall()
+        self.assertEqual([(row['id'], row['body'], row['account_id']) for row in rows],
+                         [(1, 'hello', 1), (3, 'world', 1), (4, 'hello', 2)])
+        self.assertTrue(all(row['shuffle_key'] is not None for row in rows))
+        self.assertEqual([row['draws_left'] for row in rows], [0 if row['is_deleted'] else 1 for row in rows])
+        self.assertEqual(rows[0]['hash'], db_manager.message_hash('hello'))
+        # 同じ本文はアカウントをまたいで1つだけ保存される
+        self.assertEqual(rows[0]['content_id'], rows[2]['content_id'])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM message_contents").fetchone()[0], 2)
+        # 変更履歴のトリガーも作り直されている
+        self.assertEqual([row['id'] for row in db_manager.get_messages(1)], [1, 3])
+        self.assertTrue(db_manager.insert_message('new', 3))
+        self.assertEqual(db_manager.get_message_changes(3, 0, 10)[0][-1]['message'], 'new')
+
+        stats = db_manager.get_account_stats(1)
+        self.assertEqual((stats['total'], stats['remaining'], stats['posted']), (2, 1, 1))
+
+        # 一意インデックスにより同じアカウントへの重複追加は拒否される
+        self.assertFalse(db_manager.insert_message('world', 1))
+        self.assertTrue(db_manager.insert_message('world', 2))
+
+    def test_deleted_ids_are_not_reused_after_rebuild(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(LEGACY_SCHEMA)
+        conn.executemany("INSERT INTO tweets (message, account_id) VALUES (?, 1)", [(f"message{i}",) for i in range(5)])
+        conn.execute("DELETE FROM tweets WHERE id = 5")
+        conn.commit()
+        conn.close()
+
+        run_migrations(db_manager.get_db_connection())
+        db_manager.insert_message('new', 1)
+        self.assertEqual(max(row['id'] for row in db_manager.get_messages(1)), 6)
+
+    def test_is_idempotent(self):
+        conn = db_manager.get_db_connection()
+        self.assertEqual(run_migrations(conn), list(range(1, LATEST_VERSION + 1)))
+        self.assertEqual(run_migrations(conn), [])
+
+
+class TestQueryPlans(MigrationTestCase):
+    """db_manager のよく使われるクエリがインデックスを使うことを確認する"""
+
+    migrate = True
+
+    def setUp(self):
+        super().setUp()
+        conn = db_manager.get_db_connection()
+        self.add_account()
+        for account_id in range(1, 6):
+            for i in range(20):
+                db_manager.insert_message(f"message{i}", account_id)
+        self.statements = []
+        conn.set_trace_callback(self.statements.append)
+
+    def tearDown(self):
+        db_manager.get_db_connection().set_trace_callback(None)
+        super().tearDown()
+
+    def assert_uses_index(self, func, *args):
+        self.statements.clear()
+        func(*args)
+        conn = db_manager.get_db_connection()
+        conn.set_trace_callback(None)
+        queries = [sql for sql in self.statements
+                   if sql.lstrip().split()[0].upper() in ('SELECT', 'UPDATE', 'DELETE')]
+        self.assertTrue(queries, f"{func.__name__} がクエリを実行していません")
+        for sql in queries:
+            plan = [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            full_scans = [detail for detail in plan if (detail.startswith('SCAN') and 'USING' not in detail)
+                          or detail.startswith('USE TEMP B-TREE FOR ORDER BY')]
+            self.assertEqual(full_scans, [], f"{func.__name__}: {sql}\n{plan}")
+        conn.set_trace_callback(self.statements.append)
+
+    def test_hot_queries_use_indexes(self):
+        self.assert_uses_index(db_manager.get_account, 1)
+        self.assert_uses_index(db_manager.get_settings, 1)
+        self.assert_uses_index(db_manager.get_auto_post_status, 1)
+        self.assert_uses_index(db_manager.get_message, 1)
+        self.assert_uses_index(db_manager.claim_message, 1, 60)
+        self.assert_uses_index(db_manager.ack_message, 1)
+        self.assert_uses_index(db_manager.release_message, 1)
+        self.assert_uses_index(db_manager.get_messages, 1)
+        self.assert_uses_index(db_manager.get_tweets, 1)
+        self.assert_uses_index(db_manager.get_messages, 1, 5, 10)
+        self.assert_uses_index(db_manager.get_latest_change_seq, 1)
+        self.assert_uses_index(db_manager.get_message_changes, 1, 0, 10)
+        self.assert_uses_index(db_manager.get_change_events, 1, 0, 10)
+        self.assert_uses_index(db_manager.get_media_upload, 'hash', '111')
+        self.assert_uses_index(db_manager.get_media_variant, 'img/a.jpg', 0, 0)
+        self.assert_uses_index(db_manager.get_account_stats, 1)
+        self.assert_uses_index(reset_account_messages, 1)
+        self.assert_uses_index(db_manager.update_message, 'edited', 1, 1)
+        self.assert_uses_index(db_manager.delete_message, 2, 1)
+        self.assert_uses_index(insert_messages, [['message3'], ['new message']], 1)
+        self.assert_uses_index(db_manager.reset_messages, 1)
+        self.assert_uses_index(db_manager.set_interval, 'interval', 3, [], 1)
+        self.assert_uses_index(db_manager.copy_messages, 2, [3, 4])
+        self.assert_uses_index(db_manager.delete_all_messages, 1)
+
+if __name__ == '__main__':
+    unittest.main()
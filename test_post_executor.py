@@ -0,0 +1,53 @@
+import threading
+import unittest
+from post_executor import PostExecutor
+
+class TestPostExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = []
+        self.started_lock = threading.Lock()
+        self.executor = PostExecutor(self.post, max_workers=4, max_inflight=2)
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def post(self, account_id):
+        with self.started_lock:
+            self.started.append(account_id)
+        self.release.wait(2)
+
+    def test_different_accounts_run_in_parallel(self):
+        futures = [self.executor.submit(account_id) for account_id in (1, 2, 3)]
+        for _ in range(100):
+            if len(self.started) == 3:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(sorted(self.started), [1, 2, 3])
+
+        self.release.set()
+        for future in futures:
+            future.result(2)
+        self.assertEqual(self.executor.get_metrics(), {'queued': 3, 'skipped': 0, 'completed': 3, 'pending': 0})
+
+    def test_same_account_is_skipped_while_pending(self):
+        first = self.executor.submit(1)
+        self.assertIsNone(self.executor.submit(1))
+        self.release.set()
+        first.result(2)
+
+        metrics = self.executor.get_metrics()
+        self.assertEqual(metrics['queued'], 1)
+        self.assertEqual(metrics['skipped'], 1)
+
+        # 完了後は再びキューに追加できる
+        self.assertIsNotNone(self.executor.submit(1))
+
+    def test_account_lock_is_shared_per_account(self):
+        self.assertIs(self.executor.account_lock(1), self.executor.account_lock(1))
+        self.assertIsNot(self.executor.account_lock(1), self.executor.account_lock(2))
+
+if __name__ == '__main__':
+    unittest.main()
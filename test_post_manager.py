@@ -0,0 +1,256 @@
+import threading
+import time
+from datetime import datetime
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+import requests
+import tweepy
+import db_manager
+import post_manager
+from metrics import posts_total
+from rate_limiter import RateLimiter
+from history_manager import HistoryWriter, get_post_history
+from async_poster import AsyncPoster, aiohttp
+from mock_twitter_api import MockTwitterServer
+from scheduler import PostScheduler, STARTUP_STAGGER_SECONDS
+import post_setting_manager
+from post_setting_manager import check_and_start_auto_post
+from test_helpers import TempDatabaseTestCase
+
+class FakeClient:
+    """create_tweet の結果を順番に返す（例外なら送出する）テスト用クライアント"""
+
+    consumer_key = 'key'
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.posted = []
+        self.media_ids = []
+
+    def create_tweet(self, text, media_ids=None):
+        self.posted.append(text)
+        self.media_ids.append(media_ids)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return SimpleNamespace(headers={}, data={'id': str(1000 + len(self.posted))})
+
+
+def api_error(error_class, status_code, reason, body):
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response._content = body
+    return error_class(response)
+
+def duplicate_error():
+    return api_error(tweepy.Forbidden, 403, 'Forbidden',
+                     b'{"detail": "You are not allowed to create a Tweet with duplicate content."}')
+
+
+class TestPostMessage(TempDatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.account_id = self.add_account()
+        for message in ('first', 'second', 'third'):
+            db_manager.insert_message(message, self.account_id)
+        self.clients = {}
+        self.history = HistoryWriter()
+        self.patches = [
+            patch.object(post_manager, 'post_history', self.history),
+            patch.object(post_manager, 'get_client', self.clients.get),
+            patch.object(post_manager, 'rate_limiter', RateLimiter()),
+            patch.object(post_manager, 'scheduler', SimpleNamespace(defer=lambda account_id, delay: True)),
+            patch.object(post_manager, 'leader', SimpleNamespace(is_leader=True, term=1)),
+            patch.dict(post_setting_manager._synced_state, {'term': None, 'versions': None}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        self.history.stop()
+        for p in self.patches:
+            p.stop()
+        post_manager.last_post_time.pop(self.account_id, None)
+        post_manager.post_disable_until.pop(self.account_id, None)
+        super().tearDown()
+
+    def remaining(self):
+        return db_manager.get_account_stats(self.account_id)['remaining']
+
+    def test_network_error_keeps_message_for_retry(self):
+        client = self.clients[self.account_id] = FakeClient([requests.ConnectionError('reset')])
+        post_manager.post_message(self.account_id)
+
+        self.assertEqual(len(client.posted), 1)
+        self.assertEqual(self.remaining(), 3)  # 失われていない
+        row = db_manager.get_db_connection().execute(
+            """
+            SELECT t.claimed_until, t.next_attempt_at, t.attempts
+            FROM tweets t JOIN message_contents c ON c.id = t.content_id WHERE c.body = ?
+            """, (client.posted[0],)).fetchone()
+        self.assertIsNone(row['claimed_until'])
+        self.assertIsNotNone(row['next_attempt_at'])
+        self.assertEqual(row['attempts'], 1)
+
+    def failed_row(self, message):
+        return db_manager.get_db_connection().execute(
+            """
+            SELECT t.id, t.is_deleted, t.failed_at, t.last_error
+            FROM tweets t JOIN message_contents c ON c.id = t.content_id WHERE c.body = ?
+            """, (message,)).fetchone()
+
+    def test_rejected_message_is_not_retried_until_edited(self):
+        error = api_error(tweepy.BadRequest, 400, 'Bad Request', b'{"detail": "Tweet text is too long."}')
+        client = self.clients[self.account_id] = FakeClient([error])
+        post_manager.post_message(self.account_id)
+
+        row = self.failed_row(client.posted[0])
+        self.assertEqual(row['is_deleted'], 1)
+        self.assertIn('400', row['last_error'])
+        self.assertEqual(self.remaining(), 2)
+        self.history.flush()
+        self.assertEqual(get_post_history(self.account_id)[0]['outcome'], 'rejected')
+
+        # 次のサイクルでも投稿しない
+        db_manager.reset_messages(self.account_id)
+        self.assertEqual(self.remaining(), 2)
+        self.assertEqual(self.failed_row(client.posted[0])['is_deleted'], 1)
+
+        db_manager.update_message('short', row['id'], self.account_id)
+        self.assertEqual(self.remaining(), 3)
+        self.assertIsNone(self.failed_row('short')['failed_at'])
+
+    def test_message_is_given_up_after_max_attempts(self):
+        db_manager.get_db_connection().execute(f"UPDATE tweets SET attempts = {post_manager.MAX_POST_ATTEMPTS - 1}")
+        db_manager.get_db_connection().commit()
+        client = self.clients[self.account_id] = FakeClient([requests.ConnectionError('reset')])
+        post_manager.post_message(self.account_id)
+
+        self.assertIn('reset', self.failed_row(client.posted[0])['last_error'])
+        self.assertEqual(self.remaining(), 2)
+
+    @unittest.skipIf(aiohttp is None, "aiohttp がインストールされていません")
+    def test_async_backend_does_not_block_worker(self):
+        server = MockTwitterServer(latency=0.2).start()
+        poster = AsyncPoster(base_url=server.base_url, timeout=5)
+        inflight = threading.BoundedSemaphore(1)
+        try:
+            with patch.object(post_manager, 'async_poster', poster), \
+                    patch.object(post_manager.post_executor, 'inflight', inflight):
+                post_manager.post_message(self.account_id)
+                # 応答を待たずに戻り、完了するまで同じアカウントの投稿は重ならない
+                account_lock = post_manager.post_executor.account_lock(self.account_id)
+                self.assertEqual(self.remaining(), 3)
+                self.assertFalse(inflight.acquire(blocking=False))  # 応答待ちの投稿も同時実行数に数える
+                post_manager.post_message(self.account_id)
+                self.assertTrue(account_lock.acquire(timeout=5))
+                account_lock.release()
+                self.assertTrue(inflight.acquire(blocking=False))
+                inflight.release()
+        finally:
+            poster.close()
+            server.stop()
+
+        self.assertEqual(server.api.requests, 1)
+        self.assertEqual(self.remaining(), 2)
+        self.history.flush()
+        self.assertEqual([(row['outcome'], row['tweet_id']) for row in get_post_history(self.account_id)], [('posted', '1')])
+
+    def test_attaches_uploaded_media(self):
+        db_manager.delete_all_messages(self.account_id)
+        db_manager.insert_message('with picture', self.account_id, 'img/picture.jpg')
+        client = self.clients[self.account_id] = FakeClient([None])
+        with patch.object(post_manager, 'get_media_ids', lambda account_id, path: [f"media:{path}"]):
+            post_manager.post_message(self.account_id)
+        self.assertEqual(client.media_ids, [['media:img/picture.jpg']])
+
+    def test_duplicates_are_skipped_within_one_run(self):
+        client = self.clients[self.account_id] = FakeClient([duplicate_error(), duplicate_error(), None])
+        duplicates = posts_total.get(result='duplicate')
+        post_manager.post_message(self.account_id)
+
+        self.assertEqual(len(set(client.posted)), 3)
+        self.assertEqual(posts_total.get(result='duplicate'), duplicates + 2)
+        self.assertEqual(self.remaining(), 0)
+        self.assertIn(self.account_id, post_manager.last_post_time)
+
+        self.history.flush()
+        history = get_post_history(self.account_id)
+        self.assertEqual([(row['outcome'], row['tweet_id'], row['message']) for row in history],
+                         [('posted', '1003', client.posted[2]), ('duplicate', None, client.posted[1]),
+                          ('duplicate', None, client.posted[0])])
+
+    def test_sync_schedules_follows_database(self):
+        scheduler = PostScheduler(lambda account_id: None)
+        with patch.object(post_manager, 'scheduler', scheduler):
+            db_manager.update_auto_post_status(self.account_id, True)
+            db_manager.set_interval('interval', 5, [], self.account_id)
+            check_and_start_auto_post()
+            self.assertEqual(scheduler.get_settings(self.account_id)['interval'], 5)
+
+            # 他のプロセスで自動投稿が停止された場合も反映される
+            db_manager.update_auto_post_status(self.account_id, False)
+            check_and_start_auto_post()
+            self.assertFalse(scheduler.is_scheduled(self.account_id))
+            scheduler.stop()
+
+    def test_startup_uses_saved_fire_times_and_staggers_due_accounts(self):
+        for name in ('second', 'third'):
+            self.add_account(name)
+        account_ids = db_manager.get_all_account_ids()
+        for account_id in account_ids:
+            db_manager.update_auto_post_status(account_id, True)
+        now = time.time()
+        db_manager.save_next_fire_times([(account_ids[0], now + 1000), (account_ids[2], now - 10)])
+
+        # スレッドを動かさないので、すぐ投稿するアカウントも予定のまま残る
+        scheduler = PostScheduler(lambda account_id: None, on_fire_times=db_manager.save_next_fire_times)
+        with patch.object(post_manager, 'scheduler', scheduler), patch.object(scheduler, '_ensure_thread'):
+            check_and_start_auto_post()
+            self.assertEqual(scheduler.next_fire_time(account_ids[0]), now + 1000)
+            due = [scheduler.next_fire_time(account_id) for account_id in account_ids[1:]]
+            self.assertEqual(len(set(due)), 2)
+            self.assertTrue(all(now <= fire_at <= now + 1 + STARTUP_STAGGER_SECONDS for fire_at in due))
+            scheduler.stop()
+
+        saved = dict(db_manager.get_db_connection().execute("SELECT account_id, next_fire_at FROM schedule_state").fetchall())
+        self.assertEqual([saved[account_id] for account_id in account_ids], [now + 1000] + due)
+
+    def saved_fire_times(self):
+        return dict(db_manager.get_db_connection().execute("SELECT account_id, next_fire_at FROM schedule_state").fetchall())
+
+    def test_changing_settings_discards_saved_fire_time(self):
+        db_manager.update_auto_post_status(self.account_id, True)
+        db_manager.save_next_fire_times([(self.account_id, time.time() + 1000)])
+        db_manager.set_interval('specific', None, ['09:00'], self.account_id)
+        self.assertNotIn(self.account_id, self.saved_fire_times())
+
+    def test_missed_specific_time_waits_for_next_slot_unless_catching_up(self):
+        db_manager.update_auto_post_status(self.account_id, True)
+        db_manager.set_interval('specific', None, ['09:00'], self.account_id)
+        now = time.time()
+        for catch_up in (False, True):
+            db_manager.save_next_fire_times([(self.account_id, now - 3600)])
+            post_setting_manager._synced_state.update(term=None, versions=None)
+            scheduled = []
+            with patch.object(post_setting_manager, 'schedule_auto_posts', scheduled.extend), \
+                    patch.object(post_setting_manager, 'get_scheduled_account_ids', list), \
+                    patch.object(post_setting_manager, 'CATCH_UP_MISSED_POSTS', catch_up):
+                check_and_start_auto_post()
+            fire_at = scheduled[0][2]
+            if catch_up:
+                self.assertLessEqual(fire_at, now + 1 + STARTUP_STAGGER_SECONDS)
+            else:
+                self.assertGreater(fire_at, now)
+                self.assertEqual(datetime.fromtimestamp(fire_at).strftime('%H:%M'), '09:00')
+
+    def test_retry_delay_backs_off_up_to_limit(self):
+        self.assertEqual(post_manager.get_retry_delay(1), post_manager.RETRY_BACKOFF_SECONDS)
+        self.assertEqual(post_manager.get_retry_delay(2), post_manager.RETRY_BACKOFF_SECONDS * 2)
+        self.assertEqual(post_manager.get_retry_delay(50), post_manager.MAX_RETRY_BACKOFF_SECONDS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from rate_limiter import RateLimiter
+
+class FakeClock:
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = RateLimiter(account_limit=2, app_limit=3, window=100, clock=self.clock)
+
+    def test_account_and_app_buckets(self):
+        self.assertEqual(self.limiter.acquire(1, 'app'), 0)
+        self.assertEqual(self.limiter.acquire(1, 'app'), 0)
+        self.assertAlmostEqual(self.limiter.acquire(1, 'app'), 50)  # 100秒で2回 -> 50秒で1回分補充
+
+        # 同じアプリの別アカウントはアプリの上限（3回）まで
+        self.assertEqual(self.limiter.acquire(2, 'app'), 0)
+        self.assertGreater(self.limiter.acquire(2, 'app'), 0)
+        self.assertEqual(self.limiter.acquire(3, 'other'), 0)
+
+        self.clock.now += 50
+        self.assertEqual(self.limiter.acquire(1, 'app'), 0)
+        self.assertEqual(self.limiter.get_status()['deferred'], 2)
+
+    def test_headers_replace_estimate(self):
+        now = int(self.clock.now)
+        self.limiter.update_from_headers(1, 'app', {
+            'X-Rate-Limit-Limit': '200', 'X-Rate-Limit-Remaining': '1', 'X-Rate-Limit-Reset': str(now + 900),
+            'x-app-limit-24hour-limit': '1000', 'x-app-limit-24hour-remaining': '999',
+            'x-app-limit-24hour-reset': str(now + 86400),
+        })
+        status = self.limiter.get_status()['accounts'][1]
+        self.assertEqual((status['capacity'], status['tokens']), (200, 1))
+        self.assertEqual((status['app']['capacity'], status['app']['tokens']), (1000, 999))
+
+        self.assertEqual(self.limiter.acquire(1, 'app'), 0)
+        self.assertEqual(self.limiter.acquire(1, 'app'), 900)  # リセット時刻までは補充しない
+        self.clock.now += 900
+        self.assertEqual(self.limiter.acquire(1, 'app'), 0)
+        self.assertEqual(self.limiter.get_status()['accounts'][1]['tokens'], 199)
+
+    def test_rate_limited_uses_retry_after(self):
+        self.assertEqual(self.limiter.record_rate_limited(1, 'app', {'retry-after': '120'}), 120)
+        self.assertEqual(self.limiter.acquire(1, 'app'), 120)
+        self.assertEqual(self.limiter.acquire(2, 'app'), 0)
+        self.assertEqual(self.limiter.get_status()['rate_limited'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
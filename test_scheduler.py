@@ -0,0 +1,80 @@
+import threading
+import time
+import unittest
+from datetime import datetime
+from scheduler import PostScheduler, get_next_fire_time, INTERVAL_IN_SECONDS
+
+class TestGetNextFireTime(unittest.TestCase):
+
+    def test_interval_mode(self):
+        now = 1_000_000.0
+        settings = {'interval_type': 'interval', 'interval': 2, 'specific_times': []}
+        self.assertEqual(get_next_fire_time(settings, now=now, first=True), now)
+        self.assertEqual(get_next_fire_time(settings, now=now), now + 2 * INTERVAL_IN_SECONDS)
+
+    def test_specific_mode_picks_next_time_and_wraps_to_tomorrow(self):
+        now = datetime(2025, 1, 11, 12, 30).timestamp()
+        settings = {'interval_type': 'specific', 'interval': None, 'specific_times': ['09:00', '13:15']}
+        self.assertEqual(get_next_fire_time(settings, now=now), datetime(2025, 1, 11, 13, 15).timestamp())
+
+        now = datetime(2025, 1, 11, 13, 15).timestamp()
+        self.assertEqual(get_next_fire_time(settings, now=now), datetime(2025, 1, 12, 9, 0).timestamp())
+
+    def test_specific_mode_without_times(self):
+        settings = {'interval_type': 'specific', 'interval': None, 'specific_times': []}
+        self.assertIsNone(get_next_fire_time(settings, now=0))
+
+
+class TestPostScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.fired = []
+        self.fired_event = threading.Event()
+        self.scheduler = PostScheduler(self.dispatch)
+        self.account_settings = {
+            1: {'interval_type': 'interval', 'interval': 1, 'specific_times': []},
+            2: {'interval_type': 'interval', 'interval': 1, 'specific_times': []},
+        }
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def dispatch(self, account_id):
+        self.fired.append(account_id)
+        if len(self.fired) >= 2:
+            self.fired_event.set()
+
+    def test_fires_in_time_order_and_reschedules(self):
+        now = time.time()
+        self.scheduler.schedule(2, self.account_settings[2], fire_at=now + 0.05)
+        self.scheduler.schedule(1, self.account_settings[1], fire_at=now)
+
+        self.assertTrue(self.fired_event.wait(2))
+        self.assertEqual(self.fired, [1, 2])
+        # 投稿後は次のインターバルで再登録される
+        self.assertGreater(self.scheduler.next_fire_time(1), now + INTERVAL_IN_SECONDS - 1)
+
+    def test_reschedule_and_cancel_drop_stale_entries(self):
+        self.scheduler.schedule(1, self.account_settings[1], fire_at=time.time() + 0.05)
+        self.scheduler.schedule(1, self.account_settings[1], fire_at=time.time() + 3600)
+        self.scheduler.schedule(2, self.account_settings[2], fire_at=time.time() + 0.05)
+        self.assertTrue(self.scheduler.cancel(2))
+
+        time.sleep(0.2)
+        self.assertEqual(self.fired, [])
+        self.assertTrue(self.scheduler.is_scheduled(1))
+        self.assertFalse(self.scheduler.is_scheduled(2))
+
+    def test_defer_fires_once_without_moving_regular_schedule(self):
+        self.scheduler.schedule(1, self.account_settings[1], fire_at=time.time() + 3600)
+        self.assertTrue(self.scheduler.defer(1, 0.05))
+        self.assertFalse(self.scheduler.defer(1, 0.05))  # 再実行待ちは1件だけ
+
+        time.sleep(0.2)
+        self.assertEqual(self.fired, [1])
+        self.assertGreater(self.scheduler.next_fire_time(1), time.time() + 3000)
+        self.assertTrue(self.scheduler.defer(1, 3600))
+        self.assertFalse(self.scheduler.defer(2, 1))  # 予定のないアカウントは延期しない
+
+if __name__ == '__main__':
+    unittest.main()